@@ -0,0 +1,392 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+from dataclasses import asdict
+from typing import Generic, Optional, TypeVar
+
+import aiohttp
+
+from async_portals import AsyncReportDownloader, AsyncSwap, AsyncWM
+from checkpoint import CheckpointJournal
+from filter_dates import FilterDates
+from helper import write_bytes_to_file
+from loggerfactory import LoggerFactory
+from flows import plan_lookups, plan_run
+from order_validation import (
+    PartialReports,
+    ValidationResults,
+    collect_results,
+    finish_run,
+    get_memory_budget,
+    get_run_budget,
+    add_lookup_progress,
+    get_run_telemetry,
+    prioritize_run_lookups,
+    select_flow_orders,
+)
+from order_validation_config import (
+    CMS_CONCURRENCY,
+    PARTIAL_REPORT_SECONDS,
+    REPORTS_INFO,
+    RUN_FOR,
+    SWAP_CONCURRENCY,
+    WM_BULK_MODE,
+    WM_BULK_PAGE_SIZE,
+    WM_BULK_PREFIX_LENGTH,
+    WM_CONCURRENCY,
+)
+from profiling import profiler
+from run_budget import RunBudget
+from request_log import get_request_log
+from reports import Report, ReportCache, ReportType, excel_buffer_to_dataframe, get_report_title, report_cache
+from sharding import Shard
+from telemetry import RunTelemetry
+from wm_portal import WMOrder, group_by_prefix, match_wm_orders
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+T = TypeVar('T')
+
+
+class AsyncLookupTable(Generic[T]):
+    """
+    asyncio counterpart of :obj:`lookups.LookupTable`.
+
+    A key is fetched at most once and tasks asking for a key that is being
+    fetched await the same future. Failed lookups are not stored.
+    """
+
+    def __init__(self):
+        self._results: dict[Hashable, T] = {}
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+        self.fetched = 0
+        self.reused = 0
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Optional[T]]]) -> Optional[T]:
+        if key in self._results:
+            self.reused += 1
+            return self._results[key]
+        if key in self._in_flight:
+            self.reused += 1
+            return await asyncio.shield(self._in_flight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        self.fetched += 1
+        try:
+            result = await fetch()
+        except BaseException as exception:
+            del self._in_flight[key]
+            future.set_exception(exception)
+            # Mark the exception as retrieved when no other task is waiting for it.
+            future.exception()
+            raise
+        del self._in_flight[key]
+        if result is not None:
+            self._results[key] = result
+        future.set_result(result)
+        return result
+
+    def put(self, key: Hashable, result: T):
+        """Stores a result fetched by other means, e.g. a bulk query."""
+        self._results[key] = result
+
+    def __contains__(self, key: Hashable):
+        return key in self._results
+
+
+class AsyncOrderLookups:
+    """
+    asyncio counterpart of :obj:`lookups.OrderLookups`, also downloading the cms reports.
+
+    Each backend has its own connection pool and semaphore sized by
+    CMS_CONCURRENCY, SWAP_CONCURRENCY and WM_CONCURRENCY. The portal clients
+    are only logged in on the first lookup that needs them. Lookups and
+    retries are limited by 'budget' like the blocking engine.
+    """
+
+    def __init__(self, journal: CheckpointJournal, telemetry: Optional[RunTelemetry] = None,
+                 budget: Optional[RunBudget] = None):
+        self.journal = journal
+        self.telemetry = telemetry or RunTelemetry(display=False)
+        self.budget = budget or RunBudget()
+        self.unverified_wm_orders: set[str] = set()
+        self.swap_results: AsyncLookupTable[int] = AsyncLookupTable()
+        self.wm_results: AsyncLookupTable[WMOrder] = AsyncLookupTable()
+        self.reports: AsyncLookupTable[Report] = AsyncLookupTable()
+        self._swap: Optional[AsyncSwap] = None
+        self._wm: Optional[AsyncWM] = None
+        self._downloader: Optional[AsyncReportDownloader] = None
+        self._swap_lock = asyncio.Lock()
+        self._wm_lock = asyncio.Lock()
+
+    async def swap(self) -> AsyncSwap:
+        async with self._swap_lock:
+            if self._swap is None:
+                self._swap = await AsyncSwap.create(SWAP_CONCURRENCY, on_retry=lambda: self._retry('swap'))
+        return self._swap
+
+    async def wm(self) -> AsyncWM:
+        async with self._wm_lock:
+            if self._wm is None:
+                self._wm = await AsyncWM.create(WM_CONCURRENCY, on_retry=lambda: self._retry('wm'))
+        return self._wm
+
+    def _retry(self, backend: str) -> bool:
+        """Returns whether a request of the backend may be retried and counts the retry."""
+        if not self.budget.allow_retry():
+            return False
+        self.telemetry.retry(backend)
+        return True
+
+    @property
+    def downloader(self) -> AsyncReportDownloader:
+        if self._downloader is None:
+            self._downloader = AsyncReportDownloader(CMS_CONCURRENCY)
+        return self._downloader
+
+    async def report(self, report_type: ReportType, filter_dates: FilterDates, save_to_disk: bool) -> Report:
+        """Returns a view of the report, downloading each distinct report once."""
+        key = ReportCache.key(report_type, filter_dates)
+
+        async def fetch():
+            cached = report_cache.get(key)
+            if cached is not None:
+                logger.info('Report found in cache!')
+                return cached
+            with profiler.span('cms download'):
+                content = await self.downloader.download(report_type, filter_dates, get_report_title(report_type))
+            with profiler.span('excel parse'):
+                dataframe = await asyncio.to_thread(excel_buffer_to_dataframe, content)
+            report = Report(report_type, filter_dates, save_to_disk, dataframe=dataframe,
+                            memory_budget=get_memory_budget())
+            if save_to_disk:
+                write_bytes_to_file(content, report.get_file_name())
+            report_cache.put(key, report)
+            return report
+
+        report = await self.reports.get_or_fetch(key, fetch)
+        return report.view()
+
+    async def swap_total_records(self, swap_order_id: str) -> Optional[int]:
+        """Returns how many records swap has for the order or None if the lookup failed."""
+        async def fetch():
+            total_records = self.journal.get('swap', swap_order_id)
+            if total_records is not None:
+                return total_records
+            if self.budget.expired():
+                return None
+            self.budget.request()
+            swap = await self.swap()
+            with profiler.span('swap request'), self.telemetry.request('swap') as outcome:
+                total_records = await swap.get_order(swap_order_id)
+                outcome.ok = total_records is not None
+            if total_records is not None:
+                self.journal.record('swap', swap_order_id, total_records)
+            return total_records
+        return await self.swap_results.get_or_fetch(swap_order_id, fetch)
+
+    async def wm_order(self, order_id: str) -> Optional[WMOrder]:
+        """Returns the order from WM or None if it is not in WM or could not be fetched."""
+        async def fetch():
+            checked = self.journal.get('wm', order_id)
+            if checked is not None:
+                return WMOrder(**checked)
+            if self.budget.expired():
+                self.unverified_wm_orders.add(order_id)
+                return None
+            self.budget.request()
+            wm = await self.wm()
+            try:
+                with profiler.span('wm request'), self.telemetry.request('wm') as outcome:
+                    order = await wm.fetch(order_id)
+                    outcome.ok = order is not None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                logger.error(f'Could not get details for {order_id}: {error!r}')
+                self.unverified_wm_orders.add(order_id)
+                return None
+            self.unverified_wm_orders.discard(order_id)
+            if order is not None:
+                self.journal.record('wm', order_id, asdict(order))
+            return order
+        return await self.wm_results.get_or_fetch(order_id, fetch)
+
+    async def prefetch_wm_orders(self, order_ids: Iterable[str], prefix_length: int, page_size: int) -> int:
+        """
+        asyncio counterpart of :meth:`lookups.OrderLookups.prefetch_wm_orders`, searching prefixes concurrently.
+        A failed search leaves its orders unmatched without stopping the other searches.
+        """
+        pending = [
+            order_id for order_id in dict.fromkeys(order_ids)
+            if order_id not in self.wm_results and self.journal.get('wm', order_id) is None
+        ]
+        groups = group_by_prefix(pending, prefix_length)
+        wm = await self.wm()
+        async def search(prefix: str) -> list[WMOrder]:
+            if self.budget.expired():
+                return []
+            self.budget.request()
+            try:
+                with self.telemetry.request('wm'):
+                    return await wm.fetch_bulk(prefix, page_size=page_size)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                logger.warning(f"Bulk WM search of '{prefix}' failed, fetching its {len(groups[prefix])} orders one "
+                               f"by one: {error!r}")
+                return []
+
+        with profiler.span('wm bulk search'):
+            pages = await asyncio.gather(*(search(prefix) for prefix in groups))
+        matched_count = 0
+        for group, rows in zip(groups.values(), pages):
+            for order_id, order in match_wm_orders(group, rows).items():
+                self.wm_results.put(order_id, order)
+                self.journal.record('wm', order_id, asdict(order))
+                matched_count += 1
+        logger.info(f"Bulk WM: matched {matched_count} of {len(pending)} orders with {len(groups)} searches.")
+        return matched_count
+
+    def log_summary(self):
+        logger.info(
+            f"Swap lookups: {self.swap_results.fetched} requested, {self.swap_results.reused} reused. "
+            f"WM lookups: {self.wm_results.fetched} requested, {self.wm_results.reused} reused."
+        )
+
+    async def aclose(self):
+        for client in (self._swap, self._wm, self._downloader):
+            if client is not None:
+                await client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+async def run_workers(items: Iterable[T], workers: int, handle: Callable[[T], Awaitable[None]]):
+    """
+    Calls 'handle' for every item from 'workers' tasks taking the items in
+    order from one queue, so a run of 100k orders keeps 'workers' tasks
+    instead of one per order.
+    """
+    queue: asyncio.Queue[T] = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+
+    async def work():
+        while not queue.empty():
+            await handle(queue.get_nowait())
+    await asyncio.gather(*(work() for _ in range(min(workers, queue.qsize()))))
+
+
+async def lookup_swap_orders_async(lookups: AsyncOrderLookups, swap_ids: Iterable[str], pbar,
+                                   total_records: Optional[dict[str, int]] = None) -> dict[str, int]:
+    """
+    asyncio counterpart of :func:`order_validation.lookup_swap_orders`, checking
+    SWAP_CONCURRENCY orders at a time in the order of 'swap_ids'.
+    """
+    total_records = {} if total_records is None else total_records
+
+    async def check(swap_order_id: str):
+        total = await lookups.swap_total_records(swap_order_id)
+        total_records[swap_order_id] = -1 if total is None else total
+        pbar.update(force=True)
+    await run_workers(swap_ids, SWAP_CONCURRENCY, check)
+    return total_records
+
+
+async def lookup_wm_orders_async(lookups: AsyncOrderLookups, order_ids: Iterable[str], pbar,
+                                 orders: Optional[dict[str, Optional[WMOrder]]] = None) -> dict[str, Optional[WMOrder]]:
+    """
+    asyncio counterpart of :func:`order_validation.lookup_wm_orders`, fetching
+    WM_CONCURRENCY orders at a time in the order of 'order_ids'.
+    """
+    orders = {} if orders is None else orders
+
+    async def check(order_id: str):
+        orders[order_id] = await lookups.wm_order(order_id)
+        pbar.update(force=True)
+    await run_workers(order_ids, WM_CONCURRENCY, check)
+    return orders
+
+
+async def write_partial_reports(partial: PartialReports, done: asyncio.Event):
+    """
+    Writes the partial report every 'partial.every' seconds until 'done' is set.
+    The report is built and written in a worker thread from a snapshot of the
+    lookups, so the event loop keeps serving the requests in flight.
+    """
+    while not done.is_set():
+        try:
+            await asyncio.wait_for(done.wait(), partial.every)
+        except asyncio.TimeoutError:
+            await asyncio.to_thread(partial.write, *partial.snapshot())
+
+
+async def async_order_processing(filter_dates: FilterDates, save_fetched_reports: bool, resume: bool = False,
+                                 shard: Optional[Shard] = None):
+    """
+    asyncio counterpart of :func:`order_validation.order_processing`.
+
+    Every distinct report is downloaded concurrently and every flow checks its
+    orders concurrently on one event loop, bounded by the per-backend
+    semaphores. Results and reports are the same as the blocking engine.
+    """
+    journal_suffix = f'-{shard.file_name()}' if shard else ''
+    with profiler.span('run'):
+        with CheckpointJournal.for_run(filter_dates, resume=resume, suffix=journal_suffix) as journal, \
+                get_run_telemetry(filter_dates, journal_suffix) as telemetry:
+            budget = get_run_budget()
+            async with AsyncOrderLookups(journal, telemetry, budget) as lookups:
+                results = await async_validate_reports(filter_dates, save_fetched_reports, lookups, shard)
+            lookups.log_summary()
+            budget.log_summary()
+            get_request_log().flush()
+        finish_run(results, filter_dates, shard)
+
+
+async def async_validate_reports(filter_dates: FilterDates, save_fetched_reports: bool, lookups: AsyncOrderLookups,
+                                 shard: Optional[Shard] = None) -> ValidationResults:
+    """
+    asyncio counterpart of :func:`order_validation.validate_reports`, downloading
+    the reports and looking up both backends concurrently.
+    """
+    plan = plan_run(RUN_FOR, REPORTS_INFO)
+    with profiler.span('get reports'):
+        reports = await asyncio.gather(*(
+            lookups.report(report_type, filter_dates, save_fetched_reports)
+            for report_type in plan.downloads.values()
+        ))
+    with profiler.span('select orders'):
+        flows = select_flow_orders(plan, dict(zip(plan.downloads, reports)), shard)
+    lookup_ids = prioritize_run_lookups(flows, plan_lookups(flows))
+
+    swap_total_records, wm_orders = {}, {}
+    partial = PartialReports(flows, swap_total_records, wm_orders, lookups.unverified_wm_orders, PARTIAL_REPORT_SECONDS)
+    pbars = add_lookup_progress(lookups.telemetry, lookup_ids)
+
+    async def check_swap():
+        if not lookup_ids['swap']:
+            return
+        with profiler.span('swap lookups'):
+            await lookup_swap_orders_async(lookups, lookup_ids['swap'], pbars['swap'], swap_total_records)
+
+    async def check_wm():
+        if not lookup_ids['wm']:
+            return
+        if WM_BULK_MODE:
+            await lookups.prefetch_wm_orders(lookup_ids['wm'], WM_BULK_PREFIX_LENGTH, WM_BULK_PAGE_SIZE)
+        with profiler.span('wm lookups'):
+            await lookup_wm_orders_async(lookups, lookup_ids['wm'], pbars['wm'], wm_orders)
+
+    done = asyncio.Event()
+    writer = asyncio.create_task(write_partial_reports(partial, done)) if PARTIAL_REPORT_SECONDS is not None else None
+    try:
+        await asyncio.gather(check_swap(), check_wm())
+    finally:
+        done.set()
+        if writer is not None:
+            # Waits for a write in progress, so the partial report it leaves is discarded below.
+            await writer
+    partial.discard()
+    return collect_results(flows, swap_total_records, wm_orders, lookups.unverified_wm_orders)
@@ -0,0 +1,312 @@
+import asyncio
+from collections.abc import Callable
+from contextlib import nullcontext
+import json
+import os
+from os import getenv
+from typing import Optional
+
+import aiohttp
+from requests.compat import urljoin
+from urllib3 import Retry
+from yarl import URL
+
+from filter_dates import FilterDates
+from helper import current_milli_time, write_to_file
+from http_sessions import RETRY_STATUSES
+from loggerfactory import LoggerFactory
+from order_validation_config import POOL_KEEPALIVE_SECONDS
+from reports import CMS_BACKOFF_FACTOR, CMS_RETRIES, ReportDownloader, ReportType
+from request_log import get_request_log
+from swap_portal import (
+    AJAX_HANDLER_URL,
+    DELIVERY_HEADERS,
+    DELIVERY_SEARCH_PARAMS,
+    INITIALIZE_HEADERS,
+    LOGIN_URL,
+    SESSION_HEADERS as SWAP_SESSION_HEADERS,
+    SHOW_DATA_URL,
+    SWAP_BASE_URL,
+    timeout_seconds,
+)
+from wm_portal import (
+    BASE_URL as WM_BASE_URL,
+    INITIALIZATION_ENDPOINT,
+    LOGIN_ENDPOINT,
+    LOGIN_HEADERS as WM_LOGIN_HEADERS,
+    ORDER_DETAILS_ENDPOINT,
+    ORDER_DETAILS_FORM,
+    ORDER_DETAILS_HEADERS,
+    ORDER_DETAILS_PARAMS,
+    SESSION_HEADERS as WM_SESSION_HEADERS,
+    WMOrder,
+    order_details_page_form,
+    parse_form_token,
+    parse_last_order_row,
+    parse_order_rows,
+)
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+def pooled_connector(concurrency: int) -> aiohttp.TCPConnector:
+    """Returns a connector keeping one keep-alive connection per concurrent request."""
+    return aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency, keepalive_timeout=POOL_KEEPALIVE_SECONDS)
+
+
+def backoff_seconds(retry: int, backoff_factor: float) -> float:
+    """
+    Returns the wait before the 'retry'-th retry, from 1, like
+    :meth:`urllib3.Retry.get_backoff_time`: none before the first, then
+    backoff_factor * 2 ** (retry - 1) capped at :attr:`Retry.DEFAULT_BACKOFF_MAX`.
+    """
+    if retry <= 1:
+        return 0.0
+    return min(Retry.DEFAULT_BACKOFF_MAX, backoff_factor * 2 ** (retry - 1))
+
+
+async def request_with_retries(session: aiohttp.ClientSession, method: str, url: str, *, total: int,
+                               backoff_factor: float, semaphore: Optional[asyncio.Semaphore] = None,
+                               log_as: Optional[str] = None, on_retry: Optional[Callable[[], Optional[bool]]] = None,
+                               backend: str = 'http', **kwargs) -> tuple[aiohttp.ClientResponse, bytes]:
+    """
+    Sends a request and returns the response with its body, retrying like the
+    urllib3 :obj:`Retry` policies of the blocking clients.
+
+    The semaphore is only held while the request is in flight, not while
+    waiting to retry. 'on_retry' is called before every retry and the retry
+    is given up, like the last attempt, when it returns False. Every attempt
+    is recorded in the request log under 'backend'.
+
+    Raises:
+        aiohttp.ClientError: If the last attempt fails to connect.
+        asyncio.TimeoutError: If the last attempt times out.
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(total + 1):
+        try:
+            async with semaphore or nullcontext():
+                started = loop.time()
+                async with session.request(method, url, **kwargs) as response:
+                    body = await response.read()
+            get_request_log().record(backend, method, log_as or str(response.url), response.status, loop.time() - started)
+            if response.status not in RETRY_STATUSES or attempt == total or (on_retry and on_retry() is False):
+                return response, body
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+            if attempt == total or (on_retry and on_retry() is False):
+                get_request_log().failed(backend, method, log_as or url, error)
+                raise
+        await asyncio.sleep(backoff_seconds(attempt + 1, backoff_factor))
+
+
+class AsyncSwap:
+    """
+    asyncio counterpart of :obj:`swap_portal.SwapDeliveryAuthenticatedPage`.
+
+    All lookups share one connection pool and at most 'concurrency' of them
+    are in flight at a time.
+
+    Usage::
+
+      swap = await AsyncSwap.create(concurrency=8)
+      total_records = await swap.get_order('HOS1234')
+      await swap.close()
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, concurrency: int, total: int = 4, backoff_factor: float = 2,
+                 on_retry: Optional[Callable[[], Optional[bool]]] = None):
+        self.session = session
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.on_retry = on_retry
+
+    @classmethod
+    async def create(cls, concurrency: int, on_retry: Optional[Callable[[], Optional[bool]]] = None):
+        """Returns a logged in client ready to search orders, calling 'on_retry' before every retry."""
+        session = aiohttp.ClientSession(
+            headers=SWAP_SESSION_HEADERS,
+            connector=pooled_connector(concurrency),
+            timeout=aiohttp.ClientTimeout(total=timeout_seconds),
+        )
+        swap = cls(session, concurrency, on_retry=on_retry)
+        try:
+            await swap.login()
+            await swap.initialize()
+        except BaseException:
+            await session.close()
+            raise
+        session.cookie_jar.update_cookies({'CLIENT_TIMEZONE': '-480'}, URL(SWAP_BASE_URL))
+        return swap
+
+    async def _request(self, method: str, url: str, **kwargs):
+        return await request_with_retries(self.session, method, url, total=self.total,
+                                          backoff_factor=self.backoff_factor, semaphore=self.semaphore,
+                                          on_retry=self.on_retry, backend='swap', **kwargs)
+
+    async def login(self):
+        data = {
+            'UserName': getenv('swapUserName'),
+            'Password': getenv('Password'),
+            'RememberMe': 'false'
+        }
+        response, body = await self._request('POST', LOGIN_URL, data=data)
+        if 'Login' in str(response.url):
+            logger.error('Could not authenticate!')
+            raise SystemExit('Login failed')
+        if not response.ok:
+            write_to_file(body.decode(errors='replace'), 'login_error.html')
+            logger.info('Failed response written to file')
+            raise SystemExit('Could not login.')
+        logger.info('Login success')
+
+    async def initialize(self):
+        response, _ = await self._request('GET', SHOW_DATA_URL, params={'_': current_milli_time()},
+                                          headers=INITIALIZE_HEADERS)
+        if response.ok:
+            logger.info('Initialization is success!')
+        else:
+            logger.error(f'Initialization failed with status {response.status}')
+
+    async def get_order(self, order_id: str) -> Optional[int]:
+        """Returns how many records swap has for the order or None if the lookup failed."""
+        params = {**DELIVERY_SEARCH_PARAMS, 'sSearch': order_id}
+        try:
+            response, body = await self._request('GET', AJAX_HANDLER_URL, params=params,
+                                                 headers=DELIVERY_HEADERS, log_as=f'/{order_id}')
+            if not response.ok:
+                logger.error(f'Could not get details for {order_id}')
+                return None
+            return json.loads(body)['iTotalDisplayRecords']
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+            logger.error(f'Could not get details for {order_id}: {e!r}')
+        return None
+
+    async def close(self):
+        await self.session.close()
+
+
+class AsyncWM:
+    """
+    asyncio counterpart of :obj:`wm_portal.WM`.
+
+    HTML parsing runs in a worker thread so it does not block the event loop.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, concurrency: int, total: int = 4, backoff_factor: float = 30,
+                 on_retry: Optional[Callable[[], Optional[bool]]] = None):
+        self.session = session
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.on_retry = on_retry
+        self.data = dict(ORDER_DETAILS_FORM)
+
+    @classmethod
+    async def create(cls, concurrency: int, timeout: int = 30, on_retry: Optional[Callable[[], Optional[bool]]] = None):
+        """Returns a logged in client ready to fetch orders, calling 'on_retry' before every retry."""
+        session = aiohttp.ClientSession(
+            headers=WM_SESSION_HEADERS,
+            connector=pooled_connector(concurrency),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        )
+        wm = cls(session, concurrency, on_retry=on_retry)
+        try:
+            await wm.login()
+            await wm.initialize()
+        except BaseException:
+            await session.close()
+            raise
+        return wm
+
+    async def _request(self, method: str, path: str, **kwargs):
+        return await request_with_retries(self.session, method, urljoin(WM_BASE_URL, path), total=self.total,
+                                          backoff_factor=self.backoff_factor, semaphore=self.semaphore,
+                                          on_retry=self.on_retry, backend='wm', **kwargs)
+
+    async def login(self):
+        data = {
+            'username': os.environ['secretUser'],
+            'password': os.environ['wmPassword']
+        }
+        response, _ = await self._request('POST', LOGIN_ENDPOINT, data=data, headers=WM_LOGIN_HEADERS)
+        if response.ok:
+            logger.info("WM login successful.")
+        else:
+            logger.error(f"WM login failed with status {response.status}")
+
+    async def initialize(self):
+        logger.info("Fetching form data jsfwmp7517:defaultForm...")
+        _, body = await self._request('GET', INITIALIZATION_ENDPOINT)
+        default_form_data = await asyncio.to_thread(parse_form_token, body)
+        logger.info(f"Received: {default_form_data}")
+        self.data.update({'jsfwmp7517:defaultForm': default_form_data})
+
+    async def fetch(self, id: str) -> Optional[WMOrder]:
+        """
+        Fetches order details for a order by its ID.
+
+        Raises:
+            aiohttp.ClientError: If the request fails.
+            asyncio.TimeoutError: If the request times out.
+        """
+        data = {**self.data, 'jsfwmp7517:defaultForm:htmlInputText': id}
+        _, body = await self._request('POST', ORDER_DETAILS_ENDPOINT, data=data, params=ORDER_DETAILS_PARAMS,
+                                      headers=ORDER_DETAILS_HEADERS, log_as=f'/{id}')
+        return await asyncio.to_thread(parse_last_order_row, body)
+
+    async def fetch_page(self, query: str, first: int = 0, rows: int = 100) -> list[WMOrder]:
+        """asyncio counterpart of :meth:`wm_portal.WM.fetch_page`."""
+        _, body = await self._request('POST', ORDER_DETAILS_ENDPOINT,
+                                      data=order_details_page_form(self.data, query, first, rows),
+                                      params=ORDER_DETAILS_PARAMS, headers=ORDER_DETAILS_HEADERS,
+                                      log_as=f'/{query}[{first}:{first + rows}]')
+        return await asyncio.to_thread(parse_order_rows, body)
+
+    async def fetch_bulk(self, query: str, page_size: int = 100, max_pages: int = 100) -> list[WMOrder]:
+        """asyncio counterpart of :meth:`wm_portal.WM.fetch_bulk`."""
+        orders: list[WMOrder] = []
+        previous_page: list[WMOrder] = []
+        for page in range(max_pages):
+            rows = await self.fetch_page(query, first=page * page_size, rows=page_size)
+            if rows == previous_page:
+                break
+            orders.extend(rows)
+            if len(rows) < page_size:
+                break
+            previous_page = rows
+        else:
+            logger.warning(f"Stopped fetching '{query}' after {max_pages} pages of {page_size} rows.")
+        return orders
+
+    async def close(self):
+        await self.session.close()
+
+
+class AsyncReportDownloader:
+    """asyncio counterpart of :meth:`reports.Report.download_report` sharing one connection pool."""
+
+    def __init__(self, concurrency: int):
+        self.session = aiohttp.ClientSession(
+            connector=pooled_connector(concurrency),
+            timeout=aiohttp.ClientTimeout(total=None),
+        )
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def download(self, report_type: ReportType, filter_dates: FilterDates, report_name: str) -> bytes:
+        """Pulls the report from cms and returns in bytes."""
+        downloader = ReportDownloader(filter_dates.start.date, filter_dates.end.date)
+        downloader.set_headers_filters(report_type.planType, report_type.ratePlan)
+        logger.info(f"[+] Fetching {report_name} ...")
+        try:
+            response, body = await request_with_retries(self.session, 'GET', downloader.url, total=CMS_RETRIES,
+                                                        backoff_factor=CMS_BACKOFF_FACTOR, semaphore=self.semaphore,
+                                                        backend='cms', headers=downloader.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            raise SystemExit(error.args)
+        if not response.ok:
+            raise SystemExit(f"{response.status} Error: {response.reason} for url: {response.url}")
+        return body
+
+    async def close(self):
+        await self.session.close()
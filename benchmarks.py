@@ -0,0 +1,255 @@
+"""
+Data-scale benchmarks of the DataFrame hot paths on synthetic master reports.
+
+Every benchmark is timed (best of --repeat runs) and memory-profiled with
+tracemalloc (peak of one separate run) at each report size. Results are
+compared with the baselines stored in benchmarks_baseline.json and the run
+fails when a benchmark got slower or bigger than the baseline allows, or has
+no baseline. Times depend on the machine, so refresh the baselines with
+--save-baseline on the machine running the comparison.
+
+Usage::
+
+  python benchmarks.py                         # 10k, 100k, 1M and 2M rows
+  python benchmarks.py --rows 10000 2000000 --save-baseline
+"""
+import argparse
+from collections.abc import Callable
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+import json
+import logging
+from pathlib import Path
+import tempfile
+import time
+import tracemalloc
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+import helper
+from filter_dates import FilterDate, FilterDates
+from helper import generate_xlsx_report
+from order_records import OrderBatch
+from order_validation import extract_swap_eligible_orders, swap_orders_flow_filtering
+from order_validation_config import REQUIRED_COLUMNS
+from reports import Filter, Report, ReportType
+
+
+DEFAULT_ROWS = (10_000, 100_000, 1_000_000, 2_000_000)
+BASELINE_PATH = Path(__file__).parent / 'benchmarks_baseline.json'
+# A benchmark regresses when it takes this much longer or uses this much more memory than its baseline.
+TIME_TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.2
+# Share of the orders not flown to swap, which are the rows written to the xlsx report.
+FAILED_SHARE = 0.01
+
+FILTERS = [
+    Filter('Fulfillment_Mode', 'exists', ('Standard Delivery', )),
+    Filter('Order_Delivery_Status', 'notExists', ('fulfilled', )),
+]
+
+# Value distributions of the cms master report columns.
+DELIVERY_STATUSES = {'fulfilled': 0.55, 'shipped': 0.15, 'processing': 0.12, 'new': 0.1, 'returned': 0.08}
+CANCELLATION_STATUSES = {None: 0.93, 'cancelled': 0.05, 'cancel requested': 0.02}
+PACKAGE_TYPES = {'SIM': 0.6, 'Device + Plan': 0.3, 'Plan Only': 0.1}
+FULFILLMENT_MODES = {'Standard Delivery': 0.8, 'In-Store Pickup': 0.15, 'Express Delivery': 0.05}
+ORDER_TYPES = {'New Line': 0.7, 'Port In': 0.2, 'Pre Order': 0.1}
+MOS_SHARE = 0.15
+
+
+def choice(rng: np.random.Generator, distribution: dict, size: int) -> np.ndarray:
+    values = np.empty(len(distribution), dtype=object)
+    values[:] = list(distribution)
+    return rng.choice(values, size=size, p=list(distribution.values()))
+
+
+def synthetic_master_report(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns a master report of 'rows' orders shaped like a cms export: numeric
+    Order_No with an 'A<n>' suffix and some 'MOS' orders, skewed statuses and
+    free text columns.
+    """
+    rng = np.random.default_rng(seed)
+    numbers = 10_000_000 + rng.permutation(rows)
+    suffixes = rng.choice(np.array(['A1', 'A1', 'A1', 'A2']), size=rows)
+    order_nos = pd.Series(numbers.astype(str), dtype=object) + pd.Series(suffixes, dtype=object)
+    is_mos = rng.random(rows) < MOS_SHARE
+    order_nos[is_mos] = 'MOS' + pd.Series(numbers[is_mos].astype(str), dtype=object).to_numpy()
+    created = pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 30 * 24 * 3600, rows), unit='s')
+    return pd.DataFrame({
+        'Order_No': order_nos.to_numpy(dtype=object),
+        'Order_Created_Date': created,
+        'Order_Delivery_Status': choice(rng, DELIVERY_STATUSES, rows),
+        'Order_Cancellation_Status': choice(rng, CANCELLATION_STATUSES, rows),
+        'Package_Type': choice(rng, PACKAGE_TYPES, rows),
+        'Fulfillment_Mode': choice(rng, FULFILLMENT_MODES, rows),
+        'Order_Type': choice(rng, ORDER_TYPES, rows),
+        'Customer_Name': pd.Series(rng.integers(0, 10**9, rows).astype(str), dtype=object).radd('Customer ').to_numpy(),
+        'Total_Amount': rng.gamma(2.0, 80.0, rows).round(2),
+    })
+
+
+@dataclass
+class Measurement:
+    seconds: float
+    peak_mib: float
+
+
+@dataclass
+class Regression:
+    benchmark: str
+    metric: str
+    baseline: float
+    measured: float
+
+    def __str__(self):
+        return f"{self.benchmark}: {self.metric} {self.measured:.3f} against a baseline of {self.baseline:.3f}"
+
+
+@contextmanager
+def quiet_logs():
+    """Silences the info logs of the measured functions, e.g. one line per filtered report."""
+    logging.disable(logging.INFO)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def measure(setup: Callable[[], tuple], function: Callable, repeat: int) -> Measurement:
+    """Returns the best time of 'repeat' runs of function(*setup()) and the peak memory of one more run."""
+    seconds = float('inf')
+    for _ in range(repeat):
+        args = setup()
+        started = time.perf_counter()
+        function(*args)
+        seconds = min(seconds, time.perf_counter() - started)
+    args = setup()
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return Measurement(round(seconds, 6), round(peak / 2**20, 3))
+
+
+def benchmark_cases(dataframe: pd.DataFrame) -> dict[str, tuple[Callable[[], tuple], Callable]]:
+    """Returns the setup and measured function of every benchmark on one master report."""
+    filter_dates = FilterDates(FilterDate('01/01/2023 00:00'), FilterDate('02/01/2023 00:00'))
+    report = Report(ReportType('PREPAID'), filter_dates, False, dataframe=dataframe)
+    filtered = report.view()
+    for filter in FILTERS:
+        filtered.filter(filter)
+    orders = OrderBatch.from_order_ids(filtered.column('Order_No'), 'PREPAID')
+    rng = np.random.default_rng(1)
+    failed = rng.random(len(orders)) < FAILED_SHARE
+    responses = [{'iTotalDisplayRecords': int(not is_failed)} for is_failed in failed]
+    failed_order_nos = orders.original_ids[failed]
+    failed_rows = filtered.get_filtered_dataframe_by_orderNos(failed_order_nos)
+
+    def filter_report(report_view: Report):
+        for filter in FILTERS:
+            report_view.filter(filter)
+
+    def write_xlsx(dataframes: dict[str, pd.DataFrame]):
+        generate_xlsx_report(dataframes, 'benchmark.xlsx')
+
+    return {
+        'Report.filter': (lambda: (report.view(), ), filter_report),
+        'get_columns_reduced_dataframe': (lambda: (filtered, ), lambda view: view.get_columns_reduced_dataframe(REQUIRED_COLUMNS)),
+        'extract_swap_eligible_orders': (lambda: (report.view(), FILTERS), extract_swap_eligible_orders),
+        'get_filtered_dataframe_by_orderNos': (lambda: (filtered, failed_order_nos), Report.get_filtered_dataframe_by_orderNos),
+        'swap_orders_flow_filtering': (lambda: (responses, orders), swap_orders_flow_filtering),
+        'generate_xlsx_report': (lambda: ({report.name: failed_rows}, ), write_xlsx),
+    }
+
+
+def run_benchmarks(rows: tuple[int, ...] = DEFAULT_ROWS, repeat: int = 3,
+                   only: Optional[tuple[str, ...]] = None) -> dict[str, dict]:
+    """Runs every benchmark at every report size and returns the measurements keyed by 'name@rows'."""
+    results = {}
+    with tempfile.TemporaryDirectory() as report_dir, quiet_logs():
+        reports_dir, helper.reports_dir = helper.reports_dir, Path(report_dir)
+        try:
+            for size in rows:
+                cases = benchmark_cases(synthetic_master_report(size))
+                for name, (setup, function) in cases.items():
+                    if only and name not in only:
+                        continue
+                    results[f'{name}@{size}'] = asdict(measure(setup, function, repeat))
+        finally:
+            helper.reports_dir = reports_dir
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict]) -> list[Regression]:
+    """Returns the benchmarks slower or bigger than their baseline beyond the tolerances."""
+    regressions = []
+    for benchmark, measured in results.items():
+        expected = baseline.get(benchmark)
+        if expected is None:
+            continue
+        if measured['seconds'] > expected['seconds'] * (1 + TIME_TOLERANCE):
+            regressions.append(Regression(benchmark, 'seconds', expected['seconds'], measured['seconds']))
+        if measured['peak_mib'] > expected['peak_mib'] * (1 + MEMORY_TOLERANCE):
+            regressions.append(Regression(benchmark, 'peak_mib', expected['peak_mib'], measured['peak_mib']))
+    return regressions
+
+
+def missing_baselines(results: dict[str, dict], baseline: dict[str, dict]) -> list[str]:
+    """Returns the benchmarks without a baseline, which :func:`compare` cannot check."""
+    return [benchmark for benchmark in results if benchmark not in baseline]
+
+
+def load_baseline(path: Path = BASELINE_PATH) -> dict[str, dict]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding='utf-8'))
+
+
+def save_baseline(results: dict[str, dict], path: Path = BASELINE_PATH):
+    """Stores the results as the new baseline, keeping the baselines of benchmarks not run."""
+    baseline = {**load_baseline(path), **results}
+    path.write_text(json.dumps(dict(sorted(baseline.items())), indent=2) + '\n', encoding='utf-8')
+
+
+def format_results(results: dict[str, dict], baseline: dict[str, dict]) -> str:
+    lines = [f"{'Benchmark':<45} {'Seconds':>10} {'Peak MiB':>10} {'Baseline s':>11} {'Baseline MiB':>13}"]
+    for benchmark, measured in results.items():
+        expected = baseline.get(benchmark, {})
+        lines.append(
+            f"{benchmark:<45} {measured['seconds']:>10.4f} {measured['peak_mib']:>10.1f} "
+            f"{expected.get('seconds', float('nan')):>11.4f} {expected.get('peak_mib', float('nan')):>13.1f}"
+        )
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the DataFrame hot paths')
+    parser.add_argument('--rows', dest='rows', nargs='+', type=int, default=DEFAULT_ROWS, metavar='ROWS',
+                        help='sizes of the synthetic master reports (default: 10000 100000 1000000 2000000)')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3, help='timed runs per benchmark, the best is kept')
+    parser.add_argument('--only', dest='only', nargs='+', metavar='BENCHMARK', help='only run these benchmarks')
+    parser.add_argument('--baseline', dest='baseline', type=Path, default=BASELINE_PATH, help='baseline file')
+    parser.add_argument('--save-baseline', dest='save_baseline', action='store_true',
+                        help='store the results as the new baseline instead of comparing with it')
+    args = parser.parse_args()
+
+    results = run_benchmarks(tuple(args.rows), args.repeat, tuple(args.only) if args.only else None)
+    baseline = load_baseline(args.baseline)
+    print(format_results(results, baseline))
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+    else:
+        regressions = compare(results, baseline)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        missing = missing_baselines(results, baseline)
+        for benchmark in missing:
+            print(f"NO BASELINE {benchmark}, store one with --save-baseline")
+        if regressions or missing:
+            raise SystemExit(1)
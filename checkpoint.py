@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+from filter_dates import FilterDates
+from helper import reports_dir
+from loggerfactory import LoggerFactory
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+checkpoints_dir = reports_dir / 'checkpoints'
+
+
+def get_run_key(filter_dates: FilterDates) -> str:
+    """Returns a file system friendly key identifying the selected date range."""
+    start = filter_dates.start.parse_date().strftime('%Y%m%d%H%M')
+    end = filter_dates.end.parse_date().strftime('%Y%m%d%H%M')
+    return f'{start}-{end}'
+
+
+class CheckpointJournal:
+    """
+    Append-only journal of the backend lookups done during a run.
+
+    Every checked order is written as one JSON line and flushed right away, so
+    a run that dies halfway can be resumed by replaying the journal and only
+    looking up the orders that are not in it yet. Each line looks like::
+
+        {"backend": "swap", "id": "HOS1234", "result": 1}
+
+    Failed lookups are never journaled, so they are retried on resume.
+
+    Usage::
+
+      with CheckpointJournal.for_run(filter_dates, resume=True) as journal:
+          result = journal.get('swap', 'HOS1234')
+          if result is None:
+              journal.record('swap', 'HOS1234', 1)
+    """
+
+    def __init__(self, path: Path, resume: bool = False, sync_every: int = 100):
+        """
+        Args:
+            path (Path): Location of the journal file.
+            resume (bool, optional): Replay an existing journal instead of starting over.
+                Defaults to False.
+            sync_every (int, optional): Number of records after which the journal is
+                synced to disk. Defaults to 100.
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self.entries: dict[tuple[str, str], Any] = {}
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if resume:
+            self.entries = self.replay()
+            self.truncate_torn_line()
+            logger.info(f"Resuming from {self.path} with {len(self.entries)} checked orders.")
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    @classmethod
+    def for_run(cls, filter_dates: FilterDates, resume: bool = False, suffix: str = ''):
+        """Returns the journal of the run for the given date range."""
+        return cls(checkpoints_dir / f'{get_run_key(filter_dates)}{suffix}.jsonl', resume=resume)
+
+    def replay(self) -> dict[tuple[str, str], Any]:
+        """Reads the journal file, ignoring a partially written last line."""
+        entries = {}
+        if not self.path.exists():
+            return entries
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line_number, line in enumerate(file, start=1):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupt line {line_number} in {self.path}")
+                    continue
+                entries[(record['backend'], record['id'])] = record['result']
+        return entries
+
+    def truncate_torn_line(self, chunk_size: int = 64 * 1024):
+        """
+        Cuts a partially written last line off the journal file, so records
+        appended on resume start on a line of their own.
+        """
+        if not self.path.exists():
+            return
+        with open(self.path, 'rb+') as file:
+            size = file.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(0, end - chunk_size)
+                file.seek(start)
+                newline = file.read(end - start).rfind(b'\n')
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                file.truncate(end)
+                logger.warning(f"Removed a partially written last line from {self.path}")
+
+    def get(self, backend: str, id: str) -> Optional[Any]:
+        """Returns the journaled result for an order or None if it was not checked yet."""
+        return self.entries.get((backend, id))
+
+    def record(self, backend: str, id: str, result: Any):
+        """Appends the result of a lookup to the journal."""
+        line = json.dumps({'backend': backend, 'id': id, 'result': result}) + '\n'
+        with self._lock:
+            self.entries[(backend, id)] = result
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self.sync()
+
+    def sync(self):
+        """Forces the journal to disk."""
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def compact(self):
+        """Rewrites the journal with a single line per checked order."""
+        self.close()
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            for (backend, id), result in self.entries.items():
+                file.write(json.dumps({'backend': backend, 'id': id, 'result': result}) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        logger.info(f"Checkpoint journal {self.path} compacted to {len(self.entries)} records.")
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.compact()
+        else:
+            self.close()
+
+
+class NullJournal:
+    """
+    Journal that keeps nothing, for lookups that are never resumed, e.g. the
+    ad-hoc order checks of the service.
+    """
+
+    def get(self, backend: str, id: str) -> None:
+        return None
+
+    def record(self, backend: str, id: str, result: Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
@@ -0,0 +1,237 @@
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Literal, Optional
+
+import numpy as np
+import yaml
+
+from loggerfactory import LoggerFactory
+from order_records import OrderBatch
+from reports import Filter, Report, ReportType, get_report_title
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+BACKENDS = ('swap', 'wm')
+ID_MAPPINGS = ('swap_id', 'order_no')
+DEFAULT_ID_MAPPINGS = {'swap': 'swap_id', 'wm': 'order_no'}
+FILTER_METHODS = ('contains', 'exists', 'notExists')
+
+
+@dataclass
+class ReportInfo:
+    """Report, filters and backend of a validation flow."""
+    report_type: ReportType
+    filters: list[Filter]
+    backend: Literal['swap', 'wm'] = 'swap'
+    id_mapping: Literal['swap_id', 'order_no'] = 'swap_id'
+
+
+def download_key(report_type: ReportType) -> tuple[str, str]:
+    """Returns the key identifying the cms report of a report type."""
+    return (report_type.planType, report_type.ratePlan)
+
+
+@dataclass
+class SkipRule:
+    """Orders matching 'filter' need no lookup in 'backends', their cms status already settles the outcome."""
+    filter: Filter
+    reason: str
+    backends: tuple[str, ...] = BACKENDS
+
+
+def parse_filter(where: str, filter: list) -> Filter:
+    """
+    Returns a filter given as [column, method, [texts]].
+
+    Raises:
+        SystemExit: If the filter is malformed.
+    """
+    try:
+        column_name, method_name, filter_texts = filter
+        parsed = Filter(column_name, method_name, tuple(filter_texts))
+    except (TypeError, ValueError) as error:
+        raise SystemExit(f"Malformed filter {filter!r} of {where}: {error!r}")
+    if parsed.methodName not in FILTER_METHODS:
+        raise SystemExit(f"Unknown filter method {parsed.methodName!r} of {where}")
+    return parsed
+
+
+def parse_flow(name: str, flow: dict) -> ReportInfo:
+    """
+    Returns the report info of a flow of the flows file.
+
+    Raises:
+        SystemExit: If the flow is malformed.
+    """
+    try:
+        report = flow['report']
+        report_type = ReportType(report['plan_type'], report.get('rate_plan', ''))
+    except (KeyError, TypeError) as error:
+        raise SystemExit(f"Malformed flow {name!r}: {error!r}")
+    filters = [parse_filter(f'flow {name!r}', filter) for filter in flow.get('filters') or []]
+    get_report_title(report_type)
+    backend = flow.get('backend', 'swap')
+    if backend not in BACKENDS:
+        raise SystemExit(f"Unknown backend {backend!r} of flow {name!r}, expected one of {', '.join(BACKENDS)}")
+    id_mapping = flow.get('id_mapping', DEFAULT_ID_MAPPINGS[backend])
+    if id_mapping not in ID_MAPPINGS:
+        raise SystemExit(f"Unknown id_mapping {id_mapping!r} of flow {name!r}, expected one of {', '.join(ID_MAPPINGS)}")
+    return ReportInfo(report_type, filters, backend, id_mapping)
+
+
+def parse_skip_rule(rule: dict) -> SkipRule:
+    """
+    Returns a skip rule of the flows file.
+
+    Raises:
+        SystemExit: If the rule is malformed.
+    """
+    try:
+        reason = rule['reason']
+        skip_filter = parse_filter(f'skip rule {reason!r}', rule['when'])
+    except (KeyError, TypeError) as error:
+        raise SystemExit(f"Malformed skip rule {rule!r}: {error!r}")
+    backends = tuple(rule.get('backends') or BACKENDS)
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        raise SystemExit(f"Unknown backends {', '.join(sorted(unknown))} of skip rule {reason!r}")
+    return SkipRule(skip_filter, reason, backends)
+
+
+def read_flows_file(path: Path) -> dict:
+    """
+    Returns the content of the flows file.
+
+    Raises:
+        SystemExit: If the file is missing or malformed.
+    """
+    try:
+        with open(path, 'rt', encoding='utf-8') as flows_file:
+            config = yaml.safe_load(flows_file)
+    except (OSError, yaml.YAMLError) as error:
+        raise SystemExit(f"Could not read the flows from {path}: {error}")
+    if not isinstance(config, dict) or not isinstance(config.get('flows'), dict):
+        raise SystemExit(f"{path} must map 'flows' to the flow definitions")
+    return config
+
+
+def load_skip_rules(path: Path) -> list[SkipRule]:
+    """Reads the skip rules of the flows file."""
+    return [parse_skip_rule(rule) for rule in read_flows_file(path).get('skip') or []]
+
+
+def load_flows(path: Path) -> tuple[dict[str, ReportInfo], tuple[str, ...]]:
+    """
+    Reads the flows file and returns the report info of every flow and the
+    flows to run.
+
+    Raises:
+        SystemExit: If the file is missing or malformed.
+    """
+    config = read_flows_file(path)
+    reports_info = {name: parse_flow(name, flow) for name, flow in config['flows'].items()}
+    run_for = tuple(config.get('run_for') or reports_info)
+    return reports_info, run_for
+
+
+@dataclass
+class RunPlan:
+    """
+    Flows of a run and the distinct cms reports they read, worked out before
+    anything is requested.
+    """
+    flows: dict[str, ReportInfo]
+    downloads: dict[tuple[str, str], ReportType] = field(default_factory=dict)
+
+    def report_key(self, flow_name: str) -> tuple[str, str]:
+        return download_key(self.flows[flow_name].report_type)
+
+
+def plan_run(run_for: Iterable[str], reports_info: Mapping[str, ReportInfo]) -> RunPlan:
+    """
+    Returns the plan of the flows in 'run_for', with one download per distinct report.
+
+    Raises:
+        SystemExit: If a flow is not defined.
+    """
+    flows = {}
+    for flow_name in run_for:
+        try:
+            flows[flow_name] = reports_info[flow_name]
+        except KeyError:
+            raise SystemExit(f"Flow {flow_name!r} not found, flows are {', '.join(reports_info)}")
+    plan = RunPlan(flows)
+    for report_info in flows.values():
+        plan.downloads.setdefault(download_key(report_info.report_type), report_info.report_type)
+    logger.info(f"Planned {len(plan.flows)} flows reading {len(plan.downloads)} reports.")
+    return plan
+
+
+@dataclass
+class FlowOrders:
+    """Orders a flow checks, selected from its report."""
+    name: str
+    info: ReportInfo
+    report: Report
+    orders: OrderBatch
+    skipped: OrderBatch = field(default_factory=OrderBatch.empty)
+
+    @property
+    def lookup_ids(self) -> np.ndarray:
+        """IDs looked up in the backend of the flow, one per order."""
+        return self.mapped_ids(self.orders)
+
+    def mapped_ids(self, orders: OrderBatch) -> np.ndarray:
+        if self.info.id_mapping == 'swap_id':
+            return orders.swap_ids
+        return orders.original_ids
+
+
+def skip_orders(report: Report, orders: OrderBatch, rules: Iterable[SkipRule], backend: str,
+                selected: Optional[np.ndarray] = None) -> tuple[OrderBatch, OrderBatch, dict[str, int]]:
+    """
+    Splits the orders selected from a report into the ones to look up and the
+    ones a skip rule of the backend matches, with the number skipped per reason.
+    When 'selected' is given, e.g. the orders of a shard, the others are left
+    out of both and of the counts.
+    """
+    selected = np.ones(len(orders), dtype=bool) if selected is None else selected
+    skip = np.zeros(len(orders), dtype=bool)
+    skipped_by_reason: dict[str, int] = {}
+    for rule in rules:
+        if backend not in rule.backends:
+            continue
+        mask = report.matches(rule.filter)
+        if mask is None:
+            continue
+        matched = mask & ~skip & selected
+        if matched.any():
+            skipped_by_reason[rule.reason] = skipped_by_reason.get(rule.reason, 0) + int(matched.sum())
+            skip |= matched
+    return orders[selected & ~skip], orders[skip], skipped_by_reason
+
+
+def plan_lookups(flows: list[FlowOrders]) -> dict[str, list[str]]:
+    """Returns the distinct IDs to look up in every backend across all flows, in flow order."""
+    lookup_ids: dict[str, dict[str, None]] = {backend: {} for backend in BACKENDS}
+    for flow in flows:
+        lookup_ids[flow.info.backend].update(dict.fromkeys(flow.lookup_ids))
+    planned = {backend: list(ids) for backend, ids in lookup_ids.items()}
+    logger.info(
+        f"Planned {', '.join(f'{len(ids)} {backend}' for backend, ids in planned.items())} lookups "
+        f"for {sum(len(flow.orders) for flow in flows)} orders."
+    )
+    saved_ids: dict[str, set[str]] = {backend: set() for backend in BACKENDS}
+    for flow in flows:
+        saved_ids[flow.info.backend].update(
+            skipped_id for skipped_id in flow.mapped_ids(flow.skipped)
+            if skipped_id not in lookup_ids[flow.info.backend]
+        )
+    if any(saved_ids.values()):
+        logger.info(
+            f"Skip rules saved {', '.join(f'{len(ids)} {backend}' for backend, ids in saved_ids.items())} lookups "
+            f"for {sum(len(flow.skipped) for flow in flows)} orders."
+        )
+    return planned
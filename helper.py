@@ -1,16 +1,25 @@
 from datetime import datetime
 from pathlib import Path
-import pandas as pd
 import json
 import time
+from typing import TYPE_CHECKING
 
 from loggerfactory import LoggerFactory
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 logger = LoggerFactory.get_logger(__name__)
 
 reports_dir = Path('reports')
-reports_dir.mkdir(parents=True, exist_ok=True)
+
+
+def get_report_path(filename: str) -> Path:
+    """Returns the path of a file in the reports directory, creating the directory if needed."""
+    reports_dir.mkdir(parents=True, exist_ok=True)
+    return reports_dir / filename
+
 
 def write_dict_to_json_file(data: dict, filename: str):
     """
@@ -27,7 +36,7 @@ def write_dict_to_json_file(data: dict, filename: str):
         Exception: If there is an error while writing the dictionary to the JSON file.
     """
     try:
-        filepath = reports_dir / filename
+        filepath = get_report_path(filename)
 
         with open(filepath, 'w') as file:
             json.dump(data, file, indent=2)
@@ -39,7 +48,7 @@ def write_dict_to_json_file(data: dict, filename: str):
 
 def write_to_file(text, filename: str):
     """Helper to write any string to a file"""
-    filename = reports_dir / filename
+    filename = get_report_path(filename)
     try:
         with open(filename, 'w', encoding='utf-8') as file:
             file.write(str(text))
@@ -56,7 +65,7 @@ def write_bytes_to_file(bytes_text: bytes, filename: str):
     Note: The filename should contain proper extension.
     """
     try:
-        filename = reports_dir / filename
+        filename = get_report_path(filename)
         with open(filename, 'wb') as file:
             file.write(bytes_text)
             logger.info(f'File {filename} write success.')
@@ -78,13 +87,15 @@ def save_json_data(data, report_name: str):
         write_to_file(data, f'{report_name}_error')
 
 
-def generate_xlsx_report(dataframes: dict[str, pd.DataFrame], report_name: str):
+def generate_xlsx_report(dataframes: dict[str, 'pd.DataFrame'], report_name: str):
     """
     Write the dataframes mapping to a sheet in the report file.
 
     Note: The filename should contain xlsx extension.
     """
-    report_path = reports_dir / report_name
+    import pandas as pd
+
+    report_path = get_report_path(report_name)
     try:
         with pd.ExcelWriter(report_path, 'openpyxl') as writer:
             for sheet_name, df in dataframes.items():
@@ -0,0 +1,242 @@
+import base64
+from collections import defaultdict, deque
+import gzip
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Optional
+from urllib.parse import parse_qsl, quote_plus, urlencode, urlsplit, urlunsplit
+
+from requests import ConnectionError, PreparedRequest, Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from loggerfactory import LoggerFactory
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+CASSETTE_VERSION = 1
+# Environment variables holding credentials, their values never reach a cassette.
+SECRET_ENV_NAMES = ('swapUserName', 'Password', 'secretUser', 'wmPassword')
+# Response headers left out of a cassette, request headers are only kept in MATCH_HEADERS.
+SECRET_HEADERS = ('authorization', 'cookie', 'set-cookie')
+# Request headers that select what is returned, e.g. the window of a cms report.
+MATCH_HEADERS = ('filterplantype', 'filterrateplan', 'filterdatefrom', 'filterdateto')
+# Query parameters that change on every request, e.g. cache busting timestamps.
+IGNORED_PARAMS = ('_', )
+
+
+def redact(text: str) -> str:
+    """Replaces the values of the secret environment variables, as is and form encoded."""
+    for name in SECRET_ENV_NAMES:
+        value = os.environ.get(name)
+        if value:
+            text = text.replace(value, f'<{name}>').replace(quote_plus(value), f'<{name}>')
+    return text
+
+
+def redact_bytes(content: bytes) -> bytes:
+    """Replaces the values of the secret environment variables in a response body."""
+    for name in SECRET_ENV_NAMES:
+        value = os.environ.get(name)
+        if value:
+            placeholder = f'<{name}>'.encode()
+            content = content.replace(value.encode(), placeholder).replace(quote_plus(value).encode(), placeholder)
+    return content
+
+
+def request_key(request: PreparedRequest) -> str:
+    """Returns what identifies a request in a cassette, with secrets and volatile parameters removed."""
+    url = urlsplit(request.url)
+    query = urlencode([(name, value) for name, value in parse_qsl(url.query, keep_blank_values=True)
+                       if name not in IGNORED_PARAMS])
+    body = request.body or b''
+    if isinstance(body, str):
+        body = body.encode()
+    headers = {name: request.headers[name] for name in MATCH_HEADERS if name in request.headers}
+    return json.dumps([
+        request.method,
+        redact(urlunsplit(url._replace(query=query))),
+        headers,
+        redact(body.decode('utf-8', errors='replace')),
+    ])
+
+
+class Cassette:
+    """
+    Recorded HTTP exchanges of the cms, Swap and WM clients.
+
+    In 'record' mode every exchange sent through a wrapped adapter is appended
+    to the file as one JSON line, without credentials, cookies or
+    authorization headers. In 'replay' mode the exchanges are served from the
+    file instead of the network, in recorded order for identical requests,
+    after waiting their recorded time multiplied by 'timing_scale' (0 to
+    answer at once). Paths ending in .gz are compressed.
+
+    Usage::
+
+      with use_cassette(Path('fixtures/run.jsonl.gz'), 'replay', timing_scale=0):
+          order_processing(filter_dates, False)
+    """
+
+    def __init__(self, path: Path, mode: str, timing_scale: float = 1.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown cassette mode {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self.timing_scale = timing_scale
+        self._exchanges: dict[str, deque] = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._file = None
+        if mode == 'replay':
+            self._load()
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self._open('wt')
+            self._file.write(json.dumps({'version': CASSETTE_VERSION}) + '\n')
+
+    def _open(self, mode: str):
+        if self.path.suffix == '.gz':
+            return gzip.open(self.path, mode, encoding='utf-8')
+        return open(self.path, mode, encoding='utf-8')
+
+    def _load(self):
+        with self._open('rt') as file:
+            header = json.loads(next(file))
+            if header.get('version') != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version {header.get('version')} in {self.path}")
+            count = 0
+            for line in file:
+                exchange = json.loads(line)
+                self._exchanges[exchange['key']].append(exchange)
+                count += 1
+        # The clients log in from their constructors, so the credentials must exist even offline.
+        for name in SECRET_ENV_NAMES:
+            os.environ.setdefault(name, f'replay-{name}')
+        logger.info(f"Replaying {count} HTTP exchanges from {self.path}")
+
+    def record(self, request: PreparedRequest, response: Response, elapsed: float):
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in SECRET_HEADERS}
+        exchange = {
+            'key': request_key(request),
+            'url': redact(request.url),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {name: redact(value) for name, value in headers.items()},
+            'content': base64.b64encode(redact_bytes(response.content)).decode('ascii'),
+            'elapsed': round(elapsed, 6),
+        }
+        with self._lock:
+            self._file.write(json.dumps(exchange) + '\n')
+            self._file.flush()
+
+    def play(self, request: PreparedRequest) -> Response:
+        """
+        Returns the recorded response of a request, repeating the last one once
+        identical requests outnumber the recordings.
+
+        Raises:
+            requests.ConnectionError: If the request was never recorded.
+        """
+        key = request_key(request)
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if not exchanges:
+                raise ConnectionError(f"No recorded exchange for {request.method} {redact(request.url)}")
+            exchange = exchanges.popleft() if len(exchanges) > 1 else exchanges[0]
+        if self.timing_scale:
+            time.sleep(exchange['elapsed'] * self.timing_scale)
+        response = Response()
+        response.status_code = exchange['status']
+        response.reason = exchange['reason']
+        response.headers = CaseInsensitiveDict(exchange['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = base64.b64decode(exchange['content'])
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        global _active_cassette
+        if _active_cassette is self:
+            _active_cassette = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecordingAdapter(BaseAdapter):
+    """Sends requests through 'adapter' and records every exchange in the cassette."""
+
+    def __init__(self, adapter: BaseAdapter, cassette: Cassette):
+        super().__init__()
+        self.adapter = adapter
+        self.cassette = cassette
+
+    @property
+    def max_retries(self):
+        return self.adapter.max_retries
+
+    @max_retries.setter
+    def max_retries(self, retry):
+        self.adapter.max_retries = retry
+
+    def send(self, request, **kwargs):
+        started = time.perf_counter()
+        response = self.adapter.send(request, **kwargs)
+        # Reading the content here keeps the transfer in the recorded time.
+        response.content
+        self.cassette.record(request, response, time.perf_counter() - started)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """Answers requests from the cassette without any network access."""
+
+    def __init__(self, cassette: Cassette):
+        super().__init__()
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        response = self.cassette.play(request)
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+
+_active_cassette: Optional[Cassette] = None
+
+
+def use_cassette(path: Path, mode: str, timing_scale: float = 1.0) -> Cassette:
+    """
+    Records or replays the exchanges of every adapter created afterwards by
+    :func:`http_sessions.pooled_adapter`. Call it before the portal modules are
+    imported, the swap adapter is created on import.
+    """
+    global _active_cassette
+    _active_cassette = Cassette(path, mode, timing_scale)
+    return _active_cassette
+
+
+def wrap_adapter(adapter: BaseAdapter) -> BaseAdapter:
+    """Returns the adapter itself, or its recording or replaying stand-in while a cassette is in use."""
+    if _active_cassette is None:
+        return adapter
+    if _active_cassette.mode == 'record':
+        return RecordingAdapter(adapter, _active_cassette)
+    return ReplayAdapter(_active_cassette)
@@ -0,0 +1,83 @@
+from contextvars import ContextVar
+
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+from http_fixtures import wrap_adapter
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Budget of the run sending requests from the current thread or task, see :meth:`run_budget.RunBudget.active`.
+active_budget: ContextVar = ContextVar('active_budget', default=None)
+
+
+class BudgetRetry(Retry):
+    """
+    :obj:`Retry` that also gives up once the run allows no more retries.
+
+    'budget' is any object with an ``allow_retry()`` method, e.g.
+    :obj:`run_budget.RunBudget`, and is kept by every copy urllib3 makes.
+    Without one the budget active in the calling context is used, so sessions
+    shared by concurrent runs count each retry against the run that sent it.
+    """
+
+    def __init__(self, *args, budget=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.budget = budget
+
+    def new(self, **kw):
+        kw.setdefault('budget', self.budget)
+        return super().new(**kw)
+
+    def increment(self, *args, **kwargs):
+        budget = self.budget if self.budget is not None else active_budget.get()
+        if budget is not None and not budget.allow_retry():
+            return Retry.increment(self.new(total=0), *args, **kwargs)
+        return super().increment(*args, **kwargs)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, timeout, *args, **kwargs):
+        """
+        TimeoutHTTPAdapter constructor.
+
+        Args:
+            timeout (int): How many seconds to wait for the server to send
+            data before giving up.
+        """
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+
+    def send(self, request, **kwargs):
+        """Override :obj:`HTTPAdapter` send method to add a default timeout."""
+        timeout = kwargs.get("timeout")
+        if timeout is None:
+            kwargs["timeout"] = self.timeout
+
+        return super().send(request, **kwargs)
+
+
+def pooled_adapter(pool_size: int, retry: Retry, timeout=None, block: bool = True) -> HTTPAdapter:
+    """
+    Returns an adapter keeping up to 'pool_size' keep-alive connections per host.
+
+    With 'block' a request waits for a free connection once 'pool_size' are in
+    use, instead of opening an extra connection that is discarded afterwards
+    ("Connection pool is full, discarding connection"). Size the pool to the
+    number of threads sharing the session.
+
+    While a cassette is in use (see :func:`http_fixtures.use_cassette`) the
+    adapter records or replays its exchanges.
+
+    Args:
+        pool_size (int): Connections kept per host.
+        retry (Retry): Retry policy of every request.
+        timeout (optional): Default timeout of requests sent without one. Defaults to None.
+        block (bool, optional): Wait for a free connection when the pool is exhausted. Defaults to True.
+    """
+    pool_kwargs = dict(max_retries=retry, pool_maxsize=pool_size, pool_block=block)
+    if timeout is None:
+        return wrap_adapter(HTTPAdapter(**pool_kwargs))
+    return wrap_adapter(TimeoutHTTPAdapter(timeout, **pool_kwargs))
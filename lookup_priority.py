@@ -0,0 +1,101 @@
+from collections.abc import Iterable, Mapping
+from datetime import date, timedelta
+from itertools import zip_longest
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from flows import FlowOrders
+from loggerfactory import LoggerFactory
+from results_store import ResultsStore
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+PRIORITIES = ('previous_failures', 'failure_prone_flows', 'oldest_first')
+
+
+def prioritize_lookups(flows: Iterable[FlowOrders], lookup_ids: Mapping[str, list[str]], priorities: Iterable[str],
+                       store: Optional[ResultsStore] = None, history_days: int = 30,
+                       date_column: Optional[str] = None) -> dict[str, list[str]]:
+    """
+    Returns the lookup IDs of every backend sorted by the priorities, in turn:
+
+    - 'previous_failures': orders that failed in the store over the last 'history_days' days first
+    - 'failure_prone_flows': orders of the flows failing most over those days first
+    - 'oldest_first': orders with the oldest 'date_column' in their report first
+
+    Ties keep the planned order, and an ID shared by flows takes the place of
+    its highest priority order. Priorities reading the store are ignored
+    without one, 'oldest_first' when no report has the date column.
+
+    Raises:
+        SystemExit: If a priority is unknown.
+    """
+    priorities = tuple(priorities)
+    unknown = set(priorities) - set(PRIORITIES)
+    if unknown:
+        raise SystemExit(f"Unknown lookup priorities {', '.join(sorted(unknown))}, expected {', '.join(PRIORITIES)}")
+    flows = [flow for flow in flows if len(flow.orders)]
+    if not priorities or not flows:
+        return dict(lookup_ids)
+
+    frames = []
+    for flow in flows:
+        frame = pd.DataFrame({
+            'backend': flow.info.backend,
+            'flow': flow.name,
+            'Order_No': flow.orders.original_ids,
+            'lookup_id': flow.lookup_ids,
+        })
+        if 'oldest_first' in priorities and date_column in flow.report.columns:
+            dates = flow.report.get_columns_reduced_dataframe(('Order_No', date_column)).drop_duplicates('Order_No')
+            frame = frame.merge(dates, on='Order_No', how='left', sort=False)
+            frame['order_date'] = pd.to_datetime(frame.pop(date_column), errors='coerce')
+        frames.append(frame)
+    orders = pd.concat(frames, ignore_index=True)
+    orders['planned'] = np.arange(len(orders))
+
+    since = date.today() - timedelta(days=history_days)
+    keys, applied = [], []
+    for priority in priorities:
+        if priority == 'previous_failures' and store is not None:
+            failed = store.failed_order_nos(since)
+            # False sorts first.
+            orders['not_failed_before'] = ~orders['Order_No'].astype(str).isin(failed)
+            keys.append('not_failed_before')
+            applied.append(priority)
+            logger.info(f"{int((~orders['not_failed_before']).sum())} orders failed in the last {history_days} days.")
+        elif priority == 'failure_prone_flows' and store is not None:
+            rates = store.failure_rates(since)
+            orders['flow_success_rate'] = 1 - orders['flow'].map(rates).fillna(0.0)
+            keys.append('flow_success_rate')
+            applied.append(priority)
+        elif priority == 'oldest_first':
+            if 'order_date' in orders:
+                keys.append('order_date')
+                applied.append(priority)
+            else:
+                logger.warning(f"No report has the {date_column} column, lookups are not sorted by order date.")
+    if not keys:
+        return dict(lookup_ids)
+
+    ordered = orders.sort_values([*keys, 'planned'], kind='stable', na_position='last')
+    prioritized = {}
+    for backend, ids in lookup_ids.items():
+        backend_ids = ordered.loc[ordered['backend'] == backend, 'lookup_id']
+        wanted = set(ids)
+        prioritized[backend] = [lookup_id for lookup_id in dict.fromkeys(backend_ids) if lookup_id in wanted]
+    logger.info(f"Lookups sorted by {', '.join(applied)}.")
+    return prioritized
+
+
+def interleave_lookups(lookup_ids: Mapping[str, list[str]]) -> list[tuple[str, str]]:
+    """
+    Merges the sorted lookup IDs of every backend into one queue of
+    (backend, lookup ID) pairs, taking the next lookup of each backend in turn,
+    so the top orders of every backend are checked before a run is cut short.
+    """
+    queues = [[(backend, lookup_id) for lookup_id in ids] for backend, ids in lookup_ids.items()]
+    return [lookup for lookups in zip_longest(*queues) for lookup in lookups if lookup is not None]
@@ -0,0 +1,257 @@
+from concurrent.futures import Future
+from collections.abc import Callable, Hashable, Iterable
+from dataclasses import asdict
+import threading
+import time
+from typing import Generic, Optional, TypeVar
+
+from requests import RequestException
+
+from checkpoint import CheckpointJournal
+from loggerfactory import LoggerFactory
+from profiling import profiler
+from run_budget import RunBudget
+from swap_portal import SwapDeliveryAuthenticatedPage
+from telemetry import RunTelemetry
+from wm_portal import WM, WMOrder, group_by_prefix, match_wm_orders
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+T = TypeVar('T')
+
+
+class LookupTable(Generic[T]):
+    """
+    Thread-safe table of lookup results for a run.
+
+    A key is fetched at most once: later callers get the stored result and
+    callers asking for a key that is being fetched wait for that request
+    instead of sending their own. Failed lookups (None or an exception) are
+    not stored, so the next caller retries them.
+    """
+
+    def __init__(self):
+        self._results: dict[Hashable, T] = {}
+        self._in_flight: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.fetched = 0
+        self.reused = 0
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], Optional[T]]) -> Optional[T]:
+        """Returns the result for key, calling fetch only if no one did it before."""
+        with self._lock:
+            if key in self._results:
+                self.reused += 1
+                return self._results[key]
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self.fetched += 1
+            else:
+                self.reused += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = fetch()
+        except BaseException as exception:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(exception)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            if result is not None:
+                self._results[key] = result
+        future.set_result(result)
+        return result
+
+    def put(self, key: Hashable, result: T):
+        """Stores a result fetched by other means, e.g. a bulk query."""
+        with self._lock:
+            self._results[key] = result
+
+    def clear(self):
+        """Forgets every stored result."""
+        with self._lock:
+            self._results.clear()
+
+    def __len__(self):
+        return len(self._results)
+
+    def __contains__(self, key: Hashable):
+        return key in self._results
+
+
+class PortalSessions:
+    """
+    Logged in Swap and WM sessions, created on first use.
+
+    A long running service shares one instance between its runs so they do not
+    log in again. Sessions older than 'max_age' seconds are replaced by a new
+    login the next time they are asked for, and the replaced session is closed.
+    Every session has its own connection pool, so closing one leaves the others
+    alone, and requests still in flight on it finish before their connections close.
+    """
+
+    def __init__(self, max_age: Optional[float] = None):
+        self.max_age = max_age
+        self._swap_delivery_page: Optional[SwapDeliveryAuthenticatedPage] = None
+        self._wm: Optional[WM] = None
+        self._logged_in_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, portal: str) -> bool:
+        logged_in_at = self._logged_in_at.get(portal)
+        if logged_in_at is None:
+            return True
+        return self.max_age is not None and time.monotonic() - logged_in_at > self.max_age
+
+    @property
+    def swap_delivery_page(self) -> SwapDeliveryAuthenticatedPage:
+        with self._lock:
+            if self._expired('swap'):
+                replaced, self._swap_delivery_page = self._swap_delivery_page, SwapDeliveryAuthenticatedPage()
+                self._logged_in_at['swap'] = time.monotonic()
+                if replaced is not None:
+                    replaced.swap_session.close()
+        return self._swap_delivery_page
+
+    @property
+    def wm(self) -> WM:
+        with self._lock:
+            if self._expired('wm'):
+                replaced, self._wm = self._wm, WM()
+                self._logged_in_at['wm'] = time.monotonic()
+                if replaced is not None:
+                    replaced.close()
+        return self._wm
+
+    def reset(self):
+        """Forgets the sessions so the next lookup logs in again."""
+        with self._lock:
+            self._logged_in_at.clear()
+
+
+class OrderLookups:
+    """
+    Run-wide access to the Swap and WM backends.
+
+    Every distinct swap ID and WM order ID is requested at most once per run
+    and the result is shared by every flow asking for it. Results are read from
+    and written to the checkpoint journal, so resumed runs skip them too.
+    The portal sessions are only created on the first lookup that needs them,
+    unless already logged in 'sessions' are given. Requests, failures and
+    retries of each backend are counted in 'telemetry'.
+
+    Once the deadline of 'budget' has passed no more requests are sent and
+    the lookups fail, WM orders that could not be fetched are kept in
+    'unverified_wm_orders'.
+    """
+
+    def __init__(self, journal: CheckpointJournal, sessions: Optional[PortalSessions] = None,
+                 telemetry: Optional[RunTelemetry] = None, budget: Optional[RunBudget] = None):
+        self.journal = journal
+        self.sessions = sessions or PortalSessions()
+        self.telemetry = telemetry or RunTelemetry(display=False)
+        self.budget = budget or RunBudget()
+        self.swap_results: LookupTable[int] = LookupTable()
+        self.wm_results: LookupTable[WMOrder] = LookupTable()
+        self.unverified_wm_orders: set[str] = set()
+
+    @property
+    def swap_delivery_page(self) -> SwapDeliveryAuthenticatedPage:
+        swap_delivery_page = self.sessions.swap_delivery_page
+        self.telemetry.watch_session('swap', swap_delivery_page.swap_session)
+        return swap_delivery_page
+
+    @property
+    def wm(self) -> WM:
+        wm = self.sessions.wm
+        self.telemetry.watch_session('wm', wm)
+        return wm
+
+    def swap_total_records(self, swap_order_id: str) -> Optional[int]:
+        """Returns how many records swap has for the order or None if the lookup failed."""
+        def fetch():
+            total_records = self.journal.get('swap', swap_order_id)
+            if total_records is not None:
+                return total_records
+            if self.budget.expired():
+                return None
+            self.budget.request()
+            with profiler.span('swap request'), self.telemetry.request('swap') as outcome, self.budget.active():
+                response = self.swap_delivery_page.get_order(swap_order_id)
+                outcome.ok = bool(response)
+            if not response:
+                return None
+            total_records = response.json()['iTotalDisplayRecords']
+            self.journal.record('swap', swap_order_id, total_records)
+            return total_records
+        return self.swap_results.get_or_fetch(swap_order_id, fetch)
+
+    def wm_order(self, order_id: str) -> Optional[WMOrder]:
+        """Returns the order from WM or None if it is not in WM or could not be fetched."""
+        def fetch():
+            checked = self.journal.get('wm', order_id)
+            if checked is not None:
+                return WMOrder(**checked)
+            if self.budget.expired():
+                self.unverified_wm_orders.add(order_id)
+                return None
+            self.budget.request()
+            try:
+                with profiler.span('wm request'), self.telemetry.request('wm') as outcome, self.budget.active():
+                    order = self.wm.fetch(order_id)
+                    outcome.ok = order is not None
+            except RequestException as error:
+                logger.error(f'Could not get details for {order_id}: {error!r}')
+                self.unverified_wm_orders.add(order_id)
+                return None
+            self.unverified_wm_orders.discard(order_id)
+            if order is not None:
+                self.journal.record('wm', order_id, asdict(order))
+            return order
+        return self.wm_results.get_or_fetch(order_id, fetch)
+
+    def prefetch_wm_orders(self, order_ids: Iterable[str], prefix_length: int, page_size: int) -> int:
+        """
+        Fetches the WM orders in bulk, one paginated search per order ID prefix,
+        and stores the matched orders so :meth:`wm_order` does not request them.
+        A failed search leaves its orders unmatched, to be fetched one by one.
+
+        Returns:
+            int: Number of orders matched.
+        """
+        pending = [
+            order_id for order_id in dict.fromkeys(order_ids)
+            if order_id not in self.wm_results and self.journal.get('wm', order_id) is None
+        ]
+        groups = group_by_prefix(pending, prefix_length)
+        matched_count = 0
+        for prefix, group in groups.items():
+            if self.budget.expired():
+                break
+            self.budget.request()
+            try:
+                with profiler.span('wm bulk search'), self.telemetry.request('wm'), self.budget.active():
+                    matched = match_wm_orders(group, self.wm.fetch_bulk(prefix, page_size=page_size))
+            except RequestException as error:
+                logger.warning(f"Bulk WM search of '{prefix}' failed, fetching its {len(group)} orders one by one: "
+                               f"{error!r}")
+                continue
+            for order_id, order in matched.items():
+                self.wm_results.put(order_id, order)
+                self.journal.record('wm', order_id, asdict(order))
+            matched_count += len(matched)
+        logger.info(f"Bulk WM: matched {matched_count} of {len(pending)} orders with {len(groups)} searches.")
+        return matched_count
+
+    def log_summary(self):
+        logger.info(
+            f"Swap lookups: {self.swap_results.fetched} requested, {self.swap_results.reused} reused. "
+            f"WM lookups: {self.wm_results.fetched} requested, {self.wm_results.reused} reused."
+        )
@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from collections.abc import Iterable
+from typing import Optional, TextIO
+
+import pandas as pd
+
+from checkpoint import NullJournal
+from helper import generate_xlsx_report
+from loggerfactory import LoggerFactory
+from lookups import OrderLookups, PortalSessions
+from order_records import OrderBatch
+from order_validation_config import SWAP_CONCURRENCY, WM_CONCURRENCY
+from telemetry import FlowProgress, RunTelemetry
+from wm_portal import WMOrder
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+
+@dataclass(slots=True)
+class OrderStatus:
+    """Outcome of checking one order of a list, 'wm_checked' is only set for MOS orders."""
+    order_no: str
+    swap_id: str
+    flown_to_swap: Optional[bool]
+    wm_checked: bool = False
+    wm_order: Optional[WMOrder] = None
+
+    def to_dict(self) -> dict:
+        status = {'order_no': self.order_no, 'swap_id': self.swap_id, 'flown_to_swap': self.flown_to_swap}
+        if self.wm_checked:
+            status['wm'] = None if self.wm_order is None else asdict(self.wm_order)
+        return status
+
+
+def read_order_ids(source: TextIO) -> list[str]:
+    """Reads one order ID per line, skipping blank lines, '#' comments and repeated IDs."""
+    order_ids = (line.split('#', 1)[0].strip() for line in source)
+    return list(dict.fromkeys(order_id for order_id in order_ids if order_id))
+
+
+def check_orders(lookups: OrderLookups, order_ids: Iterable[str], plan_type: str,
+                 pbar: Optional[FlowProgress] = None) -> list[OrderStatus]:
+    """
+    Checks every order in swap and the MOS orders in WM, without downloading
+    any report. Orders are mapped to swap IDs like the report flows do and both
+    backends are queried at the same time, each with its own pool of
+    SWAP_CONCURRENCY and WM_CONCURRENCY threads.
+
+    Raises:
+        ValueError: If the plan type is not PREPAID or POSTPAID.
+    """
+    orders = OrderBatch.from_order_ids(list(order_ids), plan_type)
+    with ThreadPoolExecutor(SWAP_CONCURRENCY, thread_name_prefix='swap') as swap_pool, \
+            ThreadPoolExecutor(WM_CONCURRENCY, thread_name_prefix='wm') as wm_pool:
+        swap_futures = [swap_pool.submit(lookups.swap_total_records, swap_id) for swap_id in orders.swap_ids]
+        wm_futures = {
+            order_no: wm_pool.submit(lookups.wm_order, order_no)
+            for order_no in orders.original_ids if 'MOS' in order_no
+        }
+        statuses = []
+        for (swap_id, order_no), swap_future in zip(orders, swap_futures):
+            total_records = swap_future.result()
+            status = OrderStatus(order_no, swap_id, None if total_records is None else total_records > 0)
+            if order_no in wm_futures:
+                status.wm_checked = True
+                status.wm_order = wm_futures[order_no].result()
+            statuses.append(status)
+            if pbar is not None:
+                pbar.update()
+    return statuses
+
+
+def statuses_to_dataframe(statuses: Iterable[OrderStatus]) -> pd.DataFrame:
+    """Returns one row per checked order for the report."""
+    return pd.DataFrame(
+        [
+            {
+                'Order_No': status.order_no,
+                'Swap_ID': status.swap_id,
+                'Flown_To_Swap': status.flown_to_swap,
+                'WM_Interface_ID': status.wm_order.interface_ID if status.wm_order else None,
+                'WM_Interface_Status': status.wm_order.interface_log_ID if status.wm_order else None,
+                'WM_Event_Message': status.wm_order.event_message if status.wm_order else None,
+            }
+            for status in statuses
+        ],
+        columns=['Order_No', 'Swap_ID', 'Flown_To_Swap', 'WM_Interface_ID', 'WM_Interface_Status', 'WM_Event_Message'],
+    )
+
+
+def order_list_processing(source: TextIO, plan_type: str, sessions: Optional[PortalSessions] = None) -> list[OrderStatus]:
+    """
+    Validates the orders listed in 'source' against swap and WM and writes
+    their statuses to a timestamped report.
+    """
+    order_ids = read_order_ids(source)
+    logger.info(f"Checking {len(order_ids)} {plan_type} orders.")
+    with RunTelemetry() as telemetry:
+        lookups = OrderLookups(NullJournal(), sessions, telemetry)
+        statuses = check_orders(lookups, order_ids, plan_type, telemetry.add_flow('order list', len(order_ids)))
+    lookups.log_summary()
+
+    not_flown = [status.order_no for status in statuses if status.flown_to_swap is False]
+    unchecked = [status.order_no for status in statuses if status.flown_to_swap is None]
+    wm_failed = [status.order_no for status in statuses if status.wm_order and status.wm_order.interface_log_ID == 'FAIL']
+    logger.info(f"Orders not found in swap: {', '.join(not_flown) or 'none'}")
+    logger.info(f"Orders failed at WM: {', '.join(wm_failed) or 'none'}")
+    if unchecked:
+        logger.warning(f"Orders that could not be checked in swap: {', '.join(unchecked)}")
+
+    report_name = f'OrderList_{datetime.now().strftime("%m_%d_%Y-%H_%M_%S")}.xlsx'
+    report_path = generate_xlsx_report({'order list': statuses_to_dataframe(statuses)}, report_name)
+    if report_path.exists():
+        logger.info(f"Report generated successfully! {report_path}")
+    return statuses
@@ -0,0 +1,138 @@
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+
+class RecordBatch:
+    """
+    Columnar batch of fixed-schema order records.
+
+    Every field listed in ``fields`` is stored as one numpy object array, so a
+    batch of N orders costs N pointers per field instead of N Python objects.
+    The arrays are handed to pandas as-is when converting to a DataFrame.
+
+    Subclasses only need to declare ``fields``.
+    """
+
+    __slots__ = ('_columns',)
+
+    fields: tuple[str, ...] = ()
+
+    def __init__(self, **columns: Iterable[Any]):
+        missing = set(self.fields) - set(columns)
+        if missing:
+            raise TypeError(f"Missing columns for {type(self).__name__}: {', '.join(sorted(missing))}")
+        self._columns = {name: _as_object_array(columns[name]) for name in self.fields}
+        lengths = {len(column) for column in self._columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns of {type(self).__name__} have different lengths: {lengths}")
+
+    @classmethod
+    def empty(cls):
+        """Returns a batch without any records."""
+        return cls(**{name: () for name in cls.fields})
+
+    @classmethod
+    def from_records(cls, records: Iterable[Any]):
+        """Builds a batch from objects exposing the batch fields as attributes."""
+        records = list(records)
+        return cls(**{name: [getattr(record, name) for record in records] for name in cls.fields})
+
+    def column(self, name: str) -> np.ndarray:
+        """Returns the underlying array of a single field."""
+        return self._columns[name]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Returns the batch as a DataFrame backed by the batch arrays."""
+        return pd.DataFrame(self._columns, copy=False)
+
+    def __len__(self) -> int:
+        if not self.fields:
+            return 0
+        return len(self._columns[self.fields[0]])
+
+    def __iter__(self) -> Iterator[tuple]:
+        return zip(*(self._columns[name] for name in self.fields))
+
+    def __getitem__(self, key):
+        """Selects records by boolean mask, index array or slice."""
+        return type(self)(**{name: column[key] for name, column in self._columns.items()})
+
+    def __add__(self, other: 'RecordBatch'):
+        if type(other) is not type(self):
+            return NotImplemented
+        return type(self)(**{
+            name: np.concatenate((self._columns[name], other._columns[name]))
+            for name in self.fields
+        })
+
+    def __repr__(self):
+        return f"{type(self).__name__}(records={len(self)})"
+
+
+class OrderBatch(RecordBatch):
+    """
+    Orders to be checked against a backend as ``(swap_id, original_id)`` pairs.
+
+    'swap_id' is the ID searched in the backend and 'original_id' is the
+    'Order_No' of the CMS report.
+    """
+
+    __slots__ = ()
+
+    fields = ('swap_id', 'original_id')
+
+    @property
+    def swap_ids(self) -> np.ndarray:
+        return self._columns['swap_id']
+
+    @property
+    def original_ids(self) -> np.ndarray:
+        return self._columns['original_id']
+
+    @classmethod
+    def from_order_ids(cls, order_ids: Iterable[str], plan_type: str):
+        """
+        Maps CMS order numbers to the IDs used in swap.
+
+        Orders starting with 'MOS' are kept as they are, the rest are prefixed
+        with 'HOS' for prepaid and 'MOS' for postpaid and the suffix starting
+        at 'A' is removed.
+        """
+        if plan_type == 'PREPAID':
+            prefix = 'HOS'
+        elif plan_type == 'POSTPAID':
+            prefix = 'MOS'
+        else:
+            raise ValueError(f"Unknown plan type {plan_type}")
+        original_ids = _as_object_array(order_ids)
+        if len(original_ids) == 0:
+            return cls.empty()
+        orders = pd.Series(original_ids, dtype=object, copy=False)
+        is_mos = orders.str.startswith('MOS').to_numpy(dtype=bool)
+        renamed = (prefix + orders.str.partition('A')[0]).to_numpy(dtype=object)
+        swap_ids = np.where(is_mos, original_ids, renamed)
+        return cls(swap_id=swap_ids, original_id=original_ids)
+
+
+class WMOrderBatch(RecordBatch):
+    """Orders fetched from WM, one column per :obj:`wm_portal.WMOrder` field."""
+
+    __slots__ = ()
+
+    fields = ('order_ID', 'interface_ID', 'interface_log_ID', 'event_message')
+
+
+def _as_object_array(values: Iterable[Any]) -> np.ndarray:
+    """Returns values as a 1-d numpy object array, without copying if possible."""
+    if isinstance(values, np.ndarray) and values.dtype == object:
+        return values
+    if isinstance(values, pd.Series):
+        return values.to_numpy(dtype=object)
+    if not isinstance(values, (list, tuple, np.ndarray)):
+        values = list(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
@@ -0,0 +1,92 @@
+from collections.abc import Iterable, Mapping
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from flows import FlowOrders
+from wm_portal import WMOrder
+
+
+# Outcome of every order, the ones other than 'ok' are reported.
+OUTCOMES = ('ok', 'not_flown_to_swap', 'wm_failed', 'unverified')
+WM_COLUMNS = ('wm_order_id', 'wm_interface_id', 'wm_status', 'wm_message')
+
+
+def build_status_table(flows: Iterable[FlowOrders], swap_total_records: Mapping[str, int],
+                       wm_orders: Mapping[str, Optional[WMOrder]], unverified_wm_orders: set[str],
+                       cms_columns: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    Returns one row per checked order and flow, in flow order, with:
+
+    - flow, backend, report, Order_No, swap_id and lookup_id
+    - the 'cms_columns' of the first report row of the order
+    - swap_records and swap_state (found, not_found or error) for swap flows
+    - the WM_COLUMNS and wm_state (found, missing or error) for WM flows
+    - outcome, one of OUTCOMES, and its detail
+
+    The lookups are joined to the orders with one merge per backend instead of
+    a scan per flow.
+    """
+    columns = ('flow', 'backend', 'report', 'Order_No', 'swap_id', 'lookup_id')
+    frames = []
+    for flow in flows:
+        if len(flow.orders) == 0:
+            continue
+        orders = pd.DataFrame({
+            'flow': flow.name,
+            'backend': flow.info.backend,
+            'report': flow.report.name,
+            'Order_No': flow.orders.original_ids,
+            'swap_id': flow.orders.swap_ids,
+            'lookup_id': flow.lookup_ids,
+        }).drop_duplicates('Order_No')
+        kept_columns = [column for column in cms_columns if column != 'Order_No' and column in flow.report.columns]
+        if kept_columns:
+            cms = flow.report.get_columns_reduced_dataframe(('Order_No', *kept_columns)).drop_duplicates('Order_No')
+            orders = orders.merge(cms, on='Order_No', how='left', sort=False)
+        frames.append(orders)
+    if not frames:
+        table = pd.DataFrame({column: pd.Series(dtype=object) for column in columns})
+    else:
+        table = pd.concat(frames, ignore_index=True)
+
+    swap = pd.DataFrame({
+        'backend': 'swap',
+        'lookup_id': pd.Series(list(swap_total_records), dtype=object),
+        'swap_records': pd.Series(list(swap_total_records.values()), dtype='Int64'),
+    })
+    found_wm_orders = [(order_id, order) for order_id, order in wm_orders.items() if order is not None]
+    wm = pd.DataFrame({
+        'backend': 'wm',
+        'lookup_id': pd.Series([order_id for order_id, _ in found_wm_orders], dtype=object),
+        'wm_order_id': pd.Series([order.order_ID for _, order in found_wm_orders], dtype=object),
+        'wm_interface_id': pd.Series([order.interface_ID for _, order in found_wm_orders], dtype=object),
+        'wm_status': pd.Series([order.interface_log_ID for _, order in found_wm_orders], dtype=object),
+        'wm_message': pd.Series([order.event_message for _, order in found_wm_orders], dtype=object),
+    })
+    table = table.merge(swap, on=['backend', 'lookup_id'], how='left', sort=False)
+    table = table.merge(wm, on=['backend', 'lookup_id'], how='left', sort=False)
+
+    is_swap = (table['backend'] == 'swap').to_numpy()
+    is_wm = ~is_swap
+    records = table['swap_records']
+    swap_found = (records > 0).to_numpy(dtype=bool, na_value=False)
+    swap_not_found = (records == 0).to_numpy(dtype=bool, na_value=False)
+    wm_error = is_wm & table['lookup_id'].isin(unverified_wm_orders).to_numpy()
+    wm_found = is_wm & table['wm_status'].notna().to_numpy()
+
+    table['swap_state'] = np.select(
+        [is_swap & swap_found, is_swap & swap_not_found, is_swap], ['found', 'not_found', 'error'], None)
+    table['wm_state'] = np.select([wm_error, wm_found, is_wm], ['error', 'found', 'missing'], None)
+    table['outcome'] = np.select(
+        [
+            is_swap & swap_not_found,
+            (is_swap & ~swap_found & ~swap_not_found) | wm_error,
+            wm_found & (table['wm_status'] == 'FAIL').to_numpy(dtype=bool, na_value=False),
+        ],
+        ['not_flown_to_swap', 'unverified', 'wm_failed'],
+        'ok',
+    )
+    table['detail'] = table['wm_message'].where(table['outcome'] == 'wm_failed', None)
+    return table
@@ -1,29 +1,66 @@
 from filter_dates import FilterDates
-from swap_portal import SwapDeliveryAuthenticatedPage
+from collections.abc import Callable, Iterable
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
+from pathlib import Path
+import time
+from typing import Optional, Union
+import numpy as np
 import pandas as pd
 from requests import Response
 
-from helper import generate_xlsx_report
+from checkpoint import CheckpointJournal, get_run_key
+from flows import FlowOrders, RunPlan, SkipRule, plan_lookups, plan_run, skip_orders
+from helper import generate_xlsx_report, get_report_path
+from lookup_priority import interleave_lookups, prioritize_lookups
+from lookups import OrderLookups, PortalSessions
+from order_records import OrderBatch, WMOrderBatch
+from order_status import WM_COLUMNS, build_status_table
+from profiling import profiler
+from request_log import get_request_log
+from results_store import ResultsStore, RunDiff, diff_outcomes
+from sharding import Shard, merge_shard_results, write_shard_results
+from run_budget import RunBudget
 from reports import (
+    MemoryBudget,
     Report,
     Filter,
     get_report,
 )
 from loggerfactory import LoggerFactory
+from telemetry import FlowProgress, RunTelemetry, telemetry_dir
 
-import enlighten
-
-from order_validation_config import REPORTS_INFO, REQUIRED_COLUMNS, RUN_FOR
-from wm_portal import WM
+from order_validation_config import (
+    DIFF_REPORT_MODE,
+    LOOKUP_PRIORITY,
+    MEMORY_BUDGET_MODE,
+    MEMORY_BUDGET_OUTPUT_COLUMNS,
+    ORDER_DATE_COLUMN,
+    PARTIAL_REPORT_SECONDS,
+    PRIORITY_HISTORY_DAYS,
+    REPORTS_INFO,
+    REQUIRED_COLUMNS,
+    RESULTS_STORE,
+    RETRY_BUDGET_RATIO,
+    RUN_DEADLINE_MINUTES,
+    RUN_FOR,
+    SKIP_RULES,
+    TELEMETRY_LOG_SECONDS,
+    WM_BULK_MODE,
+    WM_BULK_PAGE_SIZE,
+    WM_BULK_PREFIX_LENGTH,
+)
+from wm_portal import WMOrder
 
 
 logger = LoggerFactory.get_logger(__name__)
 
+DIFF_COLUMNS = ('Flow', 'Order_No', 'Outcome', 'Detail')
+
 
-def extract_swap_eligible_orders(report: Report, filters: list[Filter]=[]) -> list[tuple[str, str]]:
+def extract_swap_eligible_orders(report: Report, filters: list[Filter]=[]) -> OrderBatch:
     """
-    It applies filters if filters is not empty and returns list of tuples as following:
+    It applies filters if filters is not empty and returns an :obj:`OrderBatch` of pairs as following:
 
     (modified_order_id, original_order_id)
 
@@ -37,122 +74,434 @@ def extract_swap_eligible_orders(report: Report, filters: list[Filter]=[]) -> li
         logger.info('Filters applied!')
 
     logger.info(f"{report.name} Data\n{report.get_columns_reduced_dataframe(REQUIRED_COLUMNS).count()}")
-    order_ids = report.dataframe['Order_No'].values
-    if report.report_type.planType == "PREPAID":
-        swap_orders_ids = [(order, order) if order.startswith('MOS') else (f"HOS{order.split('A')[0]}", order) for order in order_ids]
-    elif report.report_type.planType == "POSTPAID":
-        swap_orders_ids = [(order, order) if order.startswith('MOS') else (f"MOS{order.split('A')[0]}", order) for order in order_ids]
-    return swap_orders_ids
+    return OrderBatch.from_order_ids(report.column('Order_No'), report.report_type.planType)
 
 
-def swap_orders_flow_filtering(responses: list[Response], orders_list: list[tuple[str, str]]) -> dict[str, list[tuple[str, str]]]:
+def swap_orders_flow_filtering(responses: list[Union[Response, dict]], orders_list: OrderBatch) -> dict[str, OrderBatch]:
     """
-    Filters the orders in responses whether flown to swap or not.
+    Filters the orders in responses whether flown to swap or not, orders whose
+    lookup failed (-1 records) are 'unverified'.
     """
-    responses_from_swap = dict()
+    total_records = np.zeros(len(orders_list), dtype=np.int64)
+    for index, response in enumerate(responses):
+        data = response if isinstance(response, dict) else response.json()
+        total_records[index] = data['iTotalDisplayRecords']
 
-    responses_from_swap["not_found"] = []
-    responses_from_swap["found"] = []
-
-    for response, order_records in zip(responses, orders_list):
-        try:
-            data = response.json()
-        except AttributeError as e:
-            logger.error(e)
-            data = response
-        if data['iTotalDisplayRecords'] > 0:
-            responses_from_swap["found"].append(order_records)
-        else:
-            responses_from_swap["not_found"].append(order_records)
+    responses_from_swap = dict()
+    responses_from_swap["not_found"] = orders_list[total_records == 0]
+    responses_from_swap["found"] = orders_list[total_records > 0]
+    responses_from_swap["unverified"] = orders_list[total_records < 0]
     return responses_from_swap
 
 
-def order_processing(filter_dates: FilterDates, save_fetched_reports: bool):
+def lookup_swap_orders(lookups: OrderLookups, swap_ids: Iterable[str], pbar,
+                       total_records: Optional[dict[str, int]] = None,
+                       on_lookup: Optional[Callable[[], None]] = None) -> dict[str, int]:
+    """
+    Searches every swap ID in swap and returns the total records found for each
+    of them, -1 when the lookup failed.
+    Orders already checked in this run or in the journal are not requested again.
+    Results are added to 'total_records' as they arrive and 'on_lookup' is
+    called after each, e.g. to write partial reports.
+    """
+    total_records = {} if total_records is None else total_records
+    for swap_order_id in swap_ids:
+        total = lookups.swap_total_records(swap_order_id)
+        total_records[swap_order_id] = -1 if total is None else total
+        pbar.update(force=True)
+        if on_lookup is not None:
+            on_lookup()
+    return total_records
+
+
+def lookup_wm_orders(lookups: OrderLookups, order_ids: Iterable[str], pbar,
+                     orders: Optional[dict[str, Optional[WMOrder]]] = None,
+                     on_lookup: Optional[Callable[[], None]] = None) -> dict[str, Optional[WMOrder]]:
+    """
+    Fetches every order from WM and returns them by order ID, None for the ones not found.
+    Orders already checked in this run or in the journal are not requested again.
+    Results are added to 'orders' as they arrive and 'on_lookup' is called after each.
+    """
+    orders = {} if orders is None else orders
+    for order_id in order_ids:
+        orders[order_id] = lookups.wm_order(order_id)
+        pbar.update(force=True)
+        if on_lookup is not None:
+            on_lookup()
+    return orders
+
+
+def order_processing(filter_dates: FilterDates, save_fetched_reports: bool, resume: bool = False,
+                     shard: Optional[Shard] = None, sessions: Optional[PortalSessions] = None) -> 'ValidationResults':
     """The main logic for order processing and validation.
     Checks for both swap order flow and wm order status.
+
+    Every lookup is written to a checkpoint journal, when 'resume' is set the
+    journal of the previous run for the same dates is replayed and only the
+    orders not checked yet are looked up.
+
+    When 'shard' is given only the orders of that shard are checked and the
+    partial results are written for :func:`merge_shards` instead of the report.
+
+    Already logged in 'sessions' are reused instead of logging in again.
+
+    The run stops sending lookups after RUN_DEADLINE_MINUTES and the orders
+    left are reported as unverified.
     """
-    orders_not_flown_to_swap: list[tuple[str, str]] = []
-    dataframes: dict[str, pd.DataFrame] = {}
-    swap_delivery_page = SwapDeliveryAuthenticatedPage()
-    wm_failed_orders = []
-
-    for report_name in RUN_FOR:
-        try:
-            selected_report_info = REPORTS_INFO[report_name]
-        except KeyError as keyerror:
-            logger.error(f"Report {keyerror.args[0]} not found. Make sure RUN_FOR is a tuple!")
-            raise SystemExit
-        report_type = selected_report_info.report_type
-        report_filters = selected_report_info.filters
-
-        report = get_report(report_type, filter_dates, save_fetched_reports)
-        manager = enlighten.get_manager()
-
-        # WM order processing and validation
-        if report_name == 'wm prepaid':
-            for filter in report_filters:
-                report.filter(filter)
-            order_ids = report.dataframe['Order_No'].values
-            total_orders_count = len(order_ids)
-            if total_orders_count == 0:
-                continue
-            pbar = manager.counter(total=total_orders_count, desc=report_name)
-            wm = WM()
-            for order_id in order_ids:
-                order = wm.fetch(order_id)
-                if order is None:
-                    continue
-                if order.interface_log_ID == 'FAIL':
-                    wm_failed_orders.append(order)
-                pbar.update(force=True)
-            if wm_failed_orders:
-                df = pd.DataFrame([x.__dict__ for x in wm_failed_orders])
-                dataframes[report_name] = df
-            continue
-
-        # Swap order processing
-        orders_to_check = extract_swap_eligible_orders(report, report_filters)
-
-        total_orders_count = len(orders_to_check)
-        if total_orders_count == 0:
-            continue
-        pbar = manager.counter(total=total_orders_count, desc=report_name)
-
-        responses = []
-        for swap_order_id, _ in orders_to_check:
-            response = swap_delivery_page.get_order(swap_order_id)
-            if not response:
-                responses.append({'iTotalDisplayRecords': -1})
-            else:
-                responses.append(response)
-            pbar.update(force=True)
-
-        swap_flown_data = swap_orders_flow_filtering(responses, orders_to_check)
-
-        orders_not_found = swap_flown_data['not_found']
-        if orders_not_found:
-            orders_not_flown_to_swap.extend(orders_not_found)
-            original_order_ids = list(map(lambda order_tuple: order_tuple[1], orders_not_found))
-            filtered_dataframe = report.get_filtered_dataframe_by_orderNos(original_order_ids)
-            try:
-                df = dataframes[report.name]
-                dataframes[report.name] = pd.concat([df, filtered_dataframe])
-            except KeyError:
-                dataframes[report.name] = filtered_dataframe
-        # save_json_data(swap_flown_data, report_name)
-
-    if orders_not_flown_to_swap:
-        logger.info(f"Orders not found in swap: {', '.join(map(lambda x: x[0], orders_not_flown_to_swap))}")
+    journal_suffix = f'-{shard.file_name()}' if shard else ''
+    with profiler.span('run'):
+        with CheckpointJournal.for_run(filter_dates, resume=resume, suffix=journal_suffix) as journal, \
+                get_run_telemetry(filter_dates, journal_suffix) as telemetry:
+            budget = get_run_budget()
+            lookups = OrderLookups(journal, sessions, telemetry, budget)
+            results = validate_reports(filter_dates, save_fetched_reports, lookups, shard)
+        lookups.log_summary()
+        budget.log_summary()
+        get_request_log().flush()
+        finish_run(results, filter_dates, shard)
+    return results
+
+
+def get_run_telemetry(filter_dates: FilterDates, suffix: str = '') -> RunTelemetry:
+    """Returns the progress and telemetry of the run for the given date range."""
+    started = datetime.now().strftime('%Y%m%d%H%M%S')
+    log_path = telemetry_dir / f'{get_run_key(filter_dates)}{suffix}-{started}.jsonl'
+    return RunTelemetry(log_path=log_path, log_every=TELEMETRY_LOG_SECONDS)
+
+
+def get_run_budget() -> RunBudget:
+    """Returns the deadline and retry budget of a run, see RUN_DEADLINE_MINUTES and RETRY_BUDGET_RATIO."""
+    deadline = None if RUN_DEADLINE_MINUTES is None else RUN_DEADLINE_MINUTES * 60
+    return RunBudget(deadline=deadline, retry_ratio=RETRY_BUDGET_RATIO)
+
+
+@dataclass
+class ValidationResults:
+    """
+    Orders not flown to swap, orders failed at WM, orders that could not be
+    checked and the report sheets for them.
+
+    'order_outcomes' keeps every failed or unverified order as
+    ``(flow, order_no, outcome, detail)`` and 'checked_orders' the number of
+    orders checked per flow, for the results store. 'checked_order_nos' are
+    the Order_No checked or settled by a skip rule, for the diff reports.
+    'status' is the per-order status table the results were read from.
+    """
+    orders_not_flown_to_swap: OrderBatch = field(default_factory=OrderBatch.empty)
+    wm_failed_orders: list[WMOrder] = field(default_factory=list)
+    unverified_orders: list[tuple[str, str]] = field(default_factory=list)
+    dataframes: dict[str, pd.DataFrame] = field(default_factory=dict)
+    order_outcomes: list[tuple[str, str, str, Optional[str]]] = field(default_factory=list)
+    checked_orders: dict[str, int] = field(default_factory=dict)
+    checked_order_nos: set[str] = field(default_factory=set)
+    status: Optional[pd.DataFrame] = None
+
+    def add_unverified(self, report_name: str, order_ids: Iterable[str]):
+        """Keeps the orders of a flow that could not be checked, e.g. after the run deadline."""
+        order_ids = list(order_ids)
+        if not order_ids:
+            return
+        self.order_outcomes.extend((report_name, order_id, 'unverified', None) for order_id in order_ids)
+        self.add_unverified_rows([(report_name, order_id) for order_id in order_ids])
+
+    def add_unverified_rows(self, unverified: list[tuple[str, str]]):
+        if not unverified:
+            return
+        self.unverified_orders.extend(unverified)
+        self.dataframes['unverified'] = pd.DataFrame(self.unverified_orders, columns=['Flow', 'Order_No'])
+
+    @classmethod
+    def from_status(cls, status: pd.DataFrame, flows: Iterable[FlowOrders]) -> 'ValidationResults':
+        """
+        Returns the results of a run from its per-order status table, see
+        :func:`order_status.build_status_table`. Every output is read from the
+        table: swap sheets take the report rows of the orders not flown, WM
+        sheets the failed interfaces and the 'unverified' sheet the rest.
+        """
+        results = cls(status=status)
+        flows = list(flows)
+        reports = {flow.report.name: flow.report for flow in flows}
+        for flow in flows:
+            results.checked_orders[flow.name] = len(flow.orders)
+            results.checked_order_nos.update(flow.orders.original_ids, flow.skipped.original_ids)
+
+        failed = status[status['outcome'] != 'ok']
+        results.order_outcomes = list(zip(
+            failed['flow'], np.where(failed['outcome'] == 'wm_failed', failed['wm_order_id'], failed['Order_No']),
+            failed['outcome'], failed['detail'].astype(object).where(failed['detail'].notna(), None),
+        ))
+
+        not_flown = failed[failed['outcome'] == 'not_flown_to_swap']
+        results.orders_not_flown_to_swap = OrderBatch(
+            swap_id=not_flown['swap_id'].to_numpy(dtype=object), original_id=not_flown['Order_No'].to_numpy(dtype=object))
+        for report_name, orders in not_flown.groupby('report', sort=False):
+            report = reports[report_name]
+            report_rows = pd.DataFrame({'Order_No': report.column('Order_No'), 'position': report.positions()})
+            positions = orders[['Order_No']].merge(report_rows, on='Order_No', sort=False)['position']
+            results.dataframes[report_name] = report.take(positions.to_numpy())
+
+        wm_failed = failed[failed['outcome'] == 'wm_failed']
+        results.wm_failed_orders = [
+            WMOrder(*row) for row in wm_failed[list(WM_COLUMNS)].itertuples(index=False, name=None)
+        ]
+        for flow_name, orders in wm_failed.groupby('flow', sort=False):
+            results.dataframes[flow_name] = WMOrderBatch(**{
+                field_name: orders[column].to_numpy(dtype=object)
+                for field_name, column in zip(WMOrderBatch.fields, WM_COLUMNS)
+            }).to_dataframe()
+
+        unverified = failed[failed['outcome'] == 'unverified']
+        results.add_unverified_rows(list(zip(unverified['flow'], unverified['Order_No'])))
+        return results
+
+    def summary(self) -> dict:
+        """Returns the failed orders as plain data, e.g. for a JSON response."""
+        return {
+            'orders_not_flown_to_swap': self.orders_not_flown_to_swap.original_ids.tolist(),
+            'wm_failed_orders': [asdict(order) for order in self.wm_failed_orders],
+            'unverified_orders': [
+                {'flow': report_name, 'order_no': order_no} for report_name, order_no in self.unverified_orders
+            ],
+        }
+
+
+class PartialReports:
+    """
+    Writes the failures found so far to one partial report, replaced every
+    'every' seconds while the lookups run, so a run cut short or stopped
+    still leaves its most useful answers. The partial report is removed once
+    the run ends normally and writes its own report.
+
+    'swap_total_records' and 'wm_orders' are the dicts the lookups fill in.
+    The asyncio engine writes from a worker thread instead of :meth:`tick`,
+    passing a :meth:`snapshot` taken on the event loop to :meth:`write`.
+
+    Usage::
+
+      partial = PartialReports(flows, swap_total_records, wm_orders, lookups.unverified_wm_orders, every=300)
+      lookup_swap_orders(lookups, swap_ids, pbar, swap_total_records, partial.tick)
+      partial.discard()
+    """
+
+    def __init__(self, flows: list[FlowOrders], swap_total_records: dict[str, int],
+                 wm_orders: dict[str, Optional[WMOrder]], unverified_wm_orders: set[str], every: Optional[float]):
+        self.flows = flows
+        self.swap_total_records = swap_total_records
+        self.wm_orders = wm_orders
+        self.unverified_wm_orders = unverified_wm_orders
+        self.every = every
+        self.report_name = f'Report_{datetime.now().strftime("%m_%d_%Y-%H_%M_%S")}_partial.xlsx'
+        self.path: Optional[Path] = None
+        self._last_flush = time.monotonic()
+
+    def tick(self):
+        """Writes the partial report when 'every' seconds passed since the last one."""
+        if self.every is None or time.monotonic() - self._last_flush < self.every:
+            return
+        self.flush()
+
+    def flush(self):
+        self.write(*self.snapshot())
+
+    def snapshot(self) -> tuple[dict[str, int], dict[str, Optional[WMOrder]], set[str]]:
+        """Returns copies of the lookup results so far, safe to read while the lookups go on."""
+        return dict(self.swap_total_records), dict(self.wm_orders), set(self.unverified_wm_orders)
+
+    def write(self, swap_total_records: dict[str, int], wm_orders: dict[str, Optional[WMOrder]],
+              unverified_wm_orders: set[str]):
+        """Writes the partial report of the given lookup results."""
+        self._last_flush = time.monotonic()
+        status = build_status_table(self.flows, swap_total_records, wm_orders, unverified_wm_orders, REQUIRED_COLUMNS)
+        is_swap = status['backend'] == 'swap'
+        looked_up = (is_swap & status['lookup_id'].isin(list(swap_total_records))) | \
+            (~is_swap & status['lookup_id'].isin(list(wm_orders)))
+        results = ValidationResults.from_status(status[looked_up], self.flows)
+        if not results.dataframes:
+            return
+        with profiler.span('write partial xlsx'):
+            path = generate_xlsx_report(results.dataframes, self.report_name)
+        if path.exists():
+            self.path = path
+            logger.info(f"Partial report of {int(looked_up.sum())} checked orders with "
+                        f"{len(results.order_outcomes)} failures written to {path}")
+
+    def discard(self):
+        """Removes the partial report, the final report replaces it."""
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+            self.path = None
+
+
+def finish_run(results: ValidationResults, filter_dates: FilterDates, shard: Optional[Shard] = None):
+    """Logs the outcome of the run, records it in the results store and writes the report or the shard results."""
+    if len(results.orders_not_flown_to_swap):
+        logger.info(f"Orders not found in swap: {', '.join(results.orders_not_flown_to_swap.swap_ids)}")
     else:
         logger.info("All orders flown to swap successfully!")
 
-    if wm_failed_orders:
+    if results.wm_failed_orders:
         logger.info("Some orders fail at WM")
     else:
         logger.info("No orders fail at WM")
 
-    if orders_not_flown_to_swap or wm_failed_orders:
-        report_name_w_ext = f'Report_{datetime.now().strftime("%m_%d_%Y-%H_%M_%S")}.xlsx'
+    if results.unverified_orders:
+        logger.warning(f"{len(results.unverified_orders)} orders could not be verified, see the unverified sheet.")
+
+    run_id = None
+    if RESULTS_STORE:
+        store = ResultsStore()
+        run_id = store.record_run(results, filter_dates, str(shard) if shard else None)
+
+    if shard is not None:
+        write_shard_results(results.dataframes, shard, get_run_key(filter_dates))
+    elif DIFF_REPORT_MODE and run_id is not None:
+        previous_outcomes = store.previous_outcomes(run_id)
+        if previous_outcomes is None:
+            logger.info("No previous run to compare with, every failure is new.")
+        write_report_diff(diff_outcomes(previous_outcomes or [], results.order_outcomes, results.checked_order_nos),
+                          results.dataframes)
+    elif len(results.orders_not_flown_to_swap) or results.wm_failed_orders or results.unverified_orders:
+        write_report(results.dataframes)
+
+
+def merge_shards(filter_dates: FilterDates):
+    """Combines the partial results of a sharded run into the final report."""
+    dataframes = merge_shard_results(get_run_key(filter_dates))
+    if any(len(df) for df in dataframes.values()):
+        write_report(dataframes)
+    else:
+        logger.info("No failed orders in any shard.")
+
+
+def write_report(dataframes: dict[str, pd.DataFrame]):
+    """Writes the dataframes to a timestamped report."""
+    report_name_w_ext = f'Report_{datetime.now().strftime("%m_%d_%Y-%H_%M_%S")}.xlsx'
+    with profiler.span('write xlsx'):
         report_path = generate_xlsx_report(dataframes, report_name_w_ext)
+    if report_path.exists():
+        logger.info(f"Report generated successfully! {report_path}")
+
+
+def write_report_diff(diff: RunDiff, dataframes: dict[str, pd.DataFrame]):
+    """
+    Writes the change since the previous run: the report sheets narrowed to the
+    new failures, and the resolved and persistent orders as compact csv files.
+    """
+    logger.info(f"{len(diff.new)} new, {len(diff.resolved)} resolved and {len(diff.persistent)} persistent "
+                f"failures since the previous run, {diff.not_rechecked} previous failures not checked again.")
+    report_name = f'Report_{datetime.now().strftime("%m_%d_%Y-%H_%M_%S")}'
+    new_order_nos = {str(order_no) for _, order_no, _, _ in diff.new}
+    if new_order_nos:
+        new_dataframes = {}
+        for sheet_name, df in dataframes.items():
+            order_column = next((column for column in ('Order_No', 'order_ID') if column in df.columns), None)
+            if order_column is None:
+                continue
+            new_rows = df[df[order_column].astype(str).isin(new_order_nos)]
+            if len(new_rows):
+                new_dataframes[sheet_name] = new_rows
+        with profiler.span('write xlsx'):
+            report_path = generate_xlsx_report(new_dataframes, f'{report_name}_new.xlsx')
         if report_path.exists():
-            logger.info(f"Report generated successfully! {report_path}")
+            logger.info(f"New failures written to {report_path}")
+    for change, outcomes in (('resolved', diff.resolved), ('persistent', diff.persistent)):
+        if outcomes:
+            csv_path = get_report_path(f'{report_name}_{change}.csv')
+            pd.DataFrame(outcomes, columns=DIFF_COLUMNS).to_csv(csv_path, index=False)
+            logger.info(f"{change.capitalize()} orders written to {csv_path}")
+
+
+def get_memory_budget() -> Optional[MemoryBudget]:
+    """Returns how reports are compacted when MEMORY_BUDGET_MODE is on, otherwise None."""
+    if not MEMORY_BUDGET_MODE:
+        return None
+    filter_columns = [
+        filter.columnName for report_name in RUN_FOR for filter in REPORTS_INFO[report_name].filters
+    ]
+    filter_columns.extend(rule.filter.columnName for rule in SKIP_RULES)
+    if 'oldest_first' in LOOKUP_PRIORITY:
+        filter_columns.append(ORDER_DATE_COLUMN)
+    return MemoryBudget(keep_columns=tuple(dict.fromkeys((*MEMORY_BUDGET_OUTPUT_COLUMNS, *filter_columns))))
+
+
+def select_flow_orders(plan: RunPlan, reports: dict[tuple, Report], shard: Optional[Shard] = None,
+                       skip_rules: Optional[Iterable[SkipRule]] = None) -> list[FlowOrders]:
+    """
+    Applies the filters of every flow of the plan to a view of its report and
+    returns the orders to check, without the orders a skip rule (SKIP_RULES by
+    default) settles.
+    """
+    skip_rules = SKIP_RULES if skip_rules is None else skip_rules
+    flows = []
+    for flow_name, report_info in plan.flows.items():
+        with profiler.span(f'flow:{flow_name}'):
+            report = reports[plan.report_key(flow_name)].view()
+            orders = extract_swap_eligible_orders(report, report_info.filters)
+            in_shard = shard.mask(orders.original_ids) if shard is not None else None
+            orders, skipped, skipped_by_reason = skip_orders(report, orders, skip_rules, report_info.backend, in_shard)
+            if skipped_by_reason:
+                logger.info(f"Skipped {len(skipped)} {flow_name} orders: "
+                            f"{', '.join(f'{count} {reason}' for reason, count in skipped_by_reason.items())}")
+            flows.append(FlowOrders(flow_name, report_info, report, orders, skipped))
+    return flows
+
+
+def collect_results(flows: list[FlowOrders], swap_total_records: dict[str, int],
+                    wm_orders: dict[str, Optional[WMOrder]], unverified_wm_orders: set[str]) -> ValidationResults:
+    """Returns the failed and unverified orders of every flow, in flow order, from the lookups of the run."""
+    with profiler.span('collect results'):
+        status = build_status_table(flows, swap_total_records, wm_orders, unverified_wm_orders, REQUIRED_COLUMNS)
+        return ValidationResults.from_status(status, flows)
+
+
+def validate_reports(filter_dates: FilterDates, save_fetched_reports: bool, lookups: OrderLookups,
+                     shard: Optional[Shard] = None) -> ValidationResults:
+    """
+    Runs every flow in RUN_FOR through its backend and returns the orders
+    not flown to swap, the orders failed at WM and the dataframes for the report.
+
+    Every report is downloaded once however many flows read it and every
+    backend looks up the distinct IDs of all flows once. Swap and WM lookups
+    share one queue, taking turns in the order of LOOKUP_PRIORITY.
+    """
+    plan = plan_run(RUN_FOR, REPORTS_INFO)
+    with profiler.span('get reports'):
+        reports = {
+            key: get_report(report_type, filter_dates, save_fetched_reports, get_memory_budget())
+            for key, report_type in plan.downloads.items()
+        }
+    with profiler.span('select orders'):
+        flows = select_flow_orders(plan, reports, shard)
+    lookup_ids = prioritize_run_lookups(flows, plan_lookups(flows))
+
+    swap_total_records, wm_orders = {}, {}
+    partial = PartialReports(flows, swap_total_records, wm_orders, lookups.unverified_wm_orders, PARTIAL_REPORT_SECONDS)
+    pbars = add_lookup_progress(lookups.telemetry, lookup_ids)
+    if WM_BULK_MODE and lookup_ids['wm']:
+        lookups.prefetch_wm_orders(lookup_ids['wm'], WM_BULK_PREFIX_LENGTH, WM_BULK_PAGE_SIZE)
+    with profiler.span('lookups'):
+        for backend, lookup_id in interleave_lookups(lookup_ids):
+            if backend == 'swap':
+                lookup_swap_orders(lookups, (lookup_id, ), pbars['swap'], swap_total_records, partial.tick)
+            else:
+                lookup_wm_orders(lookups, (lookup_id, ), pbars['wm'], wm_orders, partial.tick)
+    partial.discard()
+    return collect_results(flows, swap_total_records, wm_orders, lookups.unverified_wm_orders)
+
+
+def add_lookup_progress(telemetry: RunTelemetry, lookup_ids: dict[str, list[str]]) -> dict[str, FlowProgress]:
+    """
+    Starts the progress of every backend with lookups before the first one is
+    sent, so the run-wide totals and ETA count the work of every backend.
+    """
+    return {
+        backend: telemetry.add_flow(f'{backend} lookups', len(ids))
+        for backend, ids in lookup_ids.items() if ids
+    }
+
+
+def prioritize_run_lookups(flows: list[FlowOrders], lookup_ids: dict[str, list[str]]) -> dict[str, list[str]]:
+    """Sorts the lookups of the run by LOOKUP_PRIORITY, reading the past runs from the results store."""
+    with profiler.span('prioritize lookups'):
+        return prioritize_lookups(flows, lookup_ids, LOOKUP_PRIORITY, ResultsStore() if RESULTS_STORE else None,
+                                  PRIORITY_HISTORY_DAYS, ORDER_DATE_COLUMN)
@@ -1,51 +1,101 @@
-from dataclasses import dataclass
+from pathlib import Path
 
-from reports import (
-    ReportType,
-    Filter
-)
+from flows import ReportInfo, load_flows, load_skip_rules
 
 
 REQUIRED_COLUMNS = ('Order_No', 'Order_Delivery_Status', 'Order_Cancellation_Status', 'Package_Type', 'Fulfillment_Mode')
-RUN_FOR = ('hotlink prepaid', 'hotlink postpaid', 'maxis postpaid', 'preorder postpaid instore', 'wm prepaid')
-# RUN_FOR = ('preorder postpaid instore', )
-
-
-@dataclass
-class ReportInfo:
-    report_type: ReportType
-    filters: list[Filter]
-
-
-REPORTS_INFO = {
-    'hotlink prepaid': ReportInfo(**{
-        'report_type': ReportType('PREPAID'),
-        'filters': [],
-    }),
-    'hotlink postpaid': ReportInfo(**{
-        'report_type': ReportType('POSTPAID', 'hotlink postpaid'),
-        'filters': [
-            Filter('Fulfillment_Mode', 'exists', ('Standard Delivery', )),
-            Filter('Order_Delivery_Status', 'notExists', ('fulfilled', )),
-        ],
-    }),
-    'maxis postpaid': ReportInfo(**{
-        'report_type': ReportType('POSTPAID', 'maxis postpaid'),
-        'filters': [
-            Filter('Fulfillment_Mode', 'exists', ('Standard Delivery', )),
-            Filter('Order_Delivery_Status', 'notExists', ('fulfilled', )),
-        ],
-    }),
-    'preorder postpaid instore': ReportInfo(**{
-        'report_type': ReportType('POSTPAID', 'maxis postpaid'),
-        'filters': [
-            Filter('Fulfillment_Mode', 'exists', ('In-Store Pickup', )),
-            Filter('Package_Type', 'exists', ('Device + Plan', )),
-            Filter('Order_Type', 'exists', ('Pre Order', )),
-        ],
-    }),
-    'wm prepaid': ReportInfo(**{
-        'report_type': ReportType('PREPAID'),
-        'filters': [Filter('Order_No', 'contains', ('MOS', ))],
-    }),
-}
+
+# Flows are defined in flows.yml: the report, filters, backend and ID mapping of
+# every flow and the flows to run, and the skip rules of orders whose cms status
+# already settles the outcome (none by default).
+FLOWS_PATH = Path(__file__).parent / 'flows.yml'
+REPORTS_INFO, RUN_FOR = load_flows(FLOWS_PATH)
+SKIP_RULES = load_skip_rules(FLOWS_PATH)
+
+# Maximum number of requests in flight per backend when running on asyncio (--async).
+CMS_CONCURRENCY = 2
+SWAP_CONCURRENCY = 8
+WM_CONCURRENCY = 4
+
+# Connection pools, sized to the concurrency above so every thread or task has a
+# keep-alive connection per host. With POOL_BLOCK a request waits for a free
+# connection instead of opening one that is discarded afterwards. Idle connections
+# of the asyncio clients are closed after POOL_KEEPALIVE_SECONDS.
+CMS_POOL_SIZE = CMS_CONCURRENCY
+SWAP_POOL_SIZE = SWAP_CONCURRENCY
+WM_POOL_SIZE = WM_CONCURRENCY
+POOL_BLOCK = True
+POOL_KEEPALIVE_SECONDS = 30
+# Seconds to connect to and read the cms report export.
+CMS_TIMEOUT_SECONDS = (10, 300)
+
+# Run deadline and retry budget: lookups not sent RUN_DEADLINE_MINUTES after the run
+# started are skipped and their orders reported as unverified instead of blocking the
+# report, and Swap and WM retries stop once they exceed RETRY_BUDGET_RATIO of the
+# requests sent (e.g. 0.1 for at most 10% extra requests). None disables either limit.
+RUN_DEADLINE_MINUTES = None
+RETRY_BUDGET_RATIO = 0.1
+
+# Lookup priority: the order Swap and WM lookups are sent in, so a run cut short by
+# RUN_DEADLINE_MINUTES has checked the most useful orders first. Swap and WM take turns,
+# one lookup each (the asyncio engine runs both at once). Keys, applied in turn:
+#   previous_failures    orders failed in the results store in the last PRIORITY_HISTORY_DAYS days
+#   failure_prone_flows  orders of the flows with the highest failure rate over those days
+#   oldest_first         orders with the oldest ORDER_DATE_COLUMN of the cms report
+# An empty tuple keeps the report order. While lookups run the failures found so far are
+# written to a partial report every PARTIAL_REPORT_SECONDS (None to only write the final report).
+LOOKUP_PRIORITY = ('previous_failures', 'failure_prone_flows', 'oldest_first')
+PRIORITY_HISTORY_DAYS = 30
+ORDER_DATE_COLUMN = 'Order_Created_Date'
+PARTIAL_REPORT_SECONDS = 300
+
+# Record the failed and unverified orders of every run in reports/history/results.sqlite3,
+# queried with --history, --repeat-failures and --trend.
+RESULTS_STORE = True
+# Diff report mode: instead of a full report repeating every outstanding order, compare
+# the run by Order_No with the previous run in the results store and only write the new
+# failures as a report and the resolved and persistent orders as csv files.
+DIFF_REPORT_MODE = False
+
+# High volume logging: only one in REQUEST_LOG_SAMPLE_EVERY successful cms, Swap and WM
+# requests is logged, and a summary per backend with the number of requests, errors and
+# latency percentiles every REQUEST_LOG_SUMMARY_SECONDS and at the end of the run. Failed
+# requests are always logged in full. Off logs one line per request.
+HIGH_VOLUME_LOGGING = False
+REQUEST_LOG_SAMPLE_EVERY = 100
+REQUEST_LOG_SUMMARY_SECONDS = 60
+
+# Seconds between the run telemetry lines written to reports/telemetry/.
+TELEMETRY_LOG_SECONDS = 30
+
+# Processes parsing cms report exports and bulk WM pages, so parsing runs on other cores
+# while the lookup threads keep the backends busy. Single WM order pages are always parsed
+# on the calling thread, sending them to a process costs more than parsing them.
+# 0 parses everything on the calling thread, e.g. 2 helps large reports and bulk WM runs.
+PARSE_PROCESSES = 0
+
+# Bulk WM mode: fetch the order details table in pages of WM_BULK_PAGE_SIZE rows, one
+# search per order ID prefix of WM_BULK_PREFIX_LENGTH characters, and match the rows
+# locally. Orders missing from the pages are still fetched one by one.
+WM_BULK_MODE = False
+WM_BULK_PREFIX_LENGTH = 8
+WM_BULK_PAGE_SIZE = 100
+
+# Memory budget mode: right after parsing, master reports keep only the columns used
+# by the filters of RUN_FOR and MEMORY_BUDGET_OUTPUT_COLUMNS, text columns with few
+# distinct values become categoricals and Order_No uses Arrow backed strings when
+# pyarrow is installed. The failed order sheets then only show the kept columns.
+MEMORY_BUDGET_MODE = False
+MEMORY_BUDGET_OUTPUT_COLUMNS = REQUIRED_COLUMNS + ('Order_Type', )
+
+# Total size in memory of the parsed reports kept for later flows and runs, the least
+# recently used reports are evicted beyond it.
+REPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Service mode (--serve): the HTTP API listens on SERVICE_HOST:SERVICE_PORT, the default
+# window is validated every SERVICE_SCHEDULE_MINUTES (None to only run on request) and
+# portal sessions are logged in again after SERVICE_SESSION_MAX_AGE_MINUTES.
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8765
+SERVICE_SCHEDULE_MINUTES = 24 * 60
+SERVICE_SESSION_MAX_AGE_MINUTES = 30
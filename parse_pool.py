@@ -0,0 +1,133 @@
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import io
+import multiprocessing
+import threading
+from typing import Any, Optional, TypeVar
+
+import numpy as np
+import pandas as pd
+
+from loggerfactory import LoggerFactory
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+T = TypeVar('T')
+
+# Text columns are sent back as codes into their distinct values when these are at
+# most this share of the rows, e.g. statuses, plan types and fulfillment modes.
+MAX_DISTINCT_RATIO = 0.5
+# Order details table cells kept per row: order ID, interface ID, status and message.
+ORDER_ROW_CELLS = (2, 4, 5, 6)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Returns the process pool parsing cms reports and WM pages, started on first
+    use with PARSE_PROCESSES workers, or None to parse on the calling thread.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Imported here because order_validation_config imports reports, which imports this module.
+            from order_validation_config import PARSE_PROCESSES
+            if not PARSE_PROCESSES:
+                return None
+            # Spawned workers only import this module, forking would copy the sessions and threads of the run.
+            _pool = ProcessPoolExecutor(PARSE_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+            logger.info(f"Started {PARSE_PROCESSES} parse processes.")
+    return _pool
+
+
+def shutdown_parse_pool():
+    """Stops the parse processes, the next parse starts them again."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def run_parser(parser: Callable[..., T], *args: Any) -> T:
+    """
+    Runs a module level parser in the parse pool and waits for its result, the
+    calling thread is free for the GIL meanwhile. Parses on the calling thread
+    when the pool is disabled or its processes died.
+    """
+    pool = get_parse_pool()
+    if pool is None:
+        return parser(*args)
+    try:
+        return pool.submit(parser, *args).result()
+    except BrokenProcessPool:
+        logger.warning("Parse processes stopped unexpectedly, parsing on the calling thread.")
+        shutdown_parse_pool()
+        return parser(*args)
+
+
+def encode_dataframe(dataframe: pd.DataFrame) -> list[tuple]:
+    """
+    Returns the columns of a dataframe as (name, dtype, values, distinct values)
+    in a form that pickles compactly: repetitive text columns become integer codes
+    into their distinct values instead of one string per row.
+    """
+    columns = []
+    for name in dataframe.columns:
+        series = dataframe[name]
+        if pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+            codes, uniques = pd.factorize(series, use_na_sentinel=True)
+            if len(uniques) <= MAX_DISTINCT_RATIO * len(series):
+                missing = np.flatnonzero(codes == -1)
+                # Code -1 picks the trailing missing value, kept as parsed (NaN or None).
+                na_value = series.iloc[missing[0]] if len(missing) else np.nan
+                values = np.append(np.asarray(uniques, dtype=object), np.array([na_value], dtype=object))
+                # The smallest signed type holding the codes and -1, e.g. int8 for up to 128 values.
+                codes = codes.astype(np.min_scalar_type(-max(len(uniques), 1)))
+                columns.append((name, series.dtype, codes, values))
+                continue
+        columns.append((name, series.dtype, series.to_numpy(), None))
+    return columns
+
+
+def decode_dataframe(columns: list[tuple]) -> pd.DataFrame:
+    """Rebuilds the dataframe of :func:`encode_dataframe`."""
+    decoded = {}
+    for name, dtype, values, uniques in columns:
+        if uniques is not None:
+            values = uniques[values.astype(np.intp)]
+        decoded[name] = pd.Series(values, dtype=dtype, copy=False)
+    return pd.DataFrame(decoded, copy=False)
+
+
+def parse_excel(buffer: bytes) -> list[tuple]:
+    """Parses a cms report export, returning its encoded columns."""
+    with io.BytesIO(buffer) as file_handler:
+        dataframe = pd.read_excel(file_handler)
+    return encode_dataframe(dataframe)
+
+
+def parse_order_table(html, last_row_only: bool = False) -> list[tuple[str, ...]]:
+    """
+    Returns the ORDER_ROW_CELLS of every complete row of the WM order details
+    table, or of its last row only, as plain tuples of text.
+    """
+    # Imported here so only the processes parsing WM pages load bs4 and lxml.
+    from bs4 import BeautifulSoup
+
+    tbody = BeautifulSoup(html, 'lxml').find('tbody')
+    if tbody is None:
+        return []
+    rows = tbody.find_all('tr')
+    if last_row_only:
+        rows = rows[-1:]
+    cells = []
+    for row in rows:
+        tds = row.find_all('td')
+        if len(tds) > max(ORDER_ROW_CELLS):
+            cells.append(tuple(tds[index].text for index in ORDER_ROW_CELLS))
+    return cells
@@ -0,0 +1,161 @@
+import cProfile
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+import threading
+import time
+
+from loggerfactory import LoggerFactory
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+
+@dataclass
+class SpanStats:
+    calls: int = 0
+    total_seconds: float = 0.0
+
+
+class StageProfiler:
+    """
+    Records nested timing spans of a run, e.g. ``run;select orders;flow:wm prepaid;filter``.
+
+    Spans are tracked per thread and per asyncio task, so concurrent lookups
+    nest under the stage that started them. Their times are summed, which can
+    add up to more than the wall time of the parent stage.
+
+    Recording is off until :meth:`enable` is called, spans cost a single
+    attribute check until then.
+
+    Usage::
+
+      from profiling import profiler
+
+      with profiler.span('cms download'):
+          ...
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stats: dict[tuple[str, ...], SpanStats] = {}
+        self._path: ContextVar[tuple[str, ...]] = ContextVar('profiler_path', default=())
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+
+    @contextmanager
+    def span(self, name: str):
+        """Times the enclosed block as a child of the current span."""
+        if not self.enabled:
+            yield
+            return
+        path = self._path.get() + (name, )
+        token = self._path.set(path)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._path.reset(token)
+            with self._lock:
+                stats = self.stats.setdefault(path, SpanStats())
+                stats.calls += 1
+                stats.total_seconds += elapsed
+
+    def timed(self, name: str):
+        """Decorator timing every call of the function as a span."""
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def self_seconds(self) -> dict[tuple[str, ...], float]:
+        """Returns the time of each span not spent in its child spans."""
+        self_times = {path: stats.total_seconds for path, stats in self.stats.items()}
+        for path, stats in self.stats.items():
+            parent = path[:-1]
+            if parent in self_times:
+                self_times[parent] -= stats.total_seconds
+        return {path: max(seconds, 0.0) for path, seconds in self_times.items()}
+
+    def collapsed_stacks(self) -> str:
+        """
+        Returns the spans in the collapsed stack format read by flamegraph.pl,
+        speedscope and inferno, with self times in microseconds.
+        """
+        lines = []
+        for path, seconds in sorted(self.self_seconds().items()):
+            microseconds = round(seconds * 1_000_000)
+            if microseconds:
+                lines.append(f"{';'.join(name.replace(';', ',') for name in path)} {microseconds}")
+        return '\n'.join(lines) + '\n'
+
+    def summary_table(self) -> str:
+        """Returns a table with the calls, total and self time of every span."""
+        self_times = self.self_seconds()
+        roots_total = sum(stats.total_seconds for path, stats in self.stats.items() if len(path) == 1) or 1.0
+        width = max([len('  ' * (len(path) - 1) + path[-1]) for path in self.stats] + [len('Stage')])
+        lines = [
+            f"{'Stage':<{width}}  {'Calls':>8}  {'Total (s)':>10}  {'Self (s)':>10}  {'% run':>6}",
+            '-' * (width + 42),
+        ]
+        for path in sorted(self.stats):
+            stats = self.stats[path]
+            label = '  ' * (len(path) - 1) + path[-1]
+            lines.append(
+                f"{label:<{width}}  {stats.calls:>8}  {stats.total_seconds:>10.3f}  "
+                f"{self_times[path]:>10.3f}  {100 * stats.total_seconds / roots_total:>5.1f}%"
+            )
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory: Path, stem: str) -> list[Path]:
+        """Writes the collapsed stacks and the summary table, returns their paths."""
+        directory.mkdir(parents=True, exist_ok=True)
+        folded_path = directory / f'{stem}.folded'
+        summary_path = directory / f'{stem}_summary.txt'
+        folded_path.write_text(self.collapsed_stacks(), encoding='utf-8')
+        summary_path.write_text(self.summary_table(), encoding='utf-8')
+        return [folded_path, summary_path]
+
+
+profiler = StageProfiler()
+
+
+@contextmanager
+def profile_run(directory: Path, use_cprofile: bool = False):
+    """
+    Records the stage spans of the enclosed run and writes them to 'directory'
+    as ``profile_<timestamp>.folded`` and ``profile_<timestamp>_summary.txt``.
+
+    With 'use_cprofile' the run is also profiled function by function and the
+    statistics are written to ``profile_<timestamp>.pstats`` for pstats or snakeviz.
+    """
+    stem = f'profile_{datetime.now().strftime("%m_%d_%Y-%H_%M_%S")}'
+    profiler.reset()
+    profiler.enable()
+    function_profiler = cProfile.Profile() if use_cprofile else None
+    if function_profiler is not None:
+        function_profiler.enable()
+    try:
+        yield profiler
+    finally:
+        written = profiler.write(directory, stem)
+        if function_profiler is not None:
+            function_profiler.disable()
+            pstats_path = directory / f'{stem}.pstats'
+            function_profiler.dump_stats(pstats_path)
+            written.append(pstats_path)
+        logger.info(f"Stage timings\n{profiler.summary_table()}")
+        logger.info(f"Profile written to {', '.join(str(path) for path in written)}")
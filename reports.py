@@ -1,17 +1,25 @@
+from collections import OrderedDict
 from copy import copy
+import threading
 import requests
-from requests.exceptions import HTTPError, ConnectionError
+from requests.exceptions import HTTPError, ConnectionError, Timeout
+from urllib3 import Retry
 from dataclasses import dataclass
 from typing import Optional, Tuple, Literal
 from collections.abc import Iterable
+from importlib.util import find_spec
 
+import numpy as np
 import pandas as pd
-import io
 from datetime import datetime
 from filter_dates import FilterDates
 
 from loggerfactory import LoggerFactory
 from helper import write_bytes_to_file
+from http_sessions import RETRY_STATUSES, pooled_adapter
+from parse_pool import decode_dataframe, parse_excel, run_parser
+from profiling import profiler
+from request_log import get_request_log
 
 
 logger = LoggerFactory.get_logger(__name__)
@@ -33,18 +41,92 @@ class Filter:
     filter_texts: Tuple[str]
 
 
+def get_report_title(report_type: ReportType) -> str:
+    """Returns the title of the report for a report type."""
+    if report_type.planType == 'PREPAID':
+        return 'Hotlink Prepaid Report'
+    if report_type.planType == 'POSTPAID':
+        if report_type.ratePlan == 'hotlink postpaid':
+            return 'Hotlink Postpaid Report'
+        elif report_type.ratePlan == 'maxis postpaid':
+            return 'Maxis Postpaid Report'
+        else:
+            raise SystemExit(f"Unknown ratePlan: {report_type.ratePlan}")
+    else:
+        raise SystemExit(f"Unknown plan type {report_type.planType}")
+
+
 def excel_buffer_to_dataframe(buffer) -> pd.DataFrame:
-    """Converts an excel buffer to a pandas dataframe."""
-    with io.BytesIO(buffer) as file_handler:
-        df: pd.DataFrame = pd.io.excel.read_excel(file_handler)
-    return df
+    """Converts an excel buffer to a pandas dataframe, parsed in the parse pool."""
+    return decode_dataframe(run_parser(parse_excel, buffer))
+
+
+CMS_REPORT_URL = 'https://api-digital2.isddc.men.maxis.com.my/ecommerce/api/v4.0/cms/order/masterreport'
+# Retries of a report download, shared by the blocking and asyncio clients.
+CMS_RETRIES = 2
+CMS_BACKOFF_FACTOR = 5
+
+_cms_session: Optional[requests.Session] = None
+_cms_session_lock = threading.Lock()
+
+
+def get_cms_session() -> requests.Session:
+    """
+    Returns the session shared by every report download, keeping up to
+    CMS_POOL_SIZE connections to cms with a timeout and retries.
+    """
+    global _cms_session
+    with _cms_session_lock:
+        if _cms_session is None:
+            # Imported here because order_validation_config imports this module.
+            from order_validation_config import CMS_POOL_SIZE, CMS_TIMEOUT_SECONDS, POOL_BLOCK
+            retry = Retry(total=CMS_RETRIES, backoff_factor=CMS_BACKOFF_FACTOR, status_forcelist=RETRY_STATUSES,
+                          raise_on_status=False)
+            adapter = pooled_adapter(CMS_POOL_SIZE, retry, timeout=CMS_TIMEOUT_SECONDS, block=POOL_BLOCK)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _cms_session = session
+    return _cms_session
+
+
+ARROW_STRINGS_AVAILABLE = find_spec('pyarrow') is not None
+
+
+@dataclass
+class MemoryBudget:
+    """
+    How a master report is compacted right after parsing to fit in less memory.
+
+    Only 'keep_columns' are kept, text columns where the distinct values are at
+    most 'max_category_ratio' of the rows become categoricals and 'id_columns'
+    use Arrow backed strings when pyarrow is installed.
+    """
+    keep_columns: Tuple[str, ...]
+    id_columns: Tuple[str, ...] = ('Order_No', )
+    max_category_ratio: float = 0.5
+
+    def apply(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """Returns the compacted copy of the dataframe."""
+        keep_columns = set(self.keep_columns)
+        compacted = dataframe.loc[:, [column for column in dataframe.columns if column in keep_columns]]
+        for column in compacted.columns:
+            series = compacted[column]
+            if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+                continue
+            if column in self.id_columns:
+                if ARROW_STRINGS_AVAILABLE:
+                    compacted[column] = series.astype(pd.StringDtype('pyarrow'))
+            elif series.nunique(dropna=False) <= self.max_category_ratio * len(series):
+                compacted[column] = series.astype('category')
+        return compacted
 
 
 class ReportDownloader:
     """Helps to download the report from cms."""
 
     def __init__(self, filter_date_from: str, filter_date_to: str):
-        self.url = 'https://api-digital2.isddc.men.maxis.com.my/ecommerce/api/v4.0/cms/order/masterreport'
+        self.url = CMS_REPORT_URL
         self.headers = {
             'authority': 'api-digital2.isddc.men.maxis.com.my',
             'accept': 'application/json, text/plain, */*',
@@ -76,7 +158,20 @@ class ReportDownloader:
 
 
 class Report(ReportDownloader):
-    def __init__(self, report_type: ReportType, filter_dates: FilterDates, save_to_disk: bool) -> None:
+    """
+    Master report downloaded from cms.
+
+    The parsed report is kept as a base dataframe and filters only narrow down
+    the positions of the selected rows, so views returned by :meth:`view`
+    share the base dataframe instead of copying it. Rows are only copied when
+    :attr:`dataframe` or one of the getters is called.
+    """
+    def __init__(self, report_type: ReportType, filter_dates: FilterDates, save_to_disk: bool,
+                 dataframe: Optional[pd.DataFrame] = None, memory_budget: Optional[MemoryBudget] = None) -> None:
+        """
+        Downloads and parses the report, unless an already parsed 'dataframe' is given.
+        The dataframe is compacted when a 'memory_budget' is given.
+        """
         super().__init__(
             filter_date_from=filter_dates.start.date,
             filter_date_to=filter_dates.end.date,
@@ -84,25 +179,74 @@ class Report(ReportDownloader):
         self.report_type = report_type
         self.save_to_disk = save_to_disk
         self.name = self.generate_report_title()
-        self.content = self.download_report()
-        self.dataframe = excel_buffer_to_dataframe(self.content)
+        if dataframe is None:
+            with profiler.span('cms download'):
+                content = self.download_report()
+            with profiler.span('excel parse'):
+                dataframe = excel_buffer_to_dataframe(content)
+        self._base = dataframe
+        self._rows: Optional[np.ndarray] = None
+        self._memory_usage: Optional[int] = None
+        if memory_budget is not None:
+            parsed_bytes = self.memory_usage()
+            self.dataframe = memory_budget.apply(dataframe)
+            logger.info(f"{self.name}: {len(self._base)} rows, {self.memory_usage() / 2**20:.1f} MiB in memory "
+                        f"({parsed_bytes / 2**20:.1f} MiB as parsed, {len(self._base.columns)} columns kept).")
+        else:
+            logger.info(f"{self.name}: {len(self._base)} rows, {self.memory_usage() / 2**20:.1f} MiB in memory.")
+
+    @property
+    def dataframe(self) -> pd.DataFrame:
+        """The selected rows of the report."""
+        if self._rows is None:
+            return self._base
+        return self._base.take(self._rows)
+
+    @dataframe.setter
+    def dataframe(self, dataframe: pd.DataFrame):
+        self._base = dataframe
+        self._rows = None
+        self._memory_usage = None
+
+    def view(self) -> 'Report':
+        """Returns an unfiltered report sharing the base dataframe of this one."""
+        report_view = copy(self)
+        report_view._rows = None
+        return report_view
+
+    @property
+    def columns(self) -> pd.Index:
+        return self._base.columns
+
+    def positions(self) -> np.ndarray:
+        """Returns the positions of the selected rows in the base dataframe."""
+        if self._rows is None:
+            return np.arange(len(self._base))
+        return self._rows
+
+    def take(self, positions: np.ndarray) -> pd.DataFrame:
+        """Returns the rows of the base dataframe at the given positions, e.g. from :meth:`positions`."""
+        return self._base.take(positions)
+
+    def column(self, column_name: str) -> np.ndarray:
+        """Returns the values of a single column for the selected rows."""
+        values = self._base[column_name].to_numpy()
+        if self._rows is None:
+            return values
+        return values[self._rows]
+
+    def memory_usage(self) -> int:
+        """Returns the size in bytes of the base dataframe."""
+        if self._memory_usage is None:
+            self._memory_usage = int(self._base.memory_usage(deep=True).sum())
+        return self._memory_usage
 
 
     def __enter__(self):
         return self
 
     def generate_report_title(self):
-        if self.report_type.planType == 'PREPAID':
-            return 'Hotlink Prepaid Report'
-        if self.report_type.planType == 'POSTPAID':
-            if self.report_type.ratePlan == 'hotlink postpaid':
-                return 'Hotlink Postpaid Report'
-            elif self.report_type.ratePlan == 'maxis postpaid':
-                return 'Maxis Postpaid Report'
-            else:
-                raise SystemExit(f"Unknown ratePlan: {self.report_type.ratePlan}")
-        else:
-            raise SystemExit(f"Unknown plan type {self.report_type.planType}")
+        return get_report_title(self.report_type)
 
     def get_file_name(self):
         """Returns a file name for the report."""
@@ -120,20 +264,55 @@ class Report(ReportDownloader):
         Filter dataframe by given filter.
         Supports two methods "contains" and "exists".
         """
+        with profiler.span('filter'):
+            self._filter(filter)
+
+    def _filter(self, filter: Filter):
+        mask = self.matches(filter)
+        if mask is not None:
+            self._select(mask)
+
+    def matches(self, filter: Filter) -> Optional[np.ndarray]:
+        """
+        Returns which of the selected rows match the filter, without narrowing
+        the selection, or None if the method is not supported or the report has
+        no such column.
+        """
+        if filter.columnName not in self._base.columns:
+            logger.warning(f'Column {filter.columnName} not in {self.name}, filter {filter.methodName} ignored.')
+            return None
+        # Filtering the series keeps categorical columns as codes instead of materialising their values.
+        column = self._base[filter.columnName]
+        if self._rows is not None:
+            column = column.take(self._rows)
         if filter.methodName == 'contains':
-            self.dataframe = self.dataframe[self.dataframe[filter.columnName].str.contains(filter.filter_texts[0])]
+            mask = column.str.contains(filter.filter_texts[0])
         elif filter.methodName == 'exists':
-            self.dataframe = self.dataframe[self.dataframe[filter.columnName].isin(filter.filter_texts)]
+            mask = column.isin(filter.filter_texts)
         elif filter.methodName == 'notExists':
-            self.dataframe = self.dataframe[~self.dataframe[filter.columnName].isin(filter.filter_texts)]
+            mask = ~column.isin(filter.filter_texts)
         else:
             logger.warning(f'Mehtod {filter.methodName} not supported.')
+            return None
+        return mask.to_numpy(dtype=bool, na_value=False)
+
+    def _select(self, mask: np.ndarray):
+        """Narrows the selected rows down to the ones where mask is true."""
+        if self._rows is None:
+            self._rows = np.flatnonzero(mask)
+        else:
+            self._rows = self._rows[mask]
 
     def get_columns_reduced_dataframe(self, columns: Tuple[str]) -> pd.DataFrame:
-        return self.dataframe.loc[:, columns]
+        reduced = self._base.loc[:, list(columns)]
+        if self._rows is None:
+            return reduced
+        return reduced.take(self._rows)
 
     def get_filtered_dataframe_by_orderNos(self, orders: Iterable[str]) -> pd.DataFrame:
-        return self.dataframe.loc[self.dataframe['Order_No'].isin(orders)]
+        mask = pd.Series(self.column('Order_No'), copy=False).isin(orders).to_numpy()
+        rows = np.flatnonzero(mask) if self._rows is None else self._rows[mask]
+        return self._base.take(rows)
 
     def download_report(self):
         """Pulls the report from cms and returns in bytes."""
@@ -144,29 +323,102 @@ class Report(ReportDownloader):
         report_name = self.name
         logger.info(f"[+] Fetching {report_name} ...")
         try:
-            response = requests.get(
+            response = get_cms_session().get(
                     url=self.url,
                     headers=self.headers,
             )
-            logger.info(f"{response.request.method} {response.url} [status:{response.status_code} request:{response.elapsed.total_seconds():.3f}s]")
+            get_request_log().record('cms', response.request.method, response.url, response.status_code,
+                                     response.elapsed.total_seconds())
             response.raise_for_status()
         except HTTPError as error:
             raise SystemExit(error.args[0])
-        except ConnectionError as connection_error:
+        except (ConnectionError, Timeout) as connection_error:
             raise SystemExit(connection_error.args)
         if self.save_to_disk:
             filename = self.get_file_name()
             write_bytes_to_file(response.content, filename)
         return response.content
 
-cached_reports: list[Report] = []
 
-def get_report(report_type: ReportType, filter_dates: FilterDates, save_to_disk: bool):
-    """Return report for a given report type and also cache for future use"""
-    for report in cached_reports:
-        if report.report_type == report_type:
-            logger.info('Report found in cache!')
+class ReportCache:
+    """
+    Least recently used cache of parsed reports bounded by their size in memory.
+    Safe to share between threads, e.g. the scheduler and the request threads
+    of the service.
+
+    Args:
+        max_bytes (int): Total size of the cached dataframes after which the
+            least recently used reports are evicted. None uses REPORT_CACHE_MAX_BYTES.
+    """
+    def __init__(self, max_bytes: Optional[int] = None):
+        self._max_bytes = max_bytes
+        self.current_bytes = 0
+        self._reports: OrderedDict[tuple, tuple[Report, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self) -> int:
+        if self._max_bytes is None:
+            # Imported here because order_validation_config imports this module.
+            from order_validation_config import REPORT_CACHE_MAX_BYTES
+            return REPORT_CACHE_MAX_BYTES
+        return self._max_bytes
+
+    @staticmethod
+    def key(report_type: ReportType, filter_dates: FilterDates) -> tuple:
+        return (report_type.planType, report_type.ratePlan, filter_dates.start.date, filter_dates.end.date)
+
+    def get(self, key: tuple) -> Optional[Report]:
+        with self._lock:
+            try:
+                report, _ = self._reports[key]
+            except KeyError:
+                return None
+            self._reports.move_to_end(key)
             return report
-    report = Report(report_type, filter_dates, save_to_disk)
-    cached_reports.append(copy(report))
-    return report
+
+    def put(self, key: tuple, report: Report):
+        size = report.memory_usage()
+        max_bytes = self.max_bytes
+        if size > max_bytes:
+            logger.warning(f"{report.name} ({size} bytes) is larger than the report cache, not cached.")
+            return
+        with self._lock:
+            if key in self._reports:
+                self.current_bytes -= self._reports.pop(key)[1]
+            while self._reports and self.current_bytes + size > max_bytes:
+                _, (evicted, evicted_size) = self._reports.popitem(last=False)
+                self.current_bytes -= evicted_size
+                logger.info(f"Evicted {evicted.name} ({evicted_size} bytes) from the report cache.")
+            self._reports[key] = (report, size)
+            self.current_bytes += size
+
+    def clear(self):
+        with self._lock:
+            self._reports.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._reports)
+
+
+report_cache = ReportCache()
+
+
+def get_report(report_type: ReportType, filter_dates: FilterDates, save_to_disk: bool,
+               memory_budget: Optional[MemoryBudget] = None):
+    """
+    Return report for a given report type and also cache for future use.
+
+    Every call returns a new unfiltered view of the cached report, so filters
+    applied by one flow never leak into another. Downloaded reports are
+    compacted when a 'memory_budget' is given.
+    """
+    key = ReportCache.key(report_type, filter_dates)
+    report = report_cache.get(key)
+    if report is not None:
+        logger.info('Report found in cache!')
+        return report.view()
+    report = Report(report_type, filter_dates, save_to_disk, memory_budget=memory_budget)
+    report_cache.put(key, report)
+    return report.view()
@@ -0,0 +1,125 @@
+from collections import Counter
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import Optional
+
+from loggerfactory import LoggerFactory
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+PERCENTILES = (50, 90, 99)
+
+
+@dataclass
+class BackendWindow:
+    """Requests of one backend since its last summary."""
+    requests: int = 0
+    latencies: list[float] = field(default_factory=list)
+    errors: Counter = field(default_factory=Counter)
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """Returns the nearest-rank percentile of sorted values."""
+    rank = max(0, -(-len(sorted_values) * percent // 100) - 1)
+    return sorted_values[int(rank)]
+
+
+class RequestLog:
+    """
+    Per-request log lines of the cms, Swap and WM clients.
+
+    Every failed request is logged in full. Successful ones are logged one in
+    'sample_every', the first of every backend included, and when
+    'summary_every' is set a summary per backend with the number of requests,
+    errors and latency percentiles is logged every 'summary_every' seconds and
+    by :meth:`flush`. With the defaults every request is logged, as one line each.
+
+    Usage::
+
+      request_log = get_request_log()
+      request_log.record('swap', 'GET', '/HOS1234', response.status_code, response.elapsed.total_seconds())
+      request_log.flush()
+    """
+
+    def __init__(self, sample_every: int = 1, summary_every: Optional[float] = None):
+        self.sample_every = max(1, sample_every)
+        self.summary_every = summary_every
+        self.windows: dict[str, BackendWindow] = {}
+        self.counts: Counter = Counter()
+        self._last_summary = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, backend: str, method: str, target: str, status: int, seconds: float):
+        """Records a response, logging it when it failed or is sampled."""
+        line = f"{method} {target} [status:{status} request:{seconds:.3f}s]"
+        failed = status >= 400
+        with self._lock:
+            window = self.windows.setdefault(backend, BackendWindow())
+            window.requests += 1
+            window.latencies.append(seconds)
+            if failed:
+                window.errors[str(status)] += 1
+            self.counts[backend] += 1
+            sampled = (self.counts[backend] - 1) % self.sample_every == 0
+        if failed:
+            logger.warning(line)
+        elif sampled:
+            logger.info(line)
+        self._summarize_if_due()
+
+    def failed(self, backend: str, method: str, target: str, error: BaseException):
+        """Records a request that got no response, logging the error with its traceback."""
+        with self._lock:
+            window = self.windows.setdefault(backend, BackendWindow())
+            window.requests += 1
+            window.errors[type(error).__name__] += 1
+        logger.error(f"{method} {target} failed: {error!r}", exc_info=error)
+        self._summarize_if_due()
+
+    def _summarize_if_due(self):
+        if self.summary_every is None or time.monotonic() - self._last_summary < self.summary_every:
+            return
+        self.flush()
+
+    def flush(self):
+        """Logs the summary of every backend with requests since the last summary."""
+        if self.summary_every is None:
+            return
+        with self._lock:
+            windows, self.windows = self.windows, {}
+            elapsed = time.monotonic() - self._last_summary
+            self._last_summary = time.monotonic()
+        for backend, window in windows.items():
+            logger.info(f"{backend}: {summarize(window)} in the last {elapsed:.0f}s")
+
+
+def summarize(window: BackendWindow) -> str:
+    """Returns the number of requests, errors and latency percentiles of a window as text."""
+    text = f"{window.requests} requests"
+    if window.errors:
+        text += f", {sum(window.errors.values())} errors ({', '.join(f'{count} {error}' for error, count in window.errors.most_common())})"
+    if window.latencies:
+        latencies = sorted(window.latencies)
+        text += ', latency ' + ' '.join(f'p{percent} {percentile(latencies, percent):.3f}s' for percent in PERCENTILES)
+        text += f' max {latencies[-1]:.3f}s'
+    return text
+
+
+_request_log: Optional[RequestLog] = None
+_request_log_lock = threading.Lock()
+
+
+def get_request_log() -> RequestLog:
+    """Returns the request log of the process, sampling and summarizing when HIGH_VOLUME_LOGGING is on."""
+    global _request_log
+    with _request_log_lock:
+        if _request_log is None:
+            # Imported here because order_validation_config imports reports, which imports this module.
+            from order_validation_config import HIGH_VOLUME_LOGGING, REQUEST_LOG_SAMPLE_EVERY, REQUEST_LOG_SUMMARY_SECONDS
+            if HIGH_VOLUME_LOGGING:
+                _request_log = RequestLog(REQUEST_LOG_SAMPLE_EVERY, REQUEST_LOG_SUMMARY_SECONDS)
+            else:
+                _request_log = RequestLog()
+    return _request_log
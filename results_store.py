@@ -0,0 +1,269 @@
+from collections.abc import Iterable, Sequence
+from contextlib import closing
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from pathlib import Path
+import sqlite3
+from typing import TYPE_CHECKING, Optional
+
+from helper import reports_dir
+from loggerfactory import LoggerFactory
+
+if TYPE_CHECKING:
+    from filter_dates import FilterDates
+    from order_validation import ValidationResults
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+results_store_path = reports_dir / 'history' / 'results.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    window_start TEXT NOT NULL,
+    window_end TEXT NOT NULL,
+    shard TEXT
+);
+CREATE TABLE IF NOT EXISTS flow_counts (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    flow TEXT NOT NULL,
+    checked INTEGER NOT NULL,
+    PRIMARY KEY (run_id, flow)
+);
+CREATE TABLE IF NOT EXISTS outcomes (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    run_date TEXT NOT NULL,
+    order_no TEXT NOT NULL,
+    flow TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS outcomes_order_no ON outcomes (order_no, run_date);
+CREATE INDEX IF NOT EXISTS outcomes_run_date ON outcomes (run_date, flow, outcome);
+CREATE INDEX IF NOT EXISTS outcomes_run_id ON outcomes (run_id);
+CREATE INDEX IF NOT EXISTS runs_run_date ON runs (run_date);
+"""
+
+
+class ResultsStore:
+    """
+    SQLite history of the failed and unverified orders of every run.
+
+    Each run adds one row to 'runs', the number of orders checked per flow to
+    'flow_counts' and one row per failed or unverified order to 'outcomes',
+    indexed by order number and run date so repeat failures and trends are
+    answered without reading the xlsx reports.
+
+    Usage::
+
+      store = ResultsStore()
+      store.record_run(results, filter_dates)
+      store.order_history('1001A1')
+    """
+
+    def __init__(self, path: Path = results_store_path):
+        self.path = Path(path)
+
+    def connect(self, create: bool = True) -> sqlite3.Connection:
+        """
+        Opens the store, creating it unless 'create' is False: queries then read
+        an empty in-memory history instead of leaving an empty file behind.
+        """
+        if not create and not self.path.exists():
+            connection = sqlite3.connect(':memory:')
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path)
+        connection.executescript(SCHEMA)
+        return connection
+
+    def record_run(self, results: 'ValidationResults', filter_dates: 'FilterDates', shard: Optional[str] = None,
+                   started_at: Optional[datetime] = None) -> int:
+        """Stores the outcomes of a run and returns its run ID."""
+        started_at = started_at or datetime.now()
+        run_date = started_at.date().isoformat()
+        with closing(self.connect()) as connection, connection:
+            cursor = connection.execute(
+                "INSERT INTO runs (started_at, run_date, window_start, window_end, shard) VALUES (?, ?, ?, ?, ?)",
+                (
+                    started_at.isoformat(timespec='seconds'), run_date,
+                    filter_dates.start.parse_date().isoformat(timespec='minutes'),
+                    filter_dates.end.parse_date().isoformat(timespec='minutes'),
+                    shard,
+                ),
+            )
+            run_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO flow_counts (run_id, flow, checked) VALUES (?, ?, ?)",
+                [(run_id, flow, checked) for flow, checked in results.checked_orders.items()],
+            )
+            connection.executemany(
+                "INSERT INTO outcomes (run_id, run_date, order_no, flow, outcome, detail) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (run_id, run_date, str(order_no), flow, outcome, detail)
+                    for flow, order_no, outcome, detail in results.order_outcomes
+                ],
+            )
+        logger.info(f"Recorded {len(results.order_outcomes)} order outcomes of run {run_id} in {self.path}")
+        return run_id
+
+    def previous_outcomes(self, run_id: int, shard: Optional[str] = None) -> Optional[list[tuple]]:
+        """
+        Returns the outcomes of the last run of the same shard before a run as
+        (flow, order_no, outcome, detail), or None if there is no such run.
+        """
+        with closing(self.connect(create=False)) as connection:
+            previous = connection.execute(
+                "SELECT MAX(run_id) FROM runs WHERE run_id < ? AND shard IS ?", (run_id, shard)).fetchone()[0]
+            if previous is None:
+                return None
+            return connection.execute(
+                "SELECT flow, order_no, outcome, detail FROM outcomes WHERE run_id = ?", (previous, )).fetchall()
+
+    def order_history(self, order_no: str) -> list[tuple]:
+        """Returns every recorded outcome of an order as (started_at, flow, outcome, detail), oldest first."""
+        with closing(self.connect(create=False)) as connection:
+            return connection.execute(
+                """
+                SELECT runs.started_at, outcomes.flow, outcomes.outcome, outcomes.detail
+                FROM outcomes JOIN runs USING (run_id)
+                WHERE outcomes.order_no = ?
+                ORDER BY runs.started_at
+                """,
+                (order_no, ),
+            ).fetchall()
+
+    def repeat_failures(self, min_runs: int = 2, since: Optional[date] = None) -> list[tuple]:
+        """
+        Returns the orders that failed in at least 'min_runs' runs since a date as
+        (order_no, runs, first_failed, last_failed, flows), most frequent first.
+        Unverified outcomes are not failures.
+        """
+        with closing(self.connect(create=False)) as connection:
+            return connection.execute(
+                """
+                SELECT order_no, COUNT(DISTINCT run_id) AS runs, MIN(run_date), MAX(run_date), GROUP_CONCAT(DISTINCT flow)
+                FROM outcomes
+                WHERE outcome != 'unverified' AND run_date >= ?
+                GROUP BY order_no
+                HAVING runs >= ?
+                ORDER BY runs DESC, MAX(run_date) DESC, order_no
+                """,
+                ((since or date.min).isoformat(), min_runs),
+            ).fetchall()
+
+    def failed_order_nos(self, since: date) -> set[str]:
+        """Returns the orders that failed in any run since a date, unverified outcomes are not failures."""
+        with closing(self.connect(create=False)) as connection:
+            rows = connection.execute(
+                "SELECT DISTINCT order_no FROM outcomes WHERE run_date >= ? AND outcome != 'unverified'",
+                (since.isoformat(), ),
+            ).fetchall()
+        return {order_no for order_no, in rows}
+
+    def failure_rates(self, since: date) -> dict[str, float]:
+        """Returns the share of checked orders that failed per flow since a date."""
+        totals: dict[str, list[int]] = {}
+        for _, flow, checked, not_flown, wm_failed, _ in self.trend(since):
+            flow_totals = totals.setdefault(flow, [0, 0])
+            flow_totals[0] += checked
+            flow_totals[1] += not_flown + wm_failed
+        return {flow: failed / checked for flow, (checked, failed) in totals.items() if checked}
+
+    def trend(self, since: date) -> list[tuple]:
+        """
+        Returns the checked, not flown, WM failed and unverified orders per run
+        date and flow since a date, oldest first.
+        """
+        with closing(self.connect(create=False)) as connection:
+            checked = connection.execute(
+                """
+                SELECT runs.run_date, flow_counts.flow, SUM(flow_counts.checked)
+                FROM flow_counts JOIN runs USING (run_id)
+                WHERE runs.run_date >= ?
+                GROUP BY runs.run_date, flow_counts.flow
+                """,
+                (since.isoformat(), ),
+            ).fetchall()
+            outcomes = connection.execute(
+                """
+                SELECT run_date, flow, outcome, COUNT(*)
+                FROM outcomes
+                WHERE run_date >= ?
+                GROUP BY run_date, flow, outcome
+                """,
+                (since.isoformat(), ),
+            ).fetchall()
+        rows = {(run_date, flow): [count, 0, 0, 0] for run_date, flow, count in checked}
+        columns = {'not_flown_to_swap': 1, 'wm_failed': 2, 'unverified': 3}
+        for run_date, flow, outcome, count in outcomes:
+            rows.setdefault((run_date, flow), [0, 0, 0, 0])[columns[outcome]] += count
+        return [(*key, *counts) for key, counts in sorted(rows.items())]
+
+
+@dataclass
+class RunDiff:
+    """
+    Failed and unverified orders of a run compared by Order_No with the previous
+    run, each as (flow, order_no, outcome, detail).
+
+    'new' and 'persistent' hold the outcomes of the run whose order was not or
+    was already failing, 'resolved' the previous outcomes of orders checked again
+    and passed. Previously failing orders the run did not check again, e.g. out
+    of its window, are only counted in 'not_rechecked'.
+    """
+    new: list[tuple] = field(default_factory=list)
+    resolved: list[tuple] = field(default_factory=list)
+    persistent: list[tuple] = field(default_factory=list)
+    not_rechecked: int = 0
+
+
+def diff_outcomes(previous: Iterable[Sequence], current: Iterable[Sequence], checked_order_nos: set[str]) -> RunDiff:
+    """Compares the outcomes of two runs by Order_No, see :class:`RunDiff`."""
+    previous = [tuple(outcome) for outcome in previous]
+    current = [tuple(outcome) for outcome in current]
+    previous_order_nos = {str(outcome[1]) for outcome in previous}
+    current_order_nos = {str(outcome[1]) for outcome in current}
+    diff = RunDiff()
+    for outcome in current:
+        (diff.persistent if str(outcome[1]) in previous_order_nos else diff.new).append(outcome)
+    not_rechecked = set()
+    for outcome in previous:
+        order_no = str(outcome[1])
+        if order_no in current_order_nos:
+            continue
+        if order_no in checked_order_nos:
+            diff.resolved.append(outcome)
+        else:
+            not_rechecked.add(order_no)
+    diff.not_rechecked = len(not_rechecked)
+    return diff
+
+
+def format_table(columns: Sequence[str], rows: Iterable[Sequence]) -> str:
+    """Returns rows as an aligned text table."""
+    cells = [list(columns)] + [['' if value is None else str(value) for value in row] for row in rows]
+    widths = [max(len(row[index]) for row in cells) for index in range(len(columns))]
+    lines = ['  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in cells]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+def query(history: Optional[str] = None, repeat_failures: Optional[int] = None, trend_days: Optional[int] = None,
+          store: Optional[ResultsStore] = None) -> str:
+    """Answers the history queries of the command line as text tables."""
+    store = store or ResultsStore()
+    tables = []
+    if history is not None:
+        tables.append(format_table(('Run', 'Flow', 'Outcome', 'Detail'), store.order_history(history)))
+    if repeat_failures is not None:
+        tables.append(format_table(
+            ('Order_No', 'Runs', 'First', 'Last', 'Flows'), store.repeat_failures(repeat_failures)))
+    if trend_days is not None:
+        since = date.today() - timedelta(days=trend_days)
+        tables.append(format_table(
+            ('Date', 'Flow', 'Checked', 'Not_Flown', 'WM_Failed', 'Unverified'), store.trend(since)))
+    return '\n\n'.join(tables)
@@ -1,7 +1,11 @@
 import argparse
+from contextlib import nullcontext
+from pathlib import Path
 from filter_dates import get_default_filter_dates, get_filter_dates_input
 
-from order_validation import order_processing
+from helper import reports_dir
+from profiling import profile_run
+from sharding import Shard, ShardError
 from loggerfactory import LoggerFactory
 
 logger = LoggerFactory.get_logger(__name__)
@@ -12,17 +16,95 @@ if __name__ == '__main__':
     )
     parser.add_argument('--custom-dates', dest='custom_dates', required=False,
                         action='store_true', help='option to input custom dates for validations')
+    parser.add_argument('--resume', dest='resume', required=False,
+                        action='store_true', help='continue the last interrupted run for the same dates')
+    parser.add_argument('--shard', dest='shard', required=False, type=Shard.parse, metavar='INDEX/COUNT',
+                        help='only check the orders of one shard, e.g. 2/8, and write partial results')
+    parser.add_argument('--merge-shards', dest='merge_shards', required=False,
+                        action='store_true', help='combine the partial results of every shard into the report')
+    parser.add_argument('--async', dest='use_asyncio', required=False,
+                        action='store_true', help='run every lookup concurrently on one asyncio event loop')
+    parser.add_argument('--serve', dest='serve', required=False, action='store_true',
+                        help='keep running, validate on schedule and answer the local HTTP API')
+    parser.add_argument('--orders', dest='orders', required=False, type=argparse.FileType('r'), metavar='FILE',
+                        help="check the order IDs listed in FILE ('-' for stdin) without downloading any report")
+    parser.add_argument('--plan', dest='plan_type', required=False, default='PREPAID', type=str.upper,
+                        choices=('PREPAID', 'POSTPAID'), help='plan type of the orders given with --orders')
+    parser.add_argument('--profile', dest='profile', required=False, nargs='?', const='stages',
+                        choices=('stages', 'cprofile'),
+                        help='write stage timings as a flame graph and a summary table to the reports folder, '
+                             'with "cprofile" also write function level statistics')
+    parser.add_argument('--history', dest='history', required=False, metavar='ORDER_NO',
+                        help='show the recorded outcomes of an order in past runs')
+    parser.add_argument('--repeat-failures', dest='repeat_failures', required=False, nargs='?', const=2, type=int,
+                        metavar='RUNS', help='list the orders that failed in at least RUNS runs (default 2)')
+    parser.add_argument('--trend', dest='trend_days', required=False, nargs='?', const=30, type=int, metavar='DAYS',
+                        help='show the checked and failed orders per day and flow of the last DAYS days (default 30)')
+    parser.add_argument('--record', dest='record', required=False, type=Path, metavar='CASSETTE',
+                        help='record the cms, Swap and WM exchanges of the run to CASSETTE, without credentials')
+    parser.add_argument('--replay', dest='replay', required=False, type=Path, metavar='CASSETTE',
+                        help='answer the cms, Swap and WM requests from CASSETTE instead of the network')
+    parser.add_argument('--replay-timing', dest='replay_timing', required=False, type=float, default=1.0,
+                        metavar='SCALE', help='multiply the recorded response times when replaying, 0 to answer at once')
     args = parser.parse_args()
-    custom_dates = args.custom_dates
-
-    def check_args(custom_dates=custom_dates):
-        if custom_dates:
-            filter_dates = get_filter_dates_input()
+    if args.record and args.replay:
+        parser.error('--record and --replay cannot be combined')
+    if (args.record or args.replay) and args.use_asyncio:
+        parser.error('--record and --replay only support the blocking clients, not --async')
+    # Installed before the validation modules are imported, the swap adapter is created on import.
+    # Closed when the run ends, however it ends, so a compressed cassette gets its end marker.
+    cassette = nullcontext()
+    if args.record or args.replay:
+        from http_fixtures import use_cassette
+        if args.record:
+            cassette = use_cassette(args.record, 'record')
         else:
-            filter_dates = get_default_filter_dates()
-        return filter_dates
+            cassette = use_cassette(args.replay, 'replay', timing_scale=args.replay_timing)
+    with cassette:
+        profiling = profile_run(reports_dir, use_cprofile=args.profile == 'cprofile') if args.profile else nullcontext()
+
+        if args.serve:
+            from service import serve
+            serve()
+            raise SystemExit
+
+        if args.history is not None or args.repeat_failures is not None or args.trend_days is not None:
+            from results_store import query
+            print(query(args.history, args.repeat_failures, args.trend_days))
+            raise SystemExit
+
+        if args.orders:
+            from order_list import order_list_processing
+            with profiling:
+                order_list_processing(args.orders, args.plan_type)
+            raise SystemExit
+
+        custom_dates = args.custom_dates
+
+        def check_args(custom_dates=custom_dates):
+            if custom_dates:
+                filter_dates = get_filter_dates_input()
+            else:
+                filter_dates = get_default_filter_dates()
+            return filter_dates
 
-    filter_dates = check_args()
+        filter_dates = check_args()
 
-    logger.info(f"Range selected from: {filter_dates.start} - {filter_dates.end}")
-    order_processing(filter_dates=filter_dates, save_fetched_reports=False)
+        logger.info(f"Range selected from: {filter_dates.start} - {filter_dates.end}")
+        # The validation modules pull in pandas, requests, bs4 and enlighten, so
+        # they are only imported once the arguments are valid.
+        with profiling:
+            if args.merge_shards:
+                from order_validation import merge_shards
+                try:
+                    merge_shards(filter_dates=filter_dates)
+                except ShardError as error:
+                    parser.error(str(error))
+            elif args.use_asyncio:
+                import asyncio
+                from async_order_validation import async_order_processing
+                asyncio.run(async_order_processing(
+                    filter_dates=filter_dates, save_fetched_reports=False, resume=args.resume, shard=args.shard))
+            else:
+                from order_validation import order_processing
+                order_processing(filter_dates=filter_dates, save_fetched_reports=False, resume=args.resume, shard=args.shard)
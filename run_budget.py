@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+import threading
+import time
+from typing import Optional
+
+from http_sessions import active_budget
+from loggerfactory import LoggerFactory
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+
+class RunBudget:
+    """
+    Deadline and retry budget of a run.
+
+    Once 'deadline' seconds have passed since the run started, lookups are no
+    longer sent and their orders are reported as unverified. Retries are only
+    allowed while they stay within 'retry_ratio' of the requests sent so far,
+    with at least 'min_retries' allowed, so a struggling backend cannot
+    multiply the run time. Either limit is off when None.
+
+    Usage::
+
+      budget = RunBudget(deadline=3 * 60 * 60, retry_ratio=0.1)
+      if not budget.expired():
+          budget.request()
+          ...
+    """
+
+    def __init__(self, deadline: Optional[float] = None, retry_ratio: Optional[float] = None, min_retries: int = 10):
+        self.deadline = deadline
+        self.retry_ratio = retry_ratio
+        self.min_retries = min_retries
+        self.started = time.monotonic()
+        self.requests = 0
+        self.retries = 0
+        self.denied_retries = 0
+        self._expired = False
+        self._lock = threading.Lock()
+
+    def expired(self) -> bool:
+        """Returns whether the deadline has passed, logging it the first time."""
+        if self._expired:
+            return True
+        if self.deadline is not None and time.monotonic() - self.started >= self.deadline:
+            self._expired = True
+            logger.warning(f"Run deadline of {self.deadline:.0f}s reached, remaining orders are reported as unverified.")
+        return self._expired
+
+    def request(self):
+        """Counts a lookup sent to a backend."""
+        with self._lock:
+            self.requests += 1
+
+    def allow_retry(self) -> bool:
+        """Returns whether one more retry fits in the budget and counts it if so."""
+        if self.expired():
+            return False
+        with self._lock:
+            if self.retry_ratio is not None and self.retries >= max(self.min_retries, self.retry_ratio * self.requests):
+                if not self.denied_retries:
+                    logger.warning(f"Retry budget exhausted after {self.retries} retries for {self.requests} requests.")
+                self.denied_retries += 1
+                return False
+            self.retries += 1
+            return True
+
+    @contextmanager
+    def active(self):
+        """
+        Makes the retries of the requests sent by the calling thread or task
+        count against this budget, for sessions using :obj:`http_sessions.BudgetRetry`.
+        The sessions themselves are not changed, so runs can share them.
+        """
+        token = active_budget.set(self)
+        try:
+            yield self
+        finally:
+            active_budget.reset(token)
+
+    def log_summary(self):
+        logger.info(
+            f"Retry budget: {self.retries} retries for {self.requests} requests, {self.denied_retries} denied."
+        )
@@ -0,0 +1,183 @@
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from checkpoint import NullJournal
+from filter_dates import (
+    DateInFutureError,
+    EndBeforeStartError,
+    FilterDate,
+    FilterDates,
+    get_default_filter_dates,
+)
+from loggerfactory import LoggerFactory
+from lookups import OrderLookups, PortalSessions
+from order_list import check_orders
+from order_validation import ValidationResults, order_processing
+from order_validation_config import (
+    SERVICE_HOST,
+    SERVICE_PORT,
+    SERVICE_SCHEDULE_MINUTES,
+    SERVICE_SESSION_MAX_AGE_MINUTES,
+)
+from reports import report_cache
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+
+class ValidationService:
+    """
+    Long running validation service.
+
+    The portal sessions live as long as the service, so repeated validations
+    do not log in again. The report cache is cleared at the start of every
+    validation, because delivery and cancellation statuses change between
+    runs of the same window. Windows are validated one at a time, order
+    checks run alongside them.
+
+    Usage::
+
+      service = ValidationService()
+      results = service.validate_window(get_default_filter_dates())
+      status = service.check_order('1001A1', 'PREPAID')
+    """
+
+    def __init__(self, save_fetched_reports: bool = False,
+                 session_max_age_minutes: Optional[float] = SERVICE_SESSION_MAX_AGE_MINUTES):
+        self.save_fetched_reports = save_fetched_reports
+        max_age = None if session_max_age_minutes is None else session_max_age_minutes * 60
+        self.sessions = PortalSessions(max_age=max_age)
+        self._run_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def validate_window(self, filter_dates: FilterDates) -> ValidationResults:
+        """Validates every flow of RUN_FOR for the window and writes the report."""
+        with self._run_lock:
+            logger.info(f"Validating {filter_dates.start} - {filter_dates.end}")
+            report_cache.clear()
+            return order_processing(filter_dates, self.save_fetched_reports, sessions=self.sessions)
+
+    def check_order(self, order_no: str, plan_type: str = 'PREPAID') -> dict:
+        """
+        Checks a single order in swap and, for MOS orders, in WM.
+
+        Raises:
+            ValueError: If the plan type is not PREPAID or POSTPAID.
+        """
+        lookups = OrderLookups(NullJournal(), self.sessions)
+        return check_orders(lookups, [order_no], plan_type)[0].to_dict()
+
+    def run_schedule(self, interval_minutes: float):
+        """Validates the default window right away and then every interval until :meth:`stop` is called."""
+        while not self._stopped.is_set():
+            try:
+                self.validate_window(get_default_filter_dates())
+            except (Exception, SystemExit) as error:
+                logger.exception(f"Scheduled validation failed: {error!r}")
+            self._stopped.wait(interval_minutes * 60)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def parse_window(body: dict) -> FilterDates:
+    """
+    Returns the window of a validate request, missing dates default like
+    :func:`filter_dates.get_filter_dates_input`.
+
+    Raises:
+        ValueError: If a date is malformed.
+        DateInFutureError: If a date is in the future.
+        EndBeforeStartError: If the end is before the start.
+    """
+    default = get_default_filter_dates()
+    start = FilterDate(body['start']) if body.get('start') else default.start
+    end = FilterDate(body['end']) if body.get('end') else default.end
+    return FilterDates(start, end)
+
+
+class ServiceHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: ValidationService):
+        super().__init__(address, ServiceRequestHandler)
+        self.service = service
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+    Local HTTP API of the service::
+
+      GET  /health
+      GET  /orders/<Order_No>?plan=PREPAID
+      POST /validate  {"start": "DD/MM/YYYY HH:MM", "end": "DD/MM/YYYY HH:MM"}
+    """
+
+    server: ServiceHTTPServer
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/health':
+            self.send_json({'status': 'ok'})
+        elif url.path.startswith('/orders/'):
+            order_no = unquote(url.path.removeprefix('/orders/'))
+            plan_type = parse_qs(url.query).get('plan', ['PREPAID'])[0].upper()
+            try:
+                self.send_json(self.server.service.check_order(order_no, plan_type))
+            except ValueError as error:
+                self.send_json({'error': str(error)}, HTTPStatus.BAD_REQUEST)
+            except SystemExit as error:
+                self.send_json({'error': str(error)}, HTTPStatus.BAD_GATEWAY)
+        else:
+            self.send_json({'error': f'Unknown path {url.path}'}, HTTPStatus.NOT_FOUND)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/validate':
+            self.send_json({'error': f'Unknown path {url.path}'}, HTTPStatus.NOT_FOUND)
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            filter_dates = parse_window(body)
+        except (ValueError, TypeError, AttributeError, DateInFutureError, EndBeforeStartError) as error:
+            self.send_json({'error': str(error)}, HTTPStatus.BAD_REQUEST)
+            return
+        try:
+            results = self.server.service.validate_window(filter_dates)
+        except SystemExit as error:
+            self.send_json({'error': str(error)}, HTTPStatus.BAD_GATEWAY)
+            return
+        self.send_json(results.summary())
+
+    def send_json(self, data: dict, status: HTTPStatus = HTTPStatus.OK):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+def serve(host: str = SERVICE_HOST, port: int = SERVICE_PORT,
+          schedule_minutes: Optional[float] = SERVICE_SCHEDULE_MINUTES):
+    """Runs the service until interrupted, validating on schedule and answering the HTTP API."""
+    service = ValidationService()
+    server = ServiceHTTPServer((host, port), service)
+    if schedule_minutes:
+        threading.Thread(target=service.run_schedule, args=(schedule_minutes, ), name='schedule', daemon=True).start()
+    logger.info(f"Serving on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping the service.")
+    finally:
+        service.stop()
+        server.server_close()
@@ -0,0 +1,152 @@
+from dataclasses import dataclass
+import json
+from pathlib import Path
+import re
+import shutil
+import zlib
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+
+from helper import reports_dir
+from loggerfactory import LoggerFactory
+
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+shards_dir = reports_dir / 'shards'
+
+SHARD_FILE_PATTERN = re.compile(r'shard-(\d+)-of-(\d+)')
+MANIFEST_NAME = 'sheets.json'
+
+
+class ShardError(ValueError):
+    """
+    Custom exception raised when a shard is invalid or partial results are incomplete.
+    """
+    pass
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+    One of 'count' workers of a sharded run, 'index' starts from 1.
+
+    Orders are assigned to shards by the CRC32 of their 'Order_No', which is
+    stable across processes and hosts unlike the builtin :func:`hash`.
+    """
+
+    index: int
+    count: int
+
+    def __post_init__(self):
+        if self.count < 1 or not 1 <= self.index <= self.count:
+            raise ShardError(f"Invalid shard {self.index}/{self.count}")
+
+    @classmethod
+    def parse(cls, text: str):
+        """Parses a shard given as 'index/count', e.g. '2/8'."""
+        try:
+            index, count = (int(part) for part in text.split('/'))
+        except ValueError:
+            raise ShardError(f"Shard must be given as INDEX/COUNT, got '{text}'")
+        return cls(index, count)
+
+    def mask(self, order_ids: Iterable[str]) -> 'np.ndarray':
+        """Returns a boolean mask of the orders that belong to this shard."""
+        import numpy as np
+
+        return np.fromiter(
+            (zlib.crc32(order_id.encode()) % self.count == self.index - 1 for order_id in order_ids),
+            dtype=bool,
+        )
+
+    def file_name(self) -> str:
+        return f'shard-{self.index}-of-{self.count}'
+
+    def __str__(self):
+        return f'{self.index}/{self.count}'
+
+
+def write_shard_results(dataframes: dict[str, 'pd.DataFrame'], shard: Shard, run_key: str,
+                        directory: Path = shards_dir) -> Path:
+    """
+    Writes the partial results of a shard for the run, as a directory with one
+    CSV file per sheet and a manifest of the sheet names and column types.
+    The shards directory may be shared between hosts, so nothing is pickled.
+
+    The directory is written even when there are no failures, so the merge
+    step can tell a finished shard from a missing one.
+    """
+    path = directory / run_key / shard.file_name()
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    sheets = []
+    for number, (sheet_name, df) in enumerate(dataframes.items()):
+        file_name = f'sheet-{number}.csv'
+        df.to_csv(tmp_path / file_name, index=False)
+        dtypes = {str(column): str(dtype) for column, dtype in df.dtypes.items()}
+        sheets.append({'name': sheet_name, 'file': file_name, 'dtypes': dtypes})
+    (tmp_path / MANIFEST_NAME).write_text(json.dumps({'sheets': sheets}), encoding='utf-8')
+    shutil.rmtree(path, ignore_errors=True)
+    tmp_path.replace(path)
+    logger.info(f"Shard {shard} results written to {path}")
+    return path
+
+
+def read_shard_results(path: Path) -> dict[str, 'pd.DataFrame']:
+    """Reads the partial results written by :func:`write_shard_results`."""
+    import pandas as pd
+
+    manifest = json.loads((path / MANIFEST_NAME).read_text(encoding='utf-8'))
+    dataframes = {}
+    for sheet in manifest['sheets']:
+        # Text is read as is, e.g. Order_No stays text, the other columns get their written type back.
+        df = pd.read_csv(path / sheet['file'], dtype=object, keep_default_na=False, na_values=[''])
+        typed = {column: dtype for column, dtype in sheet['dtypes'].items() if dtype not in ('object', 'str', 'string')}
+        dataframes[sheet['name']] = df.astype(typed) if typed else df
+    return dataframes
+
+
+def merge_shard_results(run_key: str, directory: Path = shards_dir) -> dict[str, 'pd.DataFrame']:
+    """
+    Combines the partial results of every shard of the run into the sheets
+    expected by :func:`helper.generate_xlsx_report`.
+
+    Raises:
+        ShardError: If no partial results exist or some shards are missing.
+    """
+    import pandas as pd
+
+    run_dir = directory / run_key
+    partials: dict[int, Path] = {}
+    counts = set()
+    for path in sorted(run_dir.glob('shard-*-of-*')):
+        match = SHARD_FILE_PATTERN.fullmatch(path.name)
+        if match is None or not (path / MANIFEST_NAME).exists():
+            continue
+        index, count = int(match.group(1)), int(match.group(2))
+        partials[index] = path
+        counts.add(count)
+
+    if not partials:
+        raise ShardError(f"No shard results found in {run_dir}")
+    if len(counts) > 1:
+        raise ShardError(f"Shard results in {run_dir} come from runs with different shard counts: {sorted(counts)}")
+    count = counts.pop()
+    missing = sorted(set(range(1, count + 1)) - set(partials))
+    if missing:
+        raise ShardError(f"Missing results for shards {', '.join(f'{index}/{count}' for index in missing)}")
+
+    sheets: dict[str, list['pd.DataFrame']] = {}
+    for index in sorted(partials):
+        dataframes = read_shard_results(partials[index])
+        for sheet_name, df in dataframes.items():
+            sheets.setdefault(sheet_name, []).append(df)
+    logger.info(f"Merged results of {count} shards from {run_dir}")
+    return {sheet_name: pd.concat(dfs, ignore_index=True) for sheet_name, dfs in sheets.items()}
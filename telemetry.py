@@ -0,0 +1,246 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+import json
+from pathlib import Path
+import threading
+import time
+from typing import Optional
+
+from helper import reports_dir
+from loggerfactory import LoggerFactory
+
+
+logger = LoggerFactory.get_logger(__name__)
+
+telemetry_dir = reports_dir / 'telemetry'
+
+# Telemetry of the run sending a request from the current thread or task, see :meth:`RunTelemetry.request`.
+active_telemetry: ContextVar = ContextVar('active_telemetry', default=None)
+
+
+@dataclass
+class BackendStats:
+    requests: int = 0
+    errors: int = 0
+    retries: int = 0
+    in_flight: int = 0
+    latency_seconds: float = 0.0
+
+
+@dataclass
+class RequestOutcome:
+    """Set 'ok' to False inside :meth:`RunTelemetry.request` when the request failed without raising."""
+    ok: bool = True
+
+
+@dataclass
+class FlowProgress:
+    """
+    Progress of one flow, used like an enlighten counter: ``progress.update()``
+    after every checked order.
+    """
+    name: str
+    total: int
+    telemetry: 'RunTelemetry' = field(repr=False)
+    done: int = 0
+    counter: Optional[object] = field(default=None, repr=False)
+
+    def update(self, incr: int = 1, force: bool = False):
+        with self.telemetry._lock:
+            self.done += incr
+        if self.counter is not None:
+            self.counter.update(incr, force=force)
+        self.telemetry.tick()
+
+
+class RunTelemetry:
+    """
+    Progress and telemetry of a whole run.
+
+    Keeps one progress bar per flow and a status bar with the order rate, the
+    requests per second, in-flight requests, errors and retries of every
+    backend and the ETA of the orders known so far. Every 'log_every' seconds
+    and when the run ends the same numbers are appended as one JSON line to
+    'log_path', for runs without a terminal.
+
+    Usage::
+
+      telemetry = RunTelemetry(log_path=Path('reports/telemetry/run.jsonl'))
+      progress = telemetry.add_flow('hotlink prepaid', total=len(orders))
+      with telemetry.request('swap') as outcome:
+          outcome.ok = swap.get_order('HOS1234') is not None
+      progress.update()
+      telemetry.close()
+    """
+
+    def __init__(self, log_path: Optional[Path] = None, log_every: float = 30, display: bool = True):
+        self.log_path = log_path
+        self.log_every = log_every
+        self.display = display
+        self.started = time.monotonic()
+        self.backends: dict[str, BackendStats] = {}
+        self.flows: dict[str, FlowProgress] = {}
+        self._lock = threading.Lock()
+        self._manager = None
+        self._status_bar = None
+        self._last_logged = self.started
+        self._last_displayed = 0.0
+
+    def _backend(self, backend: str) -> BackendStats:
+        if backend not in self.backends:
+            self.backends[backend] = BackendStats()
+        return self.backends[backend]
+
+    def add_flow(self, name: str, total: int) -> FlowProgress:
+        """Starts the progress of a flow of 'total' orders."""
+        progress = FlowProgress(name, total, self)
+        if self.display:
+            if self._manager is None:
+                import enlighten
+                self._manager = enlighten.get_manager()
+                self._status_bar = self._manager.status_bar('')
+            progress.counter = self._manager.counter(total=total, desc=name, unit='orders')
+        with self._lock:
+            self.flows[name] = progress
+        return progress
+
+    @contextmanager
+    def request(self, backend: str):
+        """
+        Counts the enclosed backend request, as failed if it raises or the
+        outcome is not ok. Retries of watched sessions made inside count
+        against this telemetry.
+        """
+        outcome = RequestOutcome()
+        with self._lock:
+            self._backend(backend).in_flight += 1
+        token = active_telemetry.set(self)
+        started = time.perf_counter()
+        try:
+            yield outcome
+        except BaseException:
+            outcome.ok = False
+            raise
+        finally:
+            active_telemetry.reset(token)
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats = self._backend(backend)
+                stats.in_flight -= 1
+                stats.requests += 1
+                stats.latency_seconds += elapsed
+                stats.errors += not outcome.ok
+
+    def retry(self, backend: str, count: int = 1):
+        """Counts retries of a backend request."""
+        with self._lock:
+            self._backend(backend).retries += count
+
+    def watch_session(self, backend: str, session):
+        """
+        Counts the retries of every response of a :obj:`requests.Session`
+        against the telemetry of the :meth:`request` that sent it, so runs
+        sharing the session each count their own retries.
+        """
+        hooks = session.hooks['response']
+        if not any(isinstance(hook, RetryCounter) for hook in hooks):
+            hooks.append(RetryCounter(backend))
+
+    def snapshot(self) -> dict:
+        """Returns the current numbers of the run."""
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            done = sum(flow.done for flow in self.flows.values())
+            total = sum(flow.total for flow in self.flows.values())
+            rate = done / elapsed if elapsed else 0.0
+            return {
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'elapsed_seconds': round(elapsed, 3),
+                'orders_done': done,
+                'orders_total': total,
+                'orders_per_second': round(rate, 3),
+                'eta_seconds': round((total - done) / rate, 1) if rate else None,
+                'flows': {name: {'done': flow.done, 'total': flow.total} for name, flow in self.flows.items()},
+                'backends': {
+                    backend: {
+                        'requests': stats.requests,
+                        'errors': stats.errors,
+                        'retries': stats.retries,
+                        'in_flight': stats.in_flight,
+                        'requests_per_second': round(stats.requests / elapsed, 3) if elapsed else 0.0,
+                        'mean_latency_seconds': round(stats.latency_seconds / stats.requests, 3) if stats.requests else None,
+                    }
+                    for backend, stats in self.backends.items()
+                },
+            }
+
+    def status_text(self, snapshot: dict) -> str:
+        """Returns a one line summary of a snapshot for the status bar."""
+        eta = snapshot['eta_seconds']
+        parts = [
+            f"{snapshot['orders_done']}/{snapshot['orders_total']} orders",
+            f"{snapshot['orders_per_second']:.1f}/s",
+            f"ETA {'-' if eta is None else time.strftime('%H:%M:%S', time.gmtime(eta))}",
+        ]
+        for backend, stats in snapshot['backends'].items():
+            parts.append(
+                f"{backend} {stats['requests_per_second']:.1f} req/s, {stats['in_flight']} in flight, "
+                f"{stats['errors']} errors, {stats['retries']} retries"
+            )
+        return ' | '.join(parts)
+
+    def tick(self):
+        """Refreshes the status bar and writes a log line when they are due."""
+        now = time.monotonic()
+        if self._status_bar is not None and now - self._last_displayed >= 0.5:
+            self._last_displayed = now
+            self._status_bar.update(self.status_text(self.snapshot()))
+        if now - self._last_logged >= self.log_every:
+            self._last_logged = now
+            self.log()
+
+    def log(self, final: bool = False):
+        """Appends a snapshot to the structured log."""
+        snapshot = self.snapshot()
+        snapshot['final'] = final
+        if self.log_path is not None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(snapshot) + '\n')
+        return snapshot
+
+    def close(self):
+        """Writes the final snapshot and stops the progress bars."""
+        snapshot = self.log(final=True)
+        logger.info(f"Run telemetry: {self.status_text(snapshot)}")
+        if self._manager is not None:
+            self._manager.stop()
+            self._manager = None
+            self._status_bar = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RetryCounter:
+    """
+    :obj:`requests.Session` response hook counting the retries urllib3 made
+    before the response, against the active telemetry of the sending thread.
+    """
+
+    def __init__(self, backend: str):
+        self.backend = backend
+
+    def __call__(self, response, *args, **kwargs):
+        telemetry = active_telemetry.get()
+        retries = getattr(response.raw, 'retries', None)
+        if telemetry is not None and retries is not None:
+            retried = sum(1 for attempt in retries.history if attempt.redirect_location is None)
+            if retried:
+                telemetry.retry(self.backend, retried)
+        return response
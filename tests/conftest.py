@@ -0,0 +1,131 @@
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import pytest
+
+import async_portals
+import order_validation
+import order_validation_config
+import parse_pool
+import reports
+from wm_portal import INITIALIZATION_ENDPOINT, LOGIN_ENDPOINT, ORDER_DETAILS_ENDPOINT
+
+
+@pytest.fixture(autouse=True)
+def no_results_store(monkeypatch):
+    """Keeps runs from reading and writing the results store of the working directory, tests inject their own."""
+    monkeypatch.setattr(order_validation, 'RESULTS_STORE', False)
+
+
+@pytest.fixture(autouse=True)
+def no_parse_processes(monkeypatch):
+    """Parses on the calling thread, tests of the parse pool start their own processes."""
+    monkeypatch.setattr(order_validation_config, 'PARSE_PROCESSES', 0)
+    parse_pool.shutdown_parse_pool()
+
+
+def order_details_table(order_id: str, status: str) -> str:
+    cells = ''.join(f'<td>{cell}</td>' for cell in ('', '', order_id, '', f'IF-{order_id}', status, f'{status} message'))
+    return f'<html><body><table><tbody><tr>{cells}</tr></tbody></table></body></html>'
+
+
+class FakePortalsHandler(BaseHTTPRequestHandler):
+    """
+    Swap, WM and cms on one local server. Swap has no records for HOS1003, WM
+    fails MOS1002 and has no MOS1004, and the first request of every path in
+    'unavailable_once' gets a 503.
+    """
+    protocol_version = 'HTTP/1.1'
+    requests: Counter = Counter()
+    unavailable_once: set = set()
+    master_report = b''
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if self.unavailable(url.path):
+            return
+        if url.path == '/Delivery/AjaxHandler':
+            search = parse_qs(url.query)['sSearch'][0]
+            self.reply(json.dumps({'iTotalDisplayRecords': 0 if search == 'HOS1003' else 1}).encode(), 'application/json')
+        elif url.path == INITIALIZATION_ENDPOINT:
+            self.reply(b'<html><script>var axsrft = "token";</script></html>')
+        elif url.path == '/cms/masterreport':
+            self.reply(self.master_report, 'application/octet-stream')
+        else:
+            self.reply(b'<html></html>')
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode())
+        if self.unavailable(url.path):
+            return
+        if url.path == '/User/Login':
+            self.send_response(302)
+            self.send_header('Location', '/Delivery')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif url.path == ORDER_DETAILS_ENDPOINT:
+            order_id = form['jsfwmp7517:defaultForm:htmlInputText'][0]
+            body = '<html></html>' if order_id == 'MOS1004' else order_details_table(
+                order_id, 'FAIL' if order_id == 'MOS1002' else 'SUCCESS')
+            self.reply(body.encode())
+        elif url.path == LOGIN_ENDPOINT:
+            self.reply(b'<html></html>')
+        else:
+            self.send_error(404)
+
+    def unavailable(self, path: str) -> bool:
+        FakePortalsHandler.requests[path] += 1
+        if path in self.unavailable_once and FakePortalsHandler.requests[path] == 1:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return True
+        return False
+
+    def reply(self, body: bytes, content_type: str = 'text/html'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_portals(monkeypatch):
+    """Points the asyncio Swap, WM and cms clients at a :class:`FakePortalsHandler` and returns its handler."""
+    FakePortalsHandler.requests = Counter()
+    FakePortalsHandler.unavailable_once = set()
+    buffer = io.BytesIO()
+    pd.DataFrame({
+        'Order_No': ['1001A1', '1003A1', 'MOS1002', 'MOS1004'],
+        'Order_Delivery_Status': ['new'] * 4,
+        'Order_Cancellation_Status': [None] * 4,
+        'Package_Type': ['SIM'] * 4,
+        'Fulfillment_Mode': ['Standard Delivery'] * 4,
+    }).to_excel(buffer, index=False)
+    FakePortalsHandler.master_report = buffer.getvalue()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakePortalsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    monkeypatch.setattr(async_portals, 'SWAP_BASE_URL', base_url)
+    monkeypatch.setattr(async_portals, 'LOGIN_URL', f'{base_url}/User/Login')
+    monkeypatch.setattr(async_portals, 'SHOW_DATA_URL', f'{base_url}/Delivery/ShowData')
+    monkeypatch.setattr(async_portals, 'AJAX_HANDLER_URL', f'{base_url}/Delivery/AjaxHandler')
+    monkeypatch.setattr(async_portals, 'WM_BASE_URL', base_url)
+    monkeypatch.setattr(reports, 'CMS_REPORT_URL', f'{base_url}/cms/masterreport')
+    for name in ('swapUserName', 'Password', 'secretUser', 'wmPassword'):
+        monkeypatch.setenv(name, f'test-{name}')
+    yield FakePortalsHandler
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,134 @@
+import asyncio
+
+import aiohttp
+
+import async_order_validation
+from async_order_validation import (
+    AsyncLookupTable,
+    AsyncOrderLookups,
+    async_validate_reports,
+    lookup_swap_orders_async,
+    lookup_wm_orders_async,
+)
+from checkpoint import NullJournal
+from filter_dates import FilterDate, FilterDates
+from flows import ReportInfo
+from reports import Filter, ReportType
+from telemetry import RunTelemetry
+from wm_portal import WMOrder
+
+
+def test_async_lookup_table_coalesces_in_flight_requests():
+    """Test that concurrent tasks asking for the same key share one request."""
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 1
+
+    async def main():
+        table = AsyncLookupTable()
+        results = await asyncio.gather(*(table.get_or_fetch('HOS1', fetch) for _ in range(5)))
+        cached = await table.get_or_fetch('HOS1', fetch)
+        return table, results, cached
+
+    table, results, cached = asyncio.run(main())
+    assert results == [1] * 5
+    assert cached == 1
+    assert len(calls) == 1
+    assert (table.fetched, table.reused) == (1, 5)
+
+
+def test_async_lookup_table_retries_failed_lookups():
+    """Test that a lookup returning None is fetched again by the next caller."""
+    async def main():
+        table = AsyncLookupTable()
+        first = await table.get_or_fetch('HOS1', lambda: asyncio.sleep(0, result=None))
+        second = await table.get_or_fetch('HOS1', lambda: asyncio.sleep(0, result=0))
+        return first, second
+
+    assert asyncio.run(main()) == (None, 0)
+
+
+def test_lookups_keep_a_fixed_number_of_tasks(monkeypatch):
+    """Test that many orders are checked by SWAP_CONCURRENCY worker tasks, in the order given."""
+    monkeypatch.setattr(async_order_validation, 'SWAP_CONCURRENCY', 4)
+    swap_ids = [f'HOS{number}' for number in range(1000)]
+    started, tasks = [], []
+
+    class FakeLookups:
+        async def swap_total_records(self, swap_order_id):
+            started.append(swap_order_id)
+            tasks.append(len(asyncio.all_tasks()))
+            await asyncio.sleep(0)
+            return 1
+
+    async def main():
+        pbar = RunTelemetry(display=False).add_flow('swap lookups', len(swap_ids))
+        return await lookup_swap_orders_async(FakeLookups(), swap_ids, pbar)
+
+    total_records = asyncio.run(main())
+    assert list(total_records.values()) == [1] * 1000
+    assert started == swap_ids
+    assert max(tasks) <= 5
+
+
+class FakeAsyncWM:
+    """Async WM whose bulk search of the 'MOS2' prefix fails."""
+
+    def __init__(self):
+        self.fetched = []
+
+    async def fetch_bulk(self, query, page_size=100):
+        if query == 'MOS2':
+            raise aiohttp.ServerDisconnectedError()
+        await asyncio.sleep(0.01)
+        return [WMOrder(f'{query}00{index}', 'IF1', 'SUCCESS', '') for index in range(2)]
+
+    async def fetch(self, order_id):
+        self.fetched.append(order_id)
+        return WMOrder(order_id, 'IF2', 'FAIL', 'timeout')
+
+    async def close(self):
+        pass
+
+
+def test_failed_bulk_search_falls_back_to_single_lookups():
+    """Test that a failed prefix search neither stops the other searches nor the run."""
+    order_ids = ['MOS1000', 'MOS1001', 'MOS2000', 'MOS2001', 'MOS3000']
+
+    async def main():
+        async with AsyncOrderLookups(NullJournal()) as lookups:
+            lookups._wm = wm = FakeAsyncWM()
+            matched = await lookups.prefetch_wm_orders(order_ids, prefix_length=4, page_size=100)
+            pbar = RunTelemetry(display=False).add_flow('wm lookups', len(order_ids))
+            return matched, await lookup_wm_orders_async(lookups, order_ids, pbar), wm
+
+    matched, orders, wm = asyncio.run(main())
+    assert matched == 3
+    assert sorted(wm.fetched) == ['MOS2000', 'MOS2001']
+    assert [orders[order_id].interface_log_ID for order_id in order_ids] == ['SUCCESS', 'SUCCESS', 'FAIL', 'FAIL', 'SUCCESS']
+
+
+def test_async_validate_reports(fake_portals, monkeypatch):
+    """Test a full asyncio run against fake cms, Swap and WM, retrying an unavailable report download."""
+    fake_portals.unavailable_once = {'/cms/masterreport'}
+    monkeypatch.setattr(async_order_validation, 'RUN_FOR', ('all prepaid', 'wm prepaid'))
+    monkeypatch.setattr(async_order_validation, 'REPORTS_INFO', {
+        'all prepaid': ReportInfo(ReportType('PREPAID'), []),
+        'wm prepaid': ReportInfo(ReportType('PREPAID'), [Filter('Order_No', 'contains', ('MOS', ))], 'wm', 'order_no'),
+    })
+    monkeypatch.setattr(async_order_validation, 'PARTIAL_REPORT_SECONDS', None)
+    filter_dates = FilterDates(FilterDate('03/02/2023 00:00'), FilterDate('04/02/2023 00:00'))
+
+    async def main():
+        async with AsyncOrderLookups(NullJournal()) as lookups:
+            return await async_validate_reports(filter_dates, False, lookups), lookups
+
+    results, lookups = asyncio.run(main())
+    assert results.orders_not_flown_to_swap.original_ids.tolist() == ['1003A1']
+    assert [order.order_ID for order in results.wm_failed_orders] == ['MOS1002']
+    assert results.unverified_orders == []
+    assert fake_portals.requests['/cms/masterreport'] == 2
+    assert lookups.swap_results.fetched == 4
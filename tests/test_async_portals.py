@@ -0,0 +1,75 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+import async_portals
+from async_portals import AsyncSwap, AsyncWM, backoff_seconds, request_with_retries
+from wm_portal import LOGIN_ENDPOINT, ORDER_DETAILS_ENDPOINT, WMOrder
+
+
+def test_backoff_matches_urllib3():
+    """Test that retries wait like urllib3: not before the first, then doubling up to the maximum."""
+    assert [backoff_seconds(retry, 30) for retry in range(1, 5)] == [0, 60, 120, 120]
+    assert [backoff_seconds(retry, 2) for retry in range(1, 5)] == [0, 4, 8, 16]
+
+
+def test_request_with_retries_waits_between_attempts(fake_portals, monkeypatch):
+    """Test that an unavailable backend is retried after the urllib3 backoff."""
+    fake_portals.unavailable_once = {'/Delivery/ShowData'}
+    sleeps = []
+    sleep = asyncio.sleep
+
+    async def record_sleep(seconds, *args, **kwargs):
+        sleeps.append(seconds)
+        await sleep(0)
+    monkeypatch.setattr(asyncio, 'sleep', record_sleep)
+
+    async def main():
+        async with aiohttp.ClientSession() as session:
+            response, _ = await request_with_retries(session, 'GET', async_portals.SHOW_DATA_URL, total=3, backoff_factor=30)
+            return response.status
+
+    assert asyncio.run(main()) == 200
+    assert sleeps == [0]
+    assert fake_portals.requests['/Delivery/ShowData'] == 2
+
+
+def test_async_swap_logs_in_and_searches(fake_portals):
+    """Test that AsyncSwap logs in, retries an unavailable search and reads the total records."""
+    fake_portals.unavailable_once = {'/Delivery/AjaxHandler'}
+
+    async def main():
+        swap = await AsyncSwap.create(concurrency=2)
+        try:
+            return await asyncio.gather(swap.get_order('HOS1001'), swap.get_order('HOS1003'))
+        finally:
+            await swap.close()
+
+    assert sorted(asyncio.run(main())) == [0, 1]
+    assert fake_portals.requests['/User/Login'] == 1
+    assert fake_portals.requests['/Delivery/AjaxHandler'] == 3
+
+
+def test_async_swap_login_failure(fake_portals, monkeypatch):
+    """Test that a login redirected back to the login page stops the run."""
+    monkeypatch.setattr(async_portals, 'LOGIN_URL', async_portals.LOGIN_URL.replace('/User/Login', '/User/Login/Failed'))
+    with pytest.raises(SystemExit):
+        asyncio.run(AsyncSwap.create(concurrency=1))
+
+
+def test_async_wm_fetches_orders(fake_portals):
+    """Test that AsyncWM logs in, reads the form token and parses the last row of an order."""
+    async def main():
+        wm = await AsyncWM.create(concurrency=2)
+        try:
+            return wm.data['jsfwmp7517:defaultForm'], await wm.fetch('MOS1002'), await wm.fetch('MOS1004')
+        finally:
+            await wm.close()
+
+    token, failed, missing = asyncio.run(main())
+    assert token == 'token'
+    assert failed == WMOrder('MOS1002', 'IF-MOS1002', 'FAIL', 'FAIL message')
+    assert missing is None
+    assert fake_portals.requests[LOGIN_ENDPOINT] == 1
+    assert fake_portals.requests[ORDER_DETAILS_ENDPOINT] == 2
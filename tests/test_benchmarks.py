@@ -0,0 +1,41 @@
+from benchmarks import (
+    BASELINE_PATH,
+    DEFAULT_ROWS,
+    benchmark_cases,
+    compare,
+    load_baseline,
+    missing_baselines,
+    run_benchmarks,
+    save_baseline,
+    synthetic_master_report,
+)
+
+
+class TestBenchmarks:
+
+    # Synthetic reports should look like cms exports, with unique orders and a share of MOS orders.
+    def test_synthetic_master_report(self):
+        report = synthetic_master_report(20000)
+        assert report['Order_No'].is_unique
+        assert 0.1 < report['Order_No'].str.startswith('MOS').mean() < 0.2
+        assert report['Order_No'].str.match(r'^(MOS\d+|\d+A\d)$').all()
+        assert 0.5 < (report['Order_Delivery_Status'] == 'fulfilled').mean() < 0.6
+
+    # Every hot path should be measured at every size and compared with its stored baseline.
+    def test_run_and_compare(self, tmp_path):
+        results = run_benchmarks((2000, ), repeat=1)
+        assert len(results) == 6
+        assert all(measured['seconds'] > 0 and measured['peak_mib'] > 0 for measured in results.values())
+        baseline_path = tmp_path / 'baseline.json'
+        save_baseline(results, baseline_path)
+        assert compare(results, load_baseline(baseline_path)) == []
+        slower = {**results, 'Report.filter@2000': {'seconds': 100.0, 'peak_mib': 0.0}}
+        assert [(regression.benchmark, regression.metric) for regression in compare(slower, results)] == [
+            ('Report.filter@2000', 'seconds')]
+        assert missing_baselines(results, {}) == list(results)
+
+    # The stored baselines should cover every benchmark at every default size.
+    def test_stored_baselines(self):
+        baseline = load_baseline(BASELINE_PATH)
+        expected = {f'{name}@{rows}' for name in benchmark_cases(synthetic_master_report(100)) for rows in DEFAULT_ROWS}
+        assert expected <= set(baseline)
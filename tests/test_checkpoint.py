@@ -0,0 +1,63 @@
+from checkpoint import CheckpointJournal, get_run_key
+from filter_dates import FilterDate, FilterDates
+
+
+def test_get_run_key():
+    """Test that the run key is built from the selected date range."""
+    filter_dates = FilterDates(FilterDate('01/01/2023 00:00'), FilterDate('02/01/2023 08:30'))
+    assert get_run_key(filter_dates) == '202301010000-202301020830'
+
+
+class TestCheckpointJournal:
+
+    # Records written before a crash should be replayed on resume.
+    def test_resume_replays_records(self, tmp_path):
+        path = tmp_path / 'run.jsonl'
+        journal = CheckpointJournal(path)
+        journal.record('swap', 'HOS1', 1)
+        journal.record('wm', 'MOS2', {'order_ID': 'MOS2'})
+        journal.close()
+
+        resumed = CheckpointJournal(path, resume=True)
+        assert resumed.get('swap', 'HOS1') == 1
+        assert resumed.get('wm', 'MOS2') == {'order_ID': 'MOS2'}
+        assert resumed.get('swap', 'HOS3') is None
+        resumed.close()
+
+    # Starting without resume should discard the previous journal.
+    def test_fresh_run_truncates(self, tmp_path):
+        path = tmp_path / 'run.jsonl'
+        with CheckpointJournal(path) as journal:
+            journal.record('swap', 'HOS1', 1)
+        with CheckpointJournal(path) as journal:
+            assert journal.get('swap', 'HOS1') is None
+        assert path.read_text() == ''
+
+    # A partially written last line should be skipped when replaying.
+    def test_replay_ignores_torn_write(self, tmp_path):
+        path = tmp_path / 'run.jsonl'
+        path.write_text('{"backend": "swap", "id": "HOS1", "result": 0}\n{"backend": "sw')
+        journal = CheckpointJournal(path, resume=True)
+        assert journal.entries == {('swap', 'HOS1'): 0}
+        journal.record('swap', 'HOS2', 1)
+        journal.close()
+        resumed = CheckpointJournal(path, resume=True)
+        assert resumed.entries == {('swap', 'HOS1'): 0, ('swap', 'HOS2'): 1}
+        resumed.close()
+
+    # A journal holding only a torn line should be emptied on resume.
+    def test_resume_after_torn_first_line(self, tmp_path):
+        path = tmp_path / 'run.jsonl'
+        path.write_text('{"backend": "sw')
+        journal = CheckpointJournal(path, resume=True)
+        journal.record('swap', 'HOS1', 0)
+        journal.close()
+        assert path.read_text() == '{"backend": "swap", "id": "HOS1", "result": 0}\n'
+
+    # Compaction on a clean exit should keep one line per order.
+    def test_compact_on_exit(self, tmp_path):
+        path = tmp_path / 'run.jsonl'
+        with CheckpointJournal(path) as journal:
+            journal.record('swap', 'HOS1', 0)
+            journal.record('swap', 'HOS1', 1)
+        assert path.read_text().splitlines() == ['{"backend": "swap", "id": "HOS1", "result": 1}']
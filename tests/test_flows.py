@@ -0,0 +1,225 @@
+import pandas as pd
+import pytest
+
+import order_validation
+from filter_dates import FilterDate, FilterDates
+from flows import ReportInfo, SkipRule, load_flows, load_skip_rules, plan_run
+from order_validation_config import FLOWS_PATH
+from profiling import profiler
+from reports import Filter, Report, ReportType
+from sharding import Shard
+from telemetry import RunTelemetry
+from wm_portal import WMOrder
+
+
+@pytest.fixture
+def filter_dates():
+    return FilterDates(FilterDate('01/01/2023 00:00'), FilterDate('02/01/2023 00:00'))
+
+
+class FakeLookups:
+    def __init__(self):
+        self.telemetry = RunTelemetry(display=False)
+        self.unverified_wm_orders = {'MOS1004'}
+        self.swap_requests = []
+        self.wm_requests = []
+        self.snapshots = []
+
+    def swap_total_records(self, swap_order_id):
+        self.snapshots.append(self.telemetry.snapshot())
+        self.swap_requests.append(swap_order_id)
+        return 0 if swap_order_id == 'HOS1003' else 1
+
+    def wm_order(self, order_id):
+        self.wm_requests.append(order_id)
+        return None if order_id == 'MOS1004' else WMOrder(order_id, 'IF1', 'FAIL', 'timeout')
+
+
+class TestFlowsFile:
+
+    # The shipped flows should keep the WM flow on order numbers and share the postpaid reports.
+    def test_default_flows(self):
+        reports_info, run_for = load_flows(FLOWS_PATH)
+        assert run_for[-1] == 'wm prepaid'
+        assert (reports_info['wm prepaid'].backend, reports_info['wm prepaid'].id_mapping) == ('wm', 'order_no')
+        assert reports_info['hotlink prepaid'].id_mapping == 'swap_id'
+        assert reports_info['preorder postpaid instore'].filters[2] == Filter('Order_Type', 'exists', ('Pre Order', ))
+        assert len(plan_run(run_for, reports_info).downloads) == 3
+
+    # Unknown backends and flows should stop the run before anything is requested.
+    def test_invalid_flows(self, tmp_path):
+        flows_path = tmp_path / 'flows.yml'
+        flows_path.write_text('flows:\n  a:\n    report: {plan_type: PREPAID}\n    backend: crm\n')
+        with pytest.raises(SystemExit, match='backend'):
+            load_flows(flows_path)
+        flows_path.write_text('run_for: [b]\nflows:\n  a:\n    report: {plan_type: PREPAID}\n')
+        reports_info, run_for = load_flows(flows_path)
+        with pytest.raises(SystemExit, match="'b' not found"):
+            plan_run(run_for, reports_info)
+
+    # Skip rules should be off by default, default to every backend and reject unknown filter methods.
+    def test_skip_rules(self, tmp_path):
+        assert load_skip_rules(FLOWS_PATH) == []
+        flows_path = tmp_path / 'flows.yml'
+        # The documented rules should load once uncommented.
+        documented = FLOWS_PATH.read_text().split('# skip:\n', 1)[1].split('\n\n', 1)[0]
+        flows_path.write_text('flows: {}\nskip:\n' + documented.replace('# ', '', 1).replace('\n# ', '\n'))
+        assert [rule.backends for rule in load_skip_rules(flows_path)] == [('swap', ), ('swap', 'wm')]
+        flows_path.write_text('flows: {}\nskip:\n  - when: [Order_No, startsWith, [MOS]]\n    reason: mos\n')
+        with pytest.raises(SystemExit, match='startsWith'):
+            load_skip_rules(flows_path)
+
+
+class TestPlannedRun:
+
+    # Flows reading one report should download it once and share the lookups of the same IDs.
+    def test_shared_downloads_and_lookups(self, filter_dates, monkeypatch):
+        report_type = ReportType('PREPAID')
+        dataframe = pd.DataFrame({
+            'Order_No': ['1001A1', '1003A1', 'MOS1002', 'MOS1004'],
+            'Order_Delivery_Status': ['new'] * 4,
+            'Order_Cancellation_Status': [None] * 4,
+            'Package_Type': ['SIM'] * 4,
+            'Fulfillment_Mode': ['Standard Delivery'] * 4,
+        })
+        downloads = []
+
+        def get_report(report_type, filter_dates, save_to_disk, memory_budget=None):
+            downloads.append(report_type)
+            return Report(report_type, filter_dates, save_to_disk, dataframe=dataframe)
+
+        monkeypatch.setattr(order_validation, 'get_report', get_report)
+        monkeypatch.setattr(order_validation, 'RUN_FOR', ('all prepaid', 'mos prepaid', 'wm prepaid'))
+        monkeypatch.setattr(order_validation, 'REPORTS_INFO', {
+            'all prepaid': ReportInfo(report_type, []),
+            'mos prepaid': ReportInfo(report_type, [Filter('Order_No', 'contains', ('MOS', ))]),
+            'wm prepaid': ReportInfo(report_type, [Filter('Order_No', 'contains', ('MOS', ))], 'wm', 'order_no'),
+        })
+        lookups = FakeLookups()
+        results = order_validation.validate_reports(filter_dates, False, lookups)
+
+        assert len(downloads) == 1
+        assert lookups.swap_requests == ['HOS1001', 'HOS1003', 'MOS1002', 'MOS1004']
+        assert lookups.wm_requests == ['MOS1002', 'MOS1004']
+        assert results.orders_not_flown_to_swap.original_ids.tolist() == ['1003A1']
+        assert [order.order_ID for order in results.wm_failed_orders] == ['MOS1002']
+        assert results.unverified_orders == [('wm prepaid', 'MOS1004')]
+        # Both backends should count towards the run totals from the first lookup.
+        assert lookups.snapshots[0]['orders_total'] == 6
+        assert lookups.snapshots[0]['flows'] == {'swap lookups': {'done': 0, 'total': 4},
+                                                 'wm lookups': {'done': 0, 'total': 2}}
+
+    # A run cut short by its deadline should have checked the top WM orders, not only Swap ones.
+    def test_deadline_checks_both_backends_first(self, filter_dates, monkeypatch):
+        dataframe = pd.DataFrame({
+            'Order_No': ['1001A1', '1003A1', '1005A1', 'MOS1002', 'MOS1004'],
+            'Order_Delivery_Status': ['new'] * 5,
+            'Order_Cancellation_Status': [None] * 5,
+            'Package_Type': ['SIM'] * 5,
+            'Fulfillment_Mode': ['Standard Delivery'] * 5,
+        })
+        monkeypatch.setattr(order_validation, 'get_report', lambda report_type, filter_dates, save_to_disk,
+                            memory_budget=None: Report(report_type, filter_dates, save_to_disk, dataframe=dataframe))
+        monkeypatch.setattr(order_validation, 'RUN_FOR', ('hotlink prepaid', 'wm prepaid'))
+        monkeypatch.setattr(order_validation, 'REPORTS_INFO', {
+            'hotlink prepaid': ReportInfo(ReportType('PREPAID'), [Filter('Order_No', 'contains', ('A1', ))]),
+            'wm prepaid': ReportInfo(ReportType('PREPAID'), [Filter('Order_No', 'contains', ('MOS', ))], 'wm', 'order_no'),
+        })
+        # MOS1002 failed in an earlier run, so it is the most useful WM order to check.
+        monkeypatch.setattr(order_validation, 'prioritize_run_lookups', lambda flows, lookup_ids: {
+            'swap': ['HOS1005', 'HOS1003', 'HOS1001'], 'wm': ['MOS1002', 'MOS1004']})
+
+        class DeadlineLookups(FakeLookups):
+            """Only answers the first two lookups, like a run whose deadline passes."""
+
+            def expired(self):
+                return len(self.swap_requests) + len(self.wm_requests) >= 2
+
+            def swap_total_records(self, swap_order_id):
+                return None if self.expired() else super().swap_total_records(swap_order_id)
+
+            def wm_order(self, order_id):
+                if self.expired():
+                    self.unverified_wm_orders.add(order_id)
+                    return None
+                return super().wm_order(order_id)
+
+        lookups = DeadlineLookups()
+        results = order_validation.validate_reports(filter_dates, False, lookups)
+
+        assert (lookups.swap_requests, lookups.wm_requests) == (['HOS1005'], ['MOS1002'])
+        assert [order.order_ID for order in results.wm_failed_orders] == ['MOS1002']
+        assert ('wm prepaid', 'MOS1004') in results.unverified_orders
+
+    # Orders settled by a skip rule should not be looked up in the backends the rule applies to.
+    def test_skip_rules_save_lookups(self, filter_dates, monkeypatch, caplog):
+        dataframe = pd.DataFrame({
+            'Order_No': ['1001A1', '1003A1', 'MOS1002', 'MOS1004'],
+            'Order_Delivery_Status': ['new', 'fulfilled', 'fulfilled', 'new'],
+            'Order_Cancellation_Status': [None, None, None, 'cancelled'],
+            'Package_Type': ['SIM'] * 4,
+            'Fulfillment_Mode': ['Standard Delivery'] * 4,
+        })
+        monkeypatch.setattr(order_validation, 'get_report', lambda report_type, filter_dates, save_to_disk,
+                            memory_budget=None: Report(report_type, filter_dates, save_to_disk, dataframe=dataframe))
+        monkeypatch.setattr(order_validation, 'RUN_FOR', ('all prepaid', 'wm prepaid'))
+        monkeypatch.setattr(order_validation, 'REPORTS_INFO', {
+            'all prepaid': ReportInfo(ReportType('PREPAID'), []),
+            'wm prepaid': ReportInfo(ReportType('PREPAID'), [Filter('Order_No', 'contains', ('MOS', ))], 'wm', 'order_no'),
+        })
+        monkeypatch.setattr(order_validation, 'SKIP_RULES', [
+            SkipRule(Filter('Order_Delivery_Status', 'exists', ('fulfilled', )), 'delivered', ('swap', )),
+            SkipRule(Filter('Order_Cancellation_Status', 'exists', ('cancelled', )), 'cancelled'),
+        ])
+        lookups = FakeLookups()
+        with caplog.at_level('INFO'):
+            results = order_validation.validate_reports(filter_dates, False, lookups)
+
+        assert lookups.swap_requests == ['HOS1001']
+        assert lookups.wm_requests == ['MOS1002']
+        assert results.checked_orders == {'all prepaid': 1, 'wm prepaid': 1}
+        assert 'Skip rules saved 3 swap, 1 wm lookups for 4 orders.' in caplog.text
+
+    # Skip counts of a sharded run should only cover the shard, and rules on missing columns should be ignored.
+    def test_skip_rules_in_shard(self, filter_dates, caplog):
+        order_nos = [f'{number}A1' for number in range(1001, 1021)]
+        report = Report(ReportType('PREPAID'), filter_dates, False, dataframe=pd.DataFrame({
+            'Order_No': order_nos,
+            'Order_Delivery_Status': ['new'] * 20,
+            'Order_Cancellation_Status': ['cancelled'] * 20,
+            'Package_Type': ['SIM'] * 20,
+            'Fulfillment_Mode': ['Standard Delivery'] * 20,
+        }))
+        plan = plan_run(('all prepaid', ), {'all prepaid': ReportInfo(ReportType('PREPAID'), [])})
+        shard = Shard(1, 4)
+        rules = [
+            SkipRule(Filter('Payment_Status', 'exists', ('refunded', )), 'refunded'),
+            SkipRule(Filter('Order_Cancellation_Status', 'exists', ('cancelled', )), 'cancelled'),
+        ]
+        in_shard = int(shard.mask(order_nos).sum())
+        with caplog.at_level('INFO'):
+            [flow] = order_validation.select_flow_orders(plan, {plan.report_key('all prepaid'): report}, shard, rules)
+
+        assert len(flow.orders) == 0 and len(flow.skipped) == in_shard
+        assert f'Skipped {in_shard} all prepaid orders: {in_shard} cancelled' in caplog.text
+        assert 'Column Payment_Status not in' in caplog.text
+
+    # Every flow should be timed in its own span while its orders are selected.
+    def test_flow_spans(self, filter_dates, monkeypatch):
+        report = Report(ReportType('PREPAID'), filter_dates, False, dataframe=pd.DataFrame({
+            'Order_No': ['1001A1', 'MOS1002'],
+            'Order_Delivery_Status': ['new'] * 2,
+            'Order_Cancellation_Status': [None] * 2,
+            'Package_Type': ['SIM'] * 2,
+            'Fulfillment_Mode': ['Standard Delivery'] * 2,
+        }))
+        plan = plan_run(('all prepaid', 'wm prepaid'), {
+            'all prepaid': ReportInfo(ReportType('PREPAID'), []),
+            'wm prepaid': ReportInfo(ReportType('PREPAID'), [Filter('Order_No', 'contains', ('MOS', ))], 'wm', 'order_no'),
+        })
+        monkeypatch.setattr(profiler, 'enabled', True)
+        monkeypatch.setattr(profiler, 'stats', {})
+        with profiler.span('select orders'):
+            order_validation.select_flow_orders(plan, {plan.report_key('all prepaid'): report}, skip_rules=[])
+        assert profiler.stats[('select orders', 'flow:all prepaid')].calls == 1
+        assert profiler.stats[('select orders', 'flow:wm prepaid', 'filter')].calls == 1
@@ -0,0 +1,119 @@
+import base64
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from requests import ConnectionError, Session
+from urllib3 import Retry
+
+from http_fixtures import Cassette, ReplayAdapter, RecordingAdapter, use_cassette
+from http_sessions import pooled_adapter
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.reply(f'page {self.path}'.encode())
+
+    def do_POST(self):
+        self.reply(b'welcome ' + self.rfile.read(int(self.headers['Content-Length'])))
+
+    def reply(self, body):
+        time.sleep(0.05)
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'session=abc123')
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), EchoHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def new_session() -> Session:
+    session = Session()
+    session.mount('http://', pooled_adapter(1, Retry(total=0), timeout=5))
+    return session
+
+
+@pytest.fixture
+def recorded(server, tmp_path, monkeypatch):
+    monkeypatch.setenv('wmPassword', 's3cr3t pass')
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    path = tmp_path / 'cassette.jsonl.gz'
+    with use_cassette(path, 'record'):
+        session = new_session()
+        assert isinstance(session.get_adapter(base_url), RecordingAdapter)
+        session.post(f'{base_url}/login', data={'password': 's3cr3t pass'})
+        for page in (1, 2):
+            session.get(f'{base_url}/orders', params={'page': page, '_': time.time()})
+    return base_url, path
+
+
+class TestCassette:
+
+    # Credentials and cookies should never be written to the cassette.
+    def test_record_redacts_secrets(self, recorded):
+        _, path = recorded
+        lines = gzip.open(path, 'rt').read().splitlines()
+        contents = b''.join(base64.b64decode(json.loads(line)['content']) for line in lines[1:])
+        assert len(lines) == 4
+        assert b'<wmPassword>' in contents
+        assert 's3cr3t' not in ''.join(lines) and b's3cr3t' not in contents and 'abc123' not in ''.join(lines)
+
+    # Replay should answer from the cassette, without the network and in recorded order.
+    def test_replay_offline(self, recorded, server, monkeypatch):
+        base_url, path = recorded
+        server.shutdown()
+        monkeypatch.delenv('wmPassword')
+        with use_cassette(path, 'replay', timing_scale=0):
+            session = new_session()
+            assert isinstance(session.get_adapter(base_url), ReplayAdapter)
+            login = session.post(f'{base_url}/login', data={'password': 'replay-wmPassword'})
+            assert login.text == 'welcome password=<wmPassword>'
+            pages = [session.get(f'{base_url}/orders', params={'page': page, '_': 1}).text for page in (1, 2)]
+            assert pages[0].startswith('page /orders?page=1') and pages[1].startswith('page /orders?page=2')
+            with pytest.raises(ConnectionError):
+                session.get(f'{base_url}/unknown')
+
+    # Replayed responses should take their recorded time multiplied by the timing scale.
+    def test_replay_timing(self, recorded):
+        base_url, path = recorded
+        with use_cassette(path, 'replay', timing_scale=2):
+            session = new_session()
+            started = time.perf_counter()
+            session.get(f'{base_url}/orders', params={'page': 1})
+            assert time.perf_counter() - started >= 0.1
+
+    # Adapters created after the cassette is closed should use the network again.
+    def test_closed_cassette_is_not_used(self, recorded):
+        base_url, _ = recorded
+        assert not isinstance(new_session().get_adapter(base_url), (RecordingAdapter, ReplayAdapter))
+
+    # A cassette recorded through run.py should be closed when the run ends, so it replays.
+    def test_record_from_command_line(self, tmp_path):
+        path = tmp_path / 'run.jsonl.gz'
+        run = Path(__file__).parent.parent / 'run.py'
+        subprocess.run([sys.executable, str(run), '--record', str(path), '--history', '1001A1'],
+                       cwd=tmp_path, check=True, capture_output=True, timeout=60)
+        with Cassette(path, 'replay') as cassette:
+            assert cassette.mode == 'replay'
+        assert gzip.open(path, 'rt').read().splitlines() == ['{"version": 1}']
@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+
+import pytest
+from requests import Session
+from urllib3 import Retry
+
+from http_sessions import TimeoutHTTPAdapter, pooled_adapter
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OkHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+class TestPooledAdapter:
+
+    # The adapter should apply the pool size and only add a default timeout when given one.
+    def test_settings(self):
+        adapter = pooled_adapter(8, Retry(total=1), timeout=30)
+        assert isinstance(adapter, TimeoutHTTPAdapter)
+        assert (adapter._pool_maxsize, adapter._pool_block, adapter.timeout) == (8, True, 30)
+        assert not isinstance(pooled_adapter(8, Retry(total=1)), TimeoutHTTPAdapter)
+
+    # More threads than connections should wait for a free connection instead of discarding extra ones.
+    def test_blocking_pool_keeps_connections(self, base_url, caplog):
+        session = Session()
+        session.mount('http://', pooled_adapter(2, Retry(total=0), timeout=5))
+        with caplog.at_level(logging.WARNING, logger='urllib3.connectionpool'), ThreadPoolExecutor(8) as executor:
+            statuses = list(executor.map(lambda _: session.get(base_url).status_code, range(40)))
+        assert statuses == [200] * 40
+        assert 'Connection pool is full' not in caplog.text
@@ -0,0 +1,46 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+
+package_dir = Path(__file__).parent.parent
+
+HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl', 'bs4', 'lxml', 'enlighten', 'dotenv', 'requests', 'aiohttp')
+
+
+def import_times(module: str, cwd: Path) -> dict[str, int]:
+    """Imports the module in a fresh interpreter and returns the cumulative import time of every module in us."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=cwd, env={**os.environ, 'PYTHONPATH': str(package_dir)}, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.removeprefix('import time:').split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.fixture(scope='module')
+def run_import(tmp_path_factory):
+    cwd = tmp_path_factory.mktemp('run_import')
+    return cwd, import_times('run', cwd)
+
+
+class TestRunImports:
+
+    # Importing run.py should not load the heavy dependencies of the validation code paths.
+    @pytest.mark.parametrize('heavy_module', HEAVY_MODULES)
+    def test_no_heavy_imports(self, run_import, heavy_module):
+        _, times = run_import
+        assert heavy_module not in times
+
+    # Importing run.py should not create the reports directory.
+    def test_no_reports_dir(self, run_import):
+        cwd, _ = run_import
+        assert not (cwd / 'reports').exists()
@@ -0,0 +1,137 @@
+import asyncio
+from datetime import date, datetime
+import threading
+
+import pandas as pd
+import pytest
+
+import helper
+from async_order_validation import write_partial_reports
+from filter_dates import FilterDate, FilterDates
+from flows import FlowOrders, ReportInfo
+from lookup_priority import prioritize_lookups
+from order_records import OrderBatch
+from order_validation import PartialReports, ValidationResults
+from reports import Report, ReportType
+from results_store import ResultsStore
+from wm_portal import WMOrder
+
+
+@pytest.fixture
+def filter_dates():
+    return FilterDates(FilterDate('01/01/2023 00:00'), FilterDate('02/01/2023 00:00'))
+
+
+@pytest.fixture
+def flows(filter_dates):
+    report = Report(ReportType('PREPAID'), filter_dates, False, dataframe=pd.DataFrame({
+        'Order_No': ['1001A1', '1002A1', '1003A1', 'MOS1004', 'MOS1005'],
+        'Order_Created_Date': ['2023-01-05', '2023-01-02', None, '2023-01-03', '2023-01-01'],
+        'Order_Delivery_Status': ['new'] * 5,
+        'Order_Cancellation_Status': [None] * 5,
+        'Package_Type': ['SIM'] * 5,
+        'Fulfillment_Mode': ['Standard Delivery'] * 5,
+    }))
+    swap_orders = OrderBatch.from_order_ids(['1001A1', '1002A1', '1003A1'], 'PREPAID')
+    wm_orders = OrderBatch.from_order_ids(['MOS1004', 'MOS1005'], 'PREPAID')
+    return [
+        FlowOrders('hotlink prepaid', ReportInfo(ReportType('PREPAID'), []), report.view(), swap_orders),
+        FlowOrders('wm prepaid', ReportInfo(ReportType('PREPAID'), [], 'wm', 'order_no'), report.view(), wm_orders),
+    ]
+
+
+@pytest.fixture
+def lookup_ids():
+    return {'swap': ['HOS1001', 'HOS1002', 'HOS1003'], 'wm': ['MOS1004', 'MOS1005']}
+
+
+@pytest.fixture
+def store(tmp_path, filter_dates):
+    store = ResultsStore(tmp_path / 'results.sqlite3')
+    results = ValidationResults(order_outcomes=[('hotlink prepaid', '1003A1', 'not_flown_to_swap', None),
+                                                ('wm prepaid', 'MOS1005', 'unverified', None)],
+                                checked_orders={'hotlink prepaid': 10, 'wm prepaid': 10})
+    store.record_run(results, filter_dates, started_at=datetime.combine(date.today(), datetime.min.time()))
+    return store
+
+
+class TestPrioritizeLookups:
+
+    # Without priorities the planned order should be kept.
+    def test_no_priorities(self, flows, lookup_ids):
+        assert prioritize_lookups(flows, lookup_ids, ()) == lookup_ids
+
+    # Oldest orders should be looked up first, orders without a date last.
+    def test_oldest_first(self, flows, lookup_ids):
+        prioritized = prioritize_lookups(flows, lookup_ids, ('oldest_first', ), date_column='Order_Created_Date')
+        assert prioritized == {'swap': ['HOS1002', 'HOS1001', 'HOS1003'], 'wm': ['MOS1005', 'MOS1004']}
+
+    # Without the date column the planned order should be kept.
+    def test_missing_date_column(self, flows, lookup_ids):
+        assert prioritize_lookups(flows, lookup_ids, ('oldest_first', ), date_column='Created') == lookup_ids
+
+    # Orders that failed in earlier runs should come first, unverified ones are not failures.
+    def test_previous_failures(self, flows, lookup_ids, store):
+        prioritized = prioritize_lookups(flows, lookup_ids, ('previous_failures', 'oldest_first'), store,
+                                         date_column='Order_Created_Date')
+        assert prioritized == {'swap': ['HOS1003', 'HOS1002', 'HOS1001'], 'wm': ['MOS1005', 'MOS1004']}
+
+    # Store priorities should be ignored without a store.
+    def test_without_store(self, flows, lookup_ids):
+        assert prioritize_lookups(flows, lookup_ids, ('previous_failures', 'failure_prone_flows')) == lookup_ids
+
+    # The failure rates of the flows should come from the checked and failed counts of the store.
+    def test_failure_rates(self, store):
+        assert store.failure_rates(date.today()) == {'hotlink prepaid': 0.1, 'wm prepaid': 0.0}
+
+    # Unknown priorities should stop the run.
+    def test_unknown_priority(self, flows, lookup_ids):
+        with pytest.raises(SystemExit):
+            prioritize_lookups(flows, lookup_ids, ('newest_first', ))
+
+
+class TestPartialReports:
+
+    # A flush should write the failures of the lookups done so far, and discard should remove the file.
+    def test_flush_and_discard(self, flows, tmp_path, monkeypatch):
+        monkeypatch.setattr(helper, 'reports_dir', tmp_path)
+        swap_total_records, wm_orders = {'HOS1001': 0}, {}
+        partial = PartialReports(flows, swap_total_records, wm_orders, set(), every=None)
+        partial.tick()
+        assert partial.path is None
+
+        partial.flush()
+        assert partial.path.exists()
+        sheets = pd.read_excel(partial.path, sheet_name=None)
+        assert sheets[flows[0].report.name]['Order_No'].tolist() == ['1001A1']
+
+        wm_orders['MOS1004'] = WMOrder('MOS1004', 'IF1', 'FAIL', 'timeout')
+        partial.flush()
+        assert set(pd.read_excel(partial.path, sheet_name=None)) == {flows[0].report.name, 'wm prepaid'}
+
+        path = partial.path
+        partial.discard()
+        assert not path.exists()
+
+    # The asyncio engine should write partial reports off the event loop, from a snapshot of the lookups.
+    def test_written_off_event_loop(self, flows, tmp_path, monkeypatch):
+        monkeypatch.setattr(helper, 'reports_dir', tmp_path)
+        partial = PartialReports(flows, {'HOS1001': 0}, {}, set(), every=0.05)
+        write = partial.write
+        threads = []
+
+        def record_thread(*args):
+            threads.append(threading.current_thread())
+            write(*args)
+        monkeypatch.setattr(partial, 'write', record_thread)
+
+        async def main():
+            done = asyncio.Event()
+            writer = asyncio.create_task(write_partial_reports(partial, done))
+            await asyncio.sleep(0.3)
+            done.set()
+            await writer
+        asyncio.run(main())
+
+        assert threads and threading.main_thread() not in threads
+        assert partial.path.exists()
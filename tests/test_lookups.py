@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pytest
+from requests import Session
+from requests.exceptions import RetryError
+
+from checkpoint import NullJournal
+from lookups import LookupTable, OrderLookups
+from order_validation import lookup_wm_orders
+from telemetry import RunTelemetry
+from wm_portal import WMOrder
+
+
+class TestLookupTable:
+
+    # A key should only be fetched once and then served from the table.
+    def test_fetch_once(self):
+        table = LookupTable()
+        calls = []
+        for _ in range(3):
+            assert table.get_or_fetch('HOS1', lambda: calls.append(1) or 1) == 1
+        assert len(calls) == 1
+        assert (table.fetched, table.reused) == (1, 2)
+
+    # A failed lookup should not be stored so it is retried by the next caller.
+    def test_failed_lookup_is_retried(self):
+        table = LookupTable()
+        assert table.get_or_fetch('HOS1', lambda: None) is None
+        assert table.get_or_fetch('HOS1', lambda: 0) == 0
+        assert 'HOS1' in table
+
+    # An exception should reach the caller and leave the key fetchable.
+    def test_exception_is_not_stored(self):
+        table = LookupTable()
+
+        def fail():
+            raise ConnectionError('VPN down')
+
+        with pytest.raises(ConnectionError):
+            table.get_or_fetch('HOS1', fail)
+        assert table.get_or_fetch('HOS1', lambda: 1) == 1
+
+    # Concurrent callers asking for the same key should wait for the request in flight.
+    def test_in_flight_requests_are_coalesced(self):
+        table = LookupTable()
+        release = threading.Event()
+        calls = []
+
+        def slow_fetch():
+            calls.append(1)
+            release.wait(timeout=5)
+            return 1
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(table.get_or_fetch, 'HOS1', slow_fetch) for _ in range(4)]
+            release.set()
+            results = [future.result() for future in futures]
+
+        assert results == [1, 1, 1, 1]
+        assert len(calls) == 1
+
+
+class FakeWM(Session):
+    """WM whose bulk search of the 'MOS2' prefix fails after its retries."""
+
+    def __init__(self):
+        super().__init__()
+        self.fetched = []
+
+    def fetch_bulk(self, query, page_size=100):
+        if query == 'MOS2':
+            raise RetryError('Max retries exceeded')
+        return [WMOrder(f'{query}00{index}', 'IF1', 'SUCCESS', '') for index in range(2)]
+
+    def fetch(self, order_id):
+        self.fetched.append(order_id)
+        return WMOrder(order_id, 'IF2', 'FAIL', 'timeout')
+
+
+class FakeSessions:
+    def __init__(self):
+        self.wm = FakeWM()
+
+
+class TestPrefetchWMOrders:
+
+    # A failed prefix search should leave its orders to the one by one lookups and keep the other prefixes.
+    def test_failed_prefix_search(self):
+        sessions = FakeSessions()
+        lookups = OrderLookups(NullJournal(), sessions)
+        order_ids = ['MOS1000', 'MOS1001', 'MOS2000', 'MOS2001']
+        assert lookups.prefetch_wm_orders(order_ids, prefix_length=4, page_size=100) == 2
+
+        telemetry = RunTelemetry(display=False)
+        orders = lookup_wm_orders(lookups, order_ids, telemetry.add_flow('wm lookups', len(order_ids)))
+        assert sessions.wm.fetched == ['MOS2000', 'MOS2001']
+        assert [orders[order_id].interface_log_ID for order_id in order_ids] == ['SUCCESS', 'SUCCESS', 'FAIL', 'FAIL']
@@ -0,0 +1,73 @@
+import io
+import threading
+
+import pytest
+from requests import Session
+
+from checkpoint import NullJournal
+from lookups import OrderLookups
+from order_list import check_orders, read_order_ids, statuses_to_dataframe
+from wm_portal import WMOrder
+
+
+class FakeResponse:
+    def __init__(self, total_records):
+        self.total_records = total_records
+
+    def json(self):
+        return {'iTotalDisplayRecords': self.total_records}
+
+
+class FakeSwapDeliveryPage:
+    def __init__(self):
+        self.swap_session = Session()
+        self.searched = []
+        self.threads = set()
+
+    def get_order(self, order_id):
+        self.searched.append(order_id)
+        self.threads.add(threading.current_thread().name)
+        return FakeResponse(0 if order_id == 'HOS1002' else 1)
+
+
+class FakeWM(Session):
+    def fetch(self, id):
+        return WMOrder(id, 'IF1', 'FAIL', 'timeout')
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    monkeypatch.setattr('lookups.SwapDeliveryAuthenticatedPage', FakeSwapDeliveryPage)
+    monkeypatch.setattr('lookups.WM', FakeWM)
+    return OrderLookups(NullJournal())
+
+
+class TestReadOrderIds:
+
+    # Blank lines, comments and repeated IDs should be skipped.
+    def test_read(self):
+        source = io.StringIO('1001A1\n\n  MOS1002 \n# recheck\n1001A1\n1003  # from ops\n')
+        assert read_order_ids(source) == ['1001A1', 'MOS1002', '1003']
+
+
+class TestCheckOrders:
+
+    # Orders should be mapped like the report flows and MOS orders also checked in WM.
+    def test_check(self, lookups):
+        statuses = check_orders(lookups, ['1001A1', '1002A2', 'MOS1003'], 'PREPAID')
+        assert [status.swap_id for status in statuses] == ['HOS1001', 'HOS1002', 'MOS1003']
+        assert [status.flown_to_swap for status in statuses] == [True, False, True]
+        assert [status.wm_checked for status in statuses] == [False, False, True]
+        assert statuses[2].wm_order.interface_log_ID == 'FAIL'
+        assert all(thread.startswith('swap') for thread in lookups.swap_delivery_page.threads)
+
+    # Every order should become one row of the report.
+    def test_dataframe(self, lookups):
+        df = statuses_to_dataframe(check_orders(lookups, ['1001A1', 'MOS1003'], 'PREPAID'))
+        assert df['Order_No'].tolist() == ['1001A1', 'MOS1003']
+        assert df['WM_Interface_Status'].isna().tolist() == [True, False]
+
+    # Plan types without a swap ID mapping should be rejected.
+    def test_unknown_plan_type(self, lookups):
+        with pytest.raises(ValueError):
+            check_orders(lookups, ['1001A1'], 'HYBRID')
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from order_records import OrderBatch, WMOrderBatch
+from wm_portal import WMOrder
+
+
+class TestOrderBatch:
+
+    # Prepaid orders should be renamed to start with 'HOS' unless they already start with 'MOS'.
+    def test_prepaid_mapping(self):
+        batch = OrderBatch.from_order_ids(['1001A1', 'MOS2002', '3003'], 'PREPAID')
+        assert list(batch) == [('HOS1001', '1001A1'), ('MOS2002', 'MOS2002'), ('HOS3003', '3003')]
+
+    # Postpaid orders should be renamed to start with 'MOS'.
+    def test_postpaid_mapping(self):
+        batch = OrderBatch.from_order_ids(['1001A1', 'MOS2002'], 'POSTPAID')
+        assert list(batch.swap_ids) == ['MOS1001', 'MOS2002']
+        assert list(batch.original_ids) == ['1001A1', 'MOS2002']
+
+    # An unknown plan type should raise a ValueError.
+    def test_unknown_plan_type(self):
+        with pytest.raises(ValueError):
+            OrderBatch.from_order_ids(['1001'], 'UNKNOWN')
+
+    # Mapping an empty report should return an empty batch.
+    def test_empty_order_ids(self):
+        assert len(OrderBatch.from_order_ids([], 'PREPAID')) == 0
+
+    # Selecting with a boolean mask should return a batch of the same type.
+    def test_mask_selection(self):
+        batch = OrderBatch.from_order_ids(['1', '2', '3'], 'PREPAID')
+        selected = batch[np.array([True, False, True])]
+        assert isinstance(selected, OrderBatch)
+        assert list(selected.original_ids) == ['1', '3']
+
+    # Adding two batches should concatenate their records.
+    def test_concatenation(self):
+        batch = OrderBatch.empty() + OrderBatch.from_order_ids(['1'], 'PREPAID')
+        assert len(batch) == 1
+
+    # The DataFrame should be backed by the batch arrays instead of copies.
+    def test_to_dataframe_without_copy(self):
+        batch = OrderBatch.from_order_ids(['1', '2'], 'PREPAID')
+        df = batch.to_dataframe()
+        assert list(df.columns) == ['swap_id', 'original_id']
+        assert np.shares_memory(df['original_id'].to_numpy(), batch.original_ids)
+
+
+def test_wm_order_batch_from_records():
+    """Test that WM orders are converted into the failed orders dataframe."""
+    orders = [
+        WMOrder('MOS1', 'IF1', 'FAIL', 'error'),
+        WMOrder('MOS2', 'IF2', 'FAIL', 'timeout'),
+    ]
+    df = WMOrderBatch.from_records(orders).to_dataframe()
+    assert list(df.columns) == ['order_ID', 'interface_ID', 'interface_log_ID', 'event_message']
+    assert df['order_ID'].tolist() == ['MOS1', 'MOS2']
@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from filter_dates import FilterDate, FilterDates
+from flows import FlowOrders, ReportInfo
+from order_records import OrderBatch
+from order_status import build_status_table
+from order_validation import ValidationResults
+from reports import Report, ReportType
+from wm_portal import WMOrder
+
+
+@pytest.fixture
+def flows():
+    filter_dates = FilterDates(FilterDate('01/01/2023 00:00'), FilterDate('02/01/2023 00:00'))
+    report = Report(ReportType('PREPAID'), filter_dates, False, dataframe=pd.DataFrame({
+        'Order_No': ['1001A1', '1002A1', '1003A1', 'MOS1004', 'MOS1005', 'MOS1006', '1002A1'],
+        'Order_Delivery_Status': ['new', 'new', 'shipped', 'new', 'new', 'new', 'returned'],
+        'Package_Type': ['SIM'] * 7,
+    }))
+    swap_orders = OrderBatch.from_order_ids(['1001A1', '1002A1', '1003A1'], 'PREPAID')
+    wm_orders = OrderBatch.from_order_ids(['MOS1004', 'MOS1005', 'MOS1006'], 'PREPAID')
+    return [
+        FlowOrders('hotlink prepaid', ReportInfo(ReportType('PREPAID'), []), report.view(), swap_orders),
+        FlowOrders('wm prepaid', ReportInfo(ReportType('PREPAID'), [], 'wm', 'order_no'), report.view(), wm_orders),
+    ]
+
+
+@pytest.fixture
+def status(flows):
+    return build_status_table(
+        flows,
+        swap_total_records={'HOS1001': 1, 'HOS1002': 0, 'HOS1003': -1},
+        wm_orders={'MOS1004': WMOrder('MOS1004', 'IF1', 'FAIL', 'timeout'), 'MOS1005': None,
+                   'MOS1006': WMOrder('MOS1006', 'IF2', 'SUCCESS', '')},
+        unverified_wm_orders={'MOS1005'},
+        cms_columns=('Order_No', 'Order_Delivery_Status'),
+    )
+
+
+class TestStatusTable:
+
+    # Every order should get the state of its backend, its cms attributes and one outcome.
+    def test_states_and_outcomes(self, status):
+        assert status['Order_No'].tolist() == ['1001A1', '1002A1', '1003A1', 'MOS1004', 'MOS1005', 'MOS1006']
+        assert status['swap_state'].tolist()[:3] == ['found', 'not_found', 'error']
+        assert status['wm_state'].tolist()[3:] == ['found', 'error', 'found']
+        assert status['outcome'].tolist() == ['ok', 'not_flown_to_swap', 'unverified', 'wm_failed', 'unverified', 'ok']
+        assert status['Order_Delivery_Status'].tolist()[:3] == ['new', 'new', 'shipped']
+        assert status['detail'].tolist()[3] == 'timeout'
+
+    # Results, sheets included, should all be read from the table.
+    def test_results_from_status(self, status, flows):
+        results = ValidationResults.from_status(status, flows)
+        assert results.orders_not_flown_to_swap.swap_ids.tolist() == ['HOS1002']
+        assert results.wm_failed_orders == [WMOrder('MOS1004', 'IF1', 'FAIL', 'timeout')]
+        assert results.unverified_orders == [('hotlink prepaid', '1003A1'), ('wm prepaid', 'MOS1005')]
+        assert results.order_outcomes[0] == ('hotlink prepaid', '1002A1', 'not_flown_to_swap', None)
+        assert results.dataframes['Hotlink Prepaid Report']['Order_Delivery_Status'].tolist() == ['new', 'returned']
+        assert results.dataframes['wm prepaid']['order_ID'].tolist() == ['MOS1004']
+        assert results.checked_orders == {'hotlink prepaid': 3, 'wm prepaid': 3}
+
+
+def test_empty_status_table():
+    """Test that a run without orders has an empty table and no failures."""
+    status = build_status_table([], {}, {}, set())
+    results = ValidationResults.from_status(status, [])
+    assert len(status) == 0 and results.order_outcomes == [] and results.dataframes == {}
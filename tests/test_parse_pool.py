@@ -0,0 +1,61 @@
+import io
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import order_validation_config
+import parse_pool
+from parse_pool import decode_dataframe, encode_dataframe, get_parse_pool, parse_excel, run_parser
+
+
+def make_report(rows):
+    return pd.DataFrame({
+        'Order_No': [f'{index}A1' for index in range(rows)],
+        'Order_Delivery_Status': (['new', 'fulfilled', np.nan, 'shipped'] * rows)[:rows],
+        'Order_Cancellation_Status': pd.Series([None] * rows, dtype=object),
+        'Quantity': np.arange(rows),
+        'Created': pd.date_range('2023-01-01', periods=rows, freq='min'),
+    })
+
+
+class TestEncodedDataframe:
+
+    # Decoding should give back the parsed dataframe, missing values included.
+    def test_round_trip(self):
+        report = make_report(1000)
+        pd.testing.assert_frame_equal(decode_dataframe(encode_dataframe(report)), report)
+
+    # Repetitive text columns should be sent as small integer codes.
+    def test_repetitive_columns_are_compact(self):
+        report = make_report(10000)[['Order_Delivery_Status']]
+        encoded = encode_dataframe(report)
+        assert encoded[0][2].dtype == np.int8
+        assert len(pickle.dumps(encoded)) < len(pickle.dumps(report)) / 3
+
+
+@pytest.fixture
+def one_parse_process(monkeypatch):
+    """Starts a real parse process for the test and stops it afterwards."""
+    monkeypatch.setattr(order_validation_config, 'PARSE_PROCESSES', 1)
+    yield
+    parse_pool.shutdown_parse_pool()
+
+
+class TestParsePool:
+
+    # Without parse processes everything should be parsed on the calling thread.
+    def test_disabled_by_default(self):
+        assert get_parse_pool() is None
+
+    # Excel exports parsed in a worker process should match the ones parsed in process.
+    def test_parse_excel_in_pool(self, one_parse_process):
+        report = make_report(50)
+        with io.BytesIO() as buffer:
+            report.to_excel(buffer, index=False)
+            content = buffer.getvalue()
+        assert get_parse_pool() is not None
+        parsed = decode_dataframe(run_parser(parse_excel, content))
+        pd.testing.assert_frame_equal(parsed, decode_dataframe(parse_excel(content)))
+        assert parsed['Order_No'].tolist() == report['Order_No'].tolist()
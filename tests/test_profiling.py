@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+from profiling import SpanStats, StageProfiler
+
+
+class TestStageProfiler:
+
+    # Spans should not be recorded until the profiler is enabled.
+    def test_disabled(self):
+        profiler = StageProfiler()
+        with profiler.span('run'):
+            pass
+        assert profiler.stats == {}
+
+    # Nested spans should be recorded under the path of their parents.
+    def test_nested_spans(self):
+        profiler = StageProfiler()
+        profiler.enable()
+        with profiler.span('run'):
+            for _ in range(3):
+                with profiler.span('filter'):
+                    pass
+        assert profiler.stats[('run', )].calls == 1
+        assert profiler.stats[('run', 'filter')].calls == 3
+        assert profiler.stats[('run', )].total_seconds >= profiler.stats[('run', 'filter')].total_seconds
+
+    # Spans started in worker threads and asyncio tasks should nest under the span that started them.
+    def test_concurrent_spans(self):
+        profiler = StageProfiler()
+        profiler.enable()
+
+        async def lookup():
+            with profiler.span('swap request'):
+                await asyncio.sleep(0)
+
+        async def flow():
+            with profiler.span('flow'):
+                await asyncio.gather(*(lookup() for _ in range(5)))
+
+        def worker():
+            with profiler.span('parse'):
+                pass
+
+        with profiler.span('run'):
+            asyncio.run(flow())
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        assert profiler.stats[('run', 'flow', 'swap request')].calls == 5
+        assert profiler.stats[('parse', )].calls == 1
+
+    # Collapsed stacks should hold the self time of each path in microseconds.
+    def test_collapsed_stacks(self):
+        profiler = StageProfiler()
+        profiler.stats[('run', )] = SpanStats(1, 3.0)
+        profiler.stats[('run', 'flow:a')] = SpanStats(1, 2.0)
+        assert profiler.collapsed_stacks() == 'run 1000000\nrun;flow:a 2000000\n'
+        summary = profiler.summary_table()
+        assert 'flow:a' in summary and '66.7%' in summary
+
+    # Writing should create the collapsed stacks and the summary table files.
+    def test_write(self, tmp_path):
+        profiler = StageProfiler()
+        profiler.enable()
+        with profiler.span('run'):
+            pass
+        folded_path, summary_path = profiler.write(tmp_path, 'profile')
+        assert folded_path.name == 'profile.folded'
+        assert summary_path.read_text().startswith('Stage')
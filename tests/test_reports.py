@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+import order_validation_config
+from filter_dates import FilterDate, FilterDates
+from reports import Filter, MemoryBudget, Report, ReportCache, ReportType, get_report, report_cache
+
+
+@pytest.fixture
+def filter_dates():
+    return FilterDates(FilterDate('01/01/2023 00:00'), FilterDate('02/01/2023 00:00'))
+
+
+@pytest.fixture
+def master_report():
+    return pd.DataFrame({
+        'Order_No': ['1001A1', 'MOS1002', '1003', 'MOS1004'],
+        'Fulfillment_Mode': ['Standard Delivery', 'In-Store Pickup', 'Standard Delivery', 'Standard Delivery'],
+        'Order_Delivery_Status': ['pending', 'pending', 'fulfilled', 'pending'],
+    })
+
+
+@pytest.fixture
+def downloaded(master_report):
+    with patch.object(Report, 'download_report', return_value=b''), \
+            patch('reports.excel_buffer_to_dataframe', return_value=master_report) as parse:
+        report_cache.clear()
+        yield parse
+        report_cache.clear()
+
+
+class TestReportView:
+
+    # Filters should narrow the selected rows without changing the base dataframe.
+    def test_filters_select_rows(self, downloaded, filter_dates, master_report):
+        report = get_report(ReportType('PREPAID'), filter_dates, save_to_disk=False)
+        report.filter(Filter('Fulfillment_Mode', 'exists', ('Standard Delivery', )))
+        report.filter(Filter('Order_Delivery_Status', 'notExists', ('fulfilled', )))
+        report.filter(Filter('Order_No', 'contains', ('MOS', )))
+        assert report.column('Order_No').tolist() == ['MOS1004']
+        assert report.dataframe['Order_No'].tolist() == ['MOS1004']
+        assert report.get_filtered_dataframe_by_orderNos(['MOS1004', '1001A1']).index.tolist() == [3]
+        assert len(master_report) == 4
+
+    # Filters applied by one flow should not leak into the report of the next flow.
+    def test_views_are_independent(self, downloaded, filter_dates):
+        first = get_report(ReportType('PREPAID'), filter_dates, save_to_disk=False)
+        first.filter(Filter('Order_No', 'contains', ('MOS', )))
+        second = get_report(ReportType('PREPAID'), filter_dates, save_to_disk=False)
+        assert len(second.column('Order_No')) == 4
+        assert second._base is first._base
+        assert downloaded.call_count == 1
+
+
+class TestReportCache:
+
+    class FakeReport:
+        def __init__(self, name, size):
+            self.name = name
+            self.size = size
+
+        def memory_usage(self):
+            return self.size
+
+    # The least recently used report should be evicted once the cache is full.
+    def test_lru_eviction(self):
+        cache = ReportCache(max_bytes=100)
+        cache.put('a', self.FakeReport('a', 40))
+        cache.put('b', self.FakeReport('b', 40))
+        cache.get('a')
+        cache.put('c', self.FakeReport('c', 40))
+        assert cache.get('b') is None
+        assert cache.get('a') is not None
+        assert cache.current_bytes == 80
+
+    # A report larger than the cache should not be cached at all.
+    def test_oversized_report(self):
+        cache = ReportCache(max_bytes=10)
+        cache.put('a', self.FakeReport('a', 40))
+        assert len(cache) == 0
+
+    # Without a size the cache should be bounded by REPORT_CACHE_MAX_BYTES of the config.
+    def test_configured_size(self, monkeypatch):
+        monkeypatch.setattr(order_validation_config, 'REPORT_CACHE_MAX_BYTES', 50)
+        cache = ReportCache()
+        cache.put('a', self.FakeReport('a', 40))
+        cache.put('b', self.FakeReport('b', 40))
+        assert cache.get('a') is None
+        assert cache.current_bytes == 40
+
+    # Threads sharing the cache, like the service scheduler and requests, should keep its size consistent.
+    def test_shared_between_threads(self):
+        cache = ReportCache(max_bytes=100)
+
+        def use(index):
+            for turn in range(200):
+                cache.put(index % 8, self.FakeReport(str(index), 20))
+                cache.get((index + turn) % 8)
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(use, range(32)))
+        assert len(cache) == 5
+        assert cache.current_bytes == 100
+
+
+class TestMemoryBudget:
+
+    @pytest.fixture
+    def large_report(self):
+        rows = 1000
+        return pd.DataFrame({
+            'Order_No': [f'{100000 + i}A1' for i in range(rows)],
+            'Fulfillment_Mode': ['Standard Delivery', 'In-Store Pickup'] * (rows // 2),
+            'Order_Delivery_Status': ['pending', 'fulfilled', 'cancelled', 'pending'] * (rows // 4),
+            'Customer_Address': [f'{i} Jalan Ampang' for i in range(rows)],
+        })
+
+    # Unused columns should be dropped and low-cardinality columns turned into categoricals.
+    def test_apply(self, large_report):
+        budget = MemoryBudget(keep_columns=('Order_No', 'Fulfillment_Mode', 'Order_Delivery_Status'))
+        compacted = budget.apply(large_report)
+        assert compacted.columns.tolist() == ['Order_No', 'Fulfillment_Mode', 'Order_Delivery_Status']
+        assert isinstance(compacted['Fulfillment_Mode'].dtype, pd.CategoricalDtype)
+        assert not isinstance(compacted['Order_No'].dtype, pd.CategoricalDtype)
+        assert compacted.memory_usage(deep=True).sum() < large_report.memory_usage(deep=True).sum()
+        assert 'Customer_Address' in large_report.columns
+
+    # Filters on a compacted report should select the same orders as on the parsed one.
+    def test_filters_on_compacted_report(self, filter_dates, large_report):
+        budget = MemoryBudget(keep_columns=('Order_No', 'Fulfillment_Mode', 'Order_Delivery_Status'))
+        filters = [
+            Filter('Fulfillment_Mode', 'exists', ('Standard Delivery', )),
+            Filter('Order_Delivery_Status', 'notExists', ('fulfilled', )),
+            Filter('Order_Delivery_Status', 'contains', ('pend', )),
+        ]
+        selected = []
+        for memory_budget in (None, budget):
+            report = Report(ReportType('PREPAID'), filter_dates, False, dataframe=large_report, memory_budget=memory_budget)
+            for filter in filters:
+                report.filter(filter)
+            selected.append(report.column('Order_No').tolist())
+        assert selected[0] == selected[1]
+        assert len(selected[0]) == 250
@@ -0,0 +1,64 @@
+import logging
+
+from requests import ConnectionError, Session
+
+import swap_portal
+from request_log import BackendWindow, RequestLog, percentile, summarize
+
+
+class TestRequestLog:
+
+    # Only one in 'sample_every' successful requests should be logged, every failure is.
+    def test_sampling(self, caplog):
+        request_log = RequestLog(sample_every=10)
+        with caplog.at_level(logging.INFO, logger='request_log'):
+            for index in range(25):
+                request_log.record('swap', 'GET', f'/HOS{index}', 200, 0.1)
+            request_log.record('swap', 'GET', '/HOS99', 503, 0.2)
+            request_log.failed('wm', 'POST', '/MOS1', ConnectionError('refused'))
+        lines = [(record.levelname, record.getMessage()) for record in caplog.records]
+        assert [message.split()[1] for level, message in lines if level == 'INFO'] == ['/HOS0', '/HOS10', '/HOS20']
+        assert ('WARNING', 'GET /HOS99 [status:503 request:0.200s]') in lines
+        assert ('ERROR', "POST /MOS1 failed: ConnectionError('refused')") in lines
+
+    # The summary should give the requests, errors and latency percentiles of every backend once.
+    def test_summary(self, caplog):
+        request_log = RequestLog(sample_every=1000, summary_every=3600)
+        for index in range(100):
+            request_log.record('swap', 'GET', '/HOS', 200 if index else 500, (index + 1) / 100)
+        caplog.clear()
+        with caplog.at_level(logging.INFO, logger='request_log'):
+            request_log.flush()
+            request_log.flush()
+        assert len(caplog.records) == 1
+        assert caplog.records[0].getMessage().startswith(
+            'swap: 100 requests, 1 errors (1 500), latency p50 0.500s p90 0.900s p99 0.990s max 1.000s')
+
+    # Without a summary interval nothing should be aggregated into the log.
+    def test_no_summary_by_default(self, caplog):
+        request_log = RequestLog()
+        with caplog.at_level(logging.INFO, logger='request_log'):
+            request_log.record('cms', 'GET', '/masterreport', 200, 1.5)
+            request_log.flush()
+        assert [record.getMessage() for record in caplog.records] == ['GET /masterreport [status:200 request:1.500s]']
+
+
+def test_swap_lookup_without_response(monkeypatch):
+    """Test that a Swap lookup that gets no response is recorded as a failure and returns None."""
+    request_log = RequestLog()
+    monkeypatch.setattr(swap_portal, 'get_request_log', lambda: request_log)
+    page = object.__new__(swap_portal.SwapDeliveryAuthenticatedPage)
+    page.params = dict(swap_portal.DELIVERY_SEARCH_PARAMS)
+    page.swap_session = Session()
+
+    def refuse(*args, **kwargs):
+        raise ConnectionError('refused')
+    monkeypatch.setattr(page.swap_session, 'get', refuse)
+    assert page.get_order('HOS1001') is None
+    assert request_log.windows['swap'].errors == {'ConnectionError': 1}
+
+
+def test_percentile():
+    """Test that percentiles use the nearest rank."""
+    assert [percentile([1.0, 2.0, 3.0, 4.0], percent) for percent in (25, 50, 99, 100)] == [1.0, 2.0, 4.0, 4.0]
+    assert summarize(BackendWindow()) == '0 requests'
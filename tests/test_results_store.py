@@ -0,0 +1,116 @@
+from contextlib import closing
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+
+import helper
+from filter_dates import FilterDate, FilterDates
+from order_validation import ValidationResults, write_report_diff
+from results_store import ResultsStore, diff_outcomes, format_table, query
+
+
+@pytest.fixture
+def filter_dates():
+    return FilterDates(FilterDate('01/01/2023 00:00'), FilterDate('02/01/2023 00:00'))
+
+
+@pytest.fixture
+def store(tmp_path, filter_dates):
+    store = ResultsStore(tmp_path / 'results.sqlite3')
+    for day, outcomes in ((1, [('hotlink prepaid', '1001A1', 'not_flown_to_swap', None),
+                               ('wm prepaid', 'MOS1002', 'wm_failed', 'timeout')]),
+                          (2, [('hotlink prepaid', '1001A1', 'not_flown_to_swap', None),
+                               ('wm prepaid', 'MOS1002', 'unverified', None)]),
+                          (3, [('hotlink prepaid', '1001A1', 'not_flown_to_swap', None)])):
+        results = ValidationResults(order_outcomes=outcomes, checked_orders={'hotlink prepaid': 10, 'wm prepaid': 4})
+        store.record_run(results, filter_dates, started_at=datetime(2023, 1, day, 9))
+    return store
+
+
+class TestResultsStore:
+
+    # The history of an order should list every run it failed or was unverified in.
+    def test_order_history(self, store):
+        assert store.order_history('MOS1002') == [
+            ('2023-01-01T09:00:00', 'wm prepaid', 'wm_failed', 'timeout'),
+            ('2023-01-02T09:00:00', 'wm prepaid', 'unverified', None),
+        ]
+        assert store.order_history('unknown') == []
+
+    # Repeat failures should count runs, ignore unverified outcomes and honour the start date.
+    def test_repeat_failures(self, store):
+        assert store.repeat_failures(2) == [('1001A1', 3, '2023-01-01', '2023-01-03', 'hotlink prepaid')]
+        assert [row[0] for row in store.repeat_failures(1)] == ['1001A1', 'MOS1002']
+        assert store.repeat_failures(2, since=date(2023, 1, 3)) == []
+
+    # The trend should give the checked and failed orders per day and flow.
+    def test_trend(self, store):
+        assert store.trend(date(2023, 1, 2)) == [
+            ('2023-01-02', 'hotlink prepaid', 10, 1, 0, 0),
+            ('2023-01-02', 'wm prepaid', 4, 0, 0, 1),
+            ('2023-01-03', 'hotlink prepaid', 10, 1, 0, 0),
+            ('2023-01-03', 'wm prepaid', 4, 0, 0, 0),
+        ]
+
+    # Queries on a missing store should read an empty history without creating the file.
+    def test_queries_do_not_create_store(self, tmp_path):
+        store = ResultsStore(tmp_path / 'history' / 'results.sqlite3')
+        assert store.order_history('1001A1') == [] and store.failed_order_nos(date(2023, 1, 1)) == set()
+        assert store.failure_rates(date(2023, 1, 1)) == {}
+        assert not store.path.exists()
+
+    # Order lookups should be answered from the index instead of scanning the table.
+    def test_history_uses_index(self, store):
+        with closing(store.connect()) as connection:
+            plan = connection.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM outcomes WHERE order_no = ?", ('1001A1', )).fetchall()
+        assert 'outcomes_order_no' in str(plan)
+
+    # The previous run should be the last one of the same shard before the run.
+    def test_previous_outcomes(self, store, filter_dates):
+        assert store.previous_outcomes(1) is None
+        assert store.previous_outcomes(3) == [
+            ('hotlink prepaid', '1001A1', 'not_flown_to_swap', None),
+            ('wm prepaid', 'MOS1002', 'unverified', None),
+        ]
+        run_id = store.record_run(ValidationResults(), filter_dates, shard='1/2')
+        assert store.previous_outcomes(run_id, '1/2') is None
+
+    # The query command should print one table per question asked.
+    def test_query(self, store):
+        text = query(history='1001A1', repeat_failures=3, store=store)
+        history, repeat = text.split('\n\n')
+        assert len(history.splitlines()) == 5
+        assert repeat.splitlines()[2].split() == ['1001A1', '3', '2023-01-01', '2023-01-03', 'hotlink', 'prepaid']
+
+
+def test_format_table():
+    """Test that columns are aligned to their widest value."""
+    assert format_table(('A', 'Bee'), [('long', None)]) == 'A     Bee\n----  ---\nlong'
+
+
+def test_diff_outcomes():
+    """Test that orders are split by Order_No into new, resolved, persistent and not checked again."""
+    previous = [('hotlink prepaid', '1001A1', 'not_flown_to_swap', None), ('wm prepaid', 'MOS1002', 'wm_failed', 'x'),
+                ('hotlink prepaid', '1005A1', 'not_flown_to_swap', None)]
+    current = [('hotlink prepaid', '1001A1', 'not_flown_to_swap', None), ('wm prepaid', 'MOS1003', 'unverified', None)]
+    diff = diff_outcomes(previous, current, {'1001A1', 'MOS1002', 'MOS1003'})
+    assert diff.new == [('wm prepaid', 'MOS1003', 'unverified', None)]
+    assert diff.persistent == [('hotlink prepaid', '1001A1', 'not_flown_to_swap', None)]
+    assert diff.resolved == [('wm prepaid', 'MOS1002', 'wm_failed', 'x')]
+    assert diff.not_rechecked == 1
+
+
+def test_write_report_diff(tmp_path, monkeypatch):
+    """Test that the report only holds the new failures and the other changes are written as csv."""
+    monkeypatch.setattr(helper, 'reports_dir', tmp_path)
+    previous = [('hotlink prepaid', '1001A1', 'not_flown_to_swap', None), ('wm prepaid', 'MOS1002', 'wm_failed', 'x')]
+    current = [('hotlink prepaid', '1001A1', 'not_flown_to_swap', None), ('hotlink prepaid', '1003A1', 'not_flown_to_swap', None)]
+    dataframes = {'Hotlink Prepaid Report': pd.DataFrame({'Order_No': ['1001A1', '1003A1'], 'Package_Type': ['SIM'] * 2})}
+    write_report_diff(diff_outcomes(previous, current, {'1001A1', '1003A1', 'MOS1002'}), dataframes)
+
+    new_report = next(tmp_path.glob('*_new.xlsx'))
+    assert pd.read_excel(new_report)['Order_No'].tolist() == ['1003A1']
+    assert pd.read_csv(next(tmp_path.glob('*_resolved.csv')))['Order_No'].tolist() == ['MOS1002']
+    assert pd.read_csv(next(tmp_path.glob('*_persistent.csv')))['Order_No'].tolist() == ['1001A1']
@@ -0,0 +1,106 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+from requests import Session
+
+from http_sessions import BudgetRetry, pooled_adapter
+from order_records import OrderBatch
+from order_validation import ValidationResults, swap_orders_flow_filtering
+from run_budget import RunBudget
+
+
+class UnavailableHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = 0
+
+    def do_GET(self):
+        UnavailableHandler.requests += 1
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def unavailable_url():
+    UnavailableHandler.requests = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), UnavailableHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+class TestRunBudget:
+
+    # Retries should be allowed up to the ratio of the requests sent, but at least min_retries.
+    def test_retry_ratio(self):
+        budget = RunBudget(retry_ratio=0.1, min_retries=2)
+        for _ in range(30):
+            budget.request()
+        assert [budget.allow_retry() for _ in range(4)] == [True, True, True, False]
+        assert (budget.retries, budget.denied_retries) == (3, 1)
+
+    # Without limits every retry is allowed and the budget never expires.
+    def test_unlimited(self):
+        budget = RunBudget()
+        assert all(budget.allow_retry() for _ in range(100))
+        assert not budget.expired()
+
+    # After the deadline no retry is allowed anymore.
+    def test_deadline(self):
+        budget = RunBudget(deadline=0)
+        assert budget.expired()
+        assert not budget.allow_retry()
+
+    # A session watched by an exhausted budget should give up after the first attempt.
+    def test_session_retries_stop_at_budget(self, unavailable_url):
+        session = Session()
+        session.mount('http://', pooled_adapter(1, BudgetRetry(total=3, status_forcelist=(503, ), raise_on_status=False)))
+        budget = RunBudget(retry_ratio=0, min_retries=1)
+        with budget.active():
+            assert session.get(unavailable_url).status_code == 503
+            assert UnavailableHandler.requests == 2
+            assert session.get(unavailable_url).status_code == 503
+            assert UnavailableHandler.requests == 3
+
+    # Runs sharing a session should each count their own retries, an unlimited run is not stopped by another.
+    def test_shared_session_keeps_budgets_apart(self, unavailable_url):
+        session = Session()
+        session.mount('http://', pooled_adapter(1, BudgetRetry(total=2, status_forcelist=(503, ), raise_on_status=False)))
+        exhausted, unlimited = RunBudget(retry_ratio=0, min_retries=0), RunBudget()
+        with exhausted.active():
+            session.get(unavailable_url)
+        assert UnavailableHandler.requests == 1
+        with unlimited.active():
+            session.get(unavailable_url)
+        assert UnavailableHandler.requests == 4
+        assert (exhausted.denied_retries, unlimited.denied_retries) == (1, 0)
+
+
+class TestUnverifiedOrders:
+
+    # Failed swap lookups should be unverified instead of not flown.
+    def test_swap_lookup_failures_are_unverified(self):
+        orders = OrderBatch.from_order_ids(['1001A1', '1002A1', '1003A1'], 'PREPAID')
+        responses = [{'iTotalDisplayRecords': total} for total in (1, 0, -1)]
+        flows = swap_orders_flow_filtering(responses, orders)
+        assert flows['found'].original_ids.tolist() == ['1001A1']
+        assert flows['not_found'].original_ids.tolist() == ['1002A1']
+        assert flows['unverified'].original_ids.tolist() == ['1003A1']
+
+    # Unverified orders of every flow should share one sheet and be part of the summary.
+    def test_unverified_sheet(self):
+        results = ValidationResults()
+        results.add_unverified('hotlink prepaid', ['1003A1'])
+        results.add_unverified('wm prepaid', [])
+        results.add_unverified('wm prepaid', ['MOS1A1'])
+        assert results.dataframes['unverified'].values.tolist() == [['hotlink prepaid', '1003A1'], ['wm prepaid', 'MOS1A1']]
+        assert results.summary()['unverified_orders'] == [
+            {'flow': 'hotlink prepaid', 'order_no': '1003A1'},
+            {'flow': 'wm prepaid', 'order_no': 'MOS1A1'},
+        ]
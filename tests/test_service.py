@@ -0,0 +1,151 @@
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pandas as pd
+import pytest
+from requests import Session
+
+import reports
+import service
+from filter_dates import FilterDate, FilterDates
+from lookups import PortalSessions
+from order_validation import ValidationResults
+from reports import Report, ReportType, get_report
+from service import ServiceHTTPServer, ValidationService
+from wm_portal import WMOrder
+
+
+class FakeResponse:
+    def __init__(self, total_records):
+        self.total_records = total_records
+
+    def __bool__(self):
+        return True
+
+    def json(self):
+        return {'iTotalDisplayRecords': self.total_records}
+
+
+class FakeSwapDeliveryPage:
+    logins = 0
+    closed = 0
+
+    def __init__(self):
+        self.swap_session = Session()
+        self.swap_session.close = self.close
+        FakeSwapDeliveryPage.logins += 1
+
+    def close(self):
+        FakeSwapDeliveryPage.closed += 1
+
+    def get_order(self, order_id):
+        return FakeResponse(0 if order_id == 'HOS1002' else 1)
+
+
+class FakeWM(Session):
+    def fetch(self, id):
+        return WMOrder(id, 'IF1', 'FAIL', 'timeout')
+
+
+@pytest.fixture
+def fake_portals(monkeypatch):
+    FakeSwapDeliveryPage.logins = 0
+    FakeSwapDeliveryPage.closed = 0
+    monkeypatch.setattr('lookups.SwapDeliveryAuthenticatedPage', FakeSwapDeliveryPage)
+    monkeypatch.setattr('lookups.WM', FakeWM)
+
+
+@pytest.fixture
+def base_url(fake_portals, monkeypatch):
+    monkeypatch.setattr(service, 'order_processing', lambda *args, **kwargs: ValidationResults())
+    server = ServiceHTTPServer(('127.0.0.1', 0), ValidationService())
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+def get_json(url, data=None):
+    with urlopen(Request(url, data=data, method='POST' if data is not None else 'GET'), timeout=5) as response:
+        return json.loads(response.read())
+
+
+class TestValidationService:
+
+    # Order checks should map the order ID like the report flows and share one login.
+    def test_check_order(self, fake_portals):
+        validation_service = ValidationService()
+        assert validation_service.check_order('1002A1', 'PREPAID') == {
+            'order_no': '1002A1', 'swap_id': 'HOS1002', 'flown_to_swap': False,
+        }
+        status = validation_service.check_order('MOS1004', 'PREPAID')
+        assert status['flown_to_swap'] is True
+        assert status['wm']['interface_log_ID'] == 'FAIL'
+        assert FakeSwapDeliveryPage.logins == 1
+
+    # Every validation of a window should download its reports again, for the current statuses.
+    def test_reports_downloaded_every_run(self, fake_portals, monkeypatch):
+        downloads = []
+        monkeypatch.setattr(Report, 'download_report', lambda report: downloads.append(report.name) or b'')
+        monkeypatch.setattr(reports, 'excel_buffer_to_dataframe', lambda content: pd.DataFrame({'Order_No': ['1001A1']}))
+
+        def order_processing(filter_dates, save_fetched_reports, sessions):
+            get_report(ReportType('PREPAID'), filter_dates, save_fetched_reports)
+            get_report(ReportType('PREPAID'), filter_dates, save_fetched_reports)
+            return ValidationResults()
+        monkeypatch.setattr(service, 'order_processing', order_processing)
+
+        validation_service = ValidationService()
+        filter_dates = FilterDates(FilterDate('01/01/2023 00:00'), FilterDate('02/01/2023 00:00'))
+        validation_service.validate_window(filter_dates)
+        validation_service.validate_window(filter_dates)
+        assert len(downloads) == 2
+        reports.report_cache.clear()
+
+    # Sessions older than their maximum age should be logged in again and the replaced one closed.
+    def test_expired_sessions(self, fake_portals):
+        sessions = PortalSessions(max_age=0)
+        first = sessions.swap_delivery_page
+        assert FakeSwapDeliveryPage.closed == 0
+        assert sessions.swap_delivery_page is not first
+        assert FakeSwapDeliveryPage.logins == 2
+        assert FakeSwapDeliveryPage.closed == 1
+
+
+class TestServiceAPI:
+
+    # The order endpoint should answer with the status of the order.
+    def test_order_endpoint(self, base_url):
+        status = get_json(f'{base_url}/orders/1001A1?plan=prepaid')
+        assert status == {'order_no': '1001A1', 'swap_id': 'HOS1001', 'flown_to_swap': True}
+
+    # The validate endpoint should answer with the failed orders of the window.
+    def test_validate_endpoint(self, base_url):
+        body = json.dumps({'start': '01/01/2023 00:00', 'end': '02/01/2023 00:00'}).encode()
+        assert get_json(f'{base_url}/validate', body) == {
+            'orders_not_flown_to_swap': [], 'wm_failed_orders': [], 'unverified_orders': [],
+        }
+
+    # A portal login failing during an order check should be answered as a bad gateway.
+    def test_order_endpoint_login_failure(self, base_url, monkeypatch):
+        def failed_login():
+            raise SystemExit('Login failed')
+        monkeypatch.setattr('lookups.SwapDeliveryAuthenticatedPage', failed_login)
+        with pytest.raises(HTTPError) as error:
+            get_json(f'{base_url}/orders/1001A1')
+        assert error.value.code == 502
+        assert json.loads(error.value.read()) == {'error': 'Login failed'}
+
+    # Malformed windows and unknown plan types should be rejected as bad requests.
+    @pytest.mark.parametrize('path, data', [
+        ('/validate', b'{"start": "2023-01-01"}'),
+        ('/validate', b'{"start": "02/01/2023 00:00", "end": "01/01/2023 00:00"}'),
+        ('/orders/1001A1?plan=HYBRID', None),
+    ])
+    def test_bad_requests(self, base_url, path, data):
+        with pytest.raises(HTTPError) as error:
+            get_json(f'{base_url}{path}', data)
+        assert error.value.code == 400
@@ -0,0 +1,69 @@
+from pathlib import Path
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from sharding import Shard, ShardError, merge_shard_results, write_shard_results
+
+
+class TestShard:
+
+    # Parsing 'index/count' should return the matching shard.
+    def test_parse(self):
+        assert Shard.parse('2/8') == Shard(2, 8)
+
+    # Shards outside of the count or malformed text should raise a ShardError.
+    @pytest.mark.parametrize('text', ['0/8', '9/8', '2', 'a/b'])
+    def test_parse_invalid(self, text):
+        with pytest.raises(ShardError):
+            Shard.parse(text)
+
+    # Every order should belong to exactly one shard.
+    def test_masks_partition_orders(self):
+        order_ids = [f'{1000 + i}A1' for i in range(200)]
+        masks = [Shard(index, 4).mask(order_ids) for index in range(1, 5)]
+        assert (sum(mask.astype(int) for mask in masks) == 1).all()
+        assert all(mask.any() for mask in masks)
+
+
+class TestMergeShardResults:
+
+    # Partial results of every shard should be concatenated per sheet.
+    def test_merge(self, tmp_path):
+        write_shard_results({'A': pd.DataFrame({'Order_No': ['1']})}, Shard(1, 2), 'run', tmp_path)
+        write_shard_results({'A': pd.DataFrame({'Order_No': ['2']}), 'B': pd.DataFrame({'Order_No': ['3']})},
+                            Shard(2, 2), 'run', tmp_path)
+        merged = merge_shard_results('run', tmp_path)
+        assert merged['A']['Order_No'].tolist() == ['1', '2']
+        assert merged['B']['Order_No'].tolist() == ['3']
+
+    # Merging before every shard finished should raise a ShardError.
+    def test_missing_shard(self, tmp_path):
+        write_shard_results({}, Shard(1, 3), 'run', tmp_path)
+        with pytest.raises(ShardError, match='2/3, 3/3'):
+            merge_shard_results('run', tmp_path)
+
+    # Sheets should keep their names, text IDs and column types through the CSV files of a shard.
+    def test_round_trip(self, tmp_path):
+        df = pd.DataFrame({
+            'Order_No': ['0012', '2'],
+            'Total_Amount': [1.5, None],
+            'Order_Created_Date': pd.to_datetime(['2023-01-01 10:00', None]),
+        })
+        path = write_shard_results({'Hotlink Prepaid Report': df}, Shard(1, 1), 'run', tmp_path)
+        assert not list(path.glob('*.pkl'))
+        merged = merge_shard_results('run', tmp_path)['Hotlink Prepaid Report']
+        assert merged['Order_No'].tolist() == ['0012', '2']
+        assert merged['Total_Amount'].dtype == 'float64'
+        assert merged['Order_Created_Date'].dtype == df['Order_Created_Date'].dtype
+        assert merged['Total_Amount'].isna().tolist() == [False, True]
+
+    # A merge that cannot complete should end the command with its message instead of a traceback.
+    def test_merge_error_from_command_line(self, tmp_path):
+        run = Path(__file__).parent.parent / 'run.py'
+        process = subprocess.run([sys.executable, str(run), '--merge-shards'], cwd=tmp_path, capture_output=True,
+                                 text=True, timeout=60)
+        assert process.returncode == 2
+        assert 'error: No shard results found' in process.stderr and 'Traceback' not in process.stderr
@@ -0,0 +1,87 @@
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+import async_portals
+from telemetry import RetryCounter, RunTelemetry
+
+
+class TestRunTelemetry:
+
+    # Requests should be counted per backend, failed ones also as errors.
+    def test_requests(self):
+        telemetry = RunTelemetry(display=False)
+        with telemetry.request('swap'):
+            assert telemetry.backends['swap'].in_flight == 1
+        with telemetry.request('swap') as outcome:
+            outcome.ok = False
+        with pytest.raises(ConnectionError):
+            with telemetry.request('wm'):
+                raise ConnectionError('VPN down')
+        snapshot = telemetry.snapshot()
+        assert snapshot['backends']['swap']['requests'] == 2
+        assert snapshot['backends']['swap']['errors'] == 1
+        assert snapshot['backends']['swap']['in_flight'] == 0
+        assert snapshot['backends']['wm']['errors'] == 1
+
+    # Progress of every flow should add up to the orders of the run with an ETA.
+    def test_progress(self):
+        telemetry = RunTelemetry(display=False)
+        first = telemetry.add_flow('hotlink prepaid', 4)
+        telemetry.add_flow('wm prepaid', 6)
+        for _ in range(4):
+            first.update()
+        snapshot = telemetry.snapshot()
+        assert (snapshot['orders_done'], snapshot['orders_total']) == (4, 10)
+        assert snapshot['eta_seconds'] is not None
+        assert '4/10 orders' in telemetry.status_text(snapshot)
+
+    # The structured log should get a line when due and a final line on close.
+    def test_structured_log(self, tmp_path):
+        log_path = tmp_path / 'telemetry' / 'run.jsonl'
+        with RunTelemetry(log_path=log_path, log_every=0, display=False) as telemetry:
+            telemetry.add_flow('hotlink prepaid', 1).update()
+        lines = [json.loads(line) for line in log_path.read_text().splitlines()]
+        assert [line['final'] for line in lines] == [False, True]
+        assert lines[-1]['flows'] == {'hotlink prepaid': {'done': 1, 'total': 1}}
+
+    # Retries made by urllib3 should be counted from the response history, redirects excluded.
+    def test_retry_counter(self):
+        telemetry = RunTelemetry(display=False)
+        session = Session()
+        telemetry.watch_session('swap', session)
+        telemetry.watch_session('swap', session)
+        assert len(session.hooks['response']) == 1
+        history = (SimpleNamespace(redirect_location=None), SimpleNamespace(redirect_location='/login'))
+        with telemetry.request('swap'):
+            RetryCounter('swap')(SimpleNamespace(raw=SimpleNamespace(retries=SimpleNamespace(history=history))))
+        assert telemetry.backends['swap'].retries == 1
+
+    # Runs sharing a session, like the scheduled and ad-hoc runs of the service, should count their own retries.
+    def test_shared_session_counts_retries_per_run(self, fake_portals):
+        fake_portals.unavailable_once = {'/scheduled', '/ad-hoc'}
+        session = Session()
+        session.mount('http://', HTTPAdapter(max_retries=Retry(total=2, backoff_factor=0, status_forcelist=(503, ))))
+        scheduled, ad_hoc = RunTelemetry(display=False), RunTelemetry(display=False)
+        scheduled.watch_session('wm', session)
+        ad_hoc.watch_session('wm', session)
+        started, release = threading.Event(), threading.Event()
+
+        def scheduled_run():
+            with scheduled.request('wm'):
+                started.set()
+                release.wait(timeout=5)
+                session.get(f'{async_portals.WM_BASE_URL}/scheduled')
+        thread = threading.Thread(target=scheduled_run)
+        thread.start()
+        started.wait(timeout=5)
+        with ad_hoc.request('wm'):
+            session.get(f'{async_portals.WM_BASE_URL}/ad-hoc')
+        release.set()
+        thread.join()
+        assert (scheduled.backends['wm'].retries, ad_hoc.backends['wm'].retries) == (1, 1)
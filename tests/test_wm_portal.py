@@ -0,0 +1,59 @@
+from wm_portal import WMOrder, group_by_prefix, match_wm_orders, order_details_page_form, parse_last_order_row, parse_order_rows
+
+
+def make_table(*rows):
+    cells = ''.join(
+        '<tr>' + ''.join(f'<td>{cell}</td>' for cell in ('', '', order_id, '', interface, status, message)) + '</tr>'
+        for order_id, interface, status, message in rows
+    )
+    return f'<html><body><table><tbody>{cells}</tbody></table></body></html>'
+
+
+def test_parse_order_rows():
+    """Test that every row of the order details table is parsed."""
+    html = make_table(('MOS1', 'IF1', 'FAIL', 'error'), ('MOS2', 'IF2', 'SUCCESS', ''))
+    assert parse_order_rows(html) == [
+        WMOrder('MOS1', 'IF1', 'FAIL', 'error'),
+        WMOrder('MOS2', 'IF2', 'SUCCESS', ''),
+    ]
+
+
+def test_parse_order_rows_empty_page():
+    """Test that a page without a table body has no orders."""
+    assert parse_order_rows('<html><body></body></html>') == []
+
+
+def test_match_wm_orders_keeps_last_row():
+    """Test that only requested orders are matched, keeping their last row like WM.fetch."""
+    rows = [
+        WMOrder('MOS1', 'IF1', 'FAIL', 'first try'),
+        WMOrder('MOS3', 'IF1', 'SUCCESS', ''),
+        WMOrder('MOS1', 'IF1', 'SUCCESS', 'retried'),
+    ]
+    matched = match_wm_orders(['MOS1', 'MOS2'], rows)
+    assert matched == {'MOS1': WMOrder('MOS1', 'IF1', 'SUCCESS', 'retried')}
+
+
+def test_order_details_page_form():
+    """Test that the paging fields of the order details form are set."""
+    form = order_details_page_form({'jsfwmp7517:defaultForm': 'token'}, 'MOS123', first=200, rows=3)
+    assert form['jsfwmp7517:defaultForm'] == 'token'
+    assert form['jsfwmp7517:defaultForm:htmlInputText'] == 'MOS123'
+    assert form['jsfwmp7517:defaultForm:asyncTable__first'] == '200'
+    assert form['jsfwmp7517:defaultForm:asyncTable__rows'] == '3'
+    assert form['jsfwmp7517:defaultForm:asyncTable__update'] == '__row0,__row1,__row2'
+
+
+def test_group_by_prefix():
+    """Test that order IDs are grouped by their prefix."""
+    assert group_by_prefix(['MOS1231', 'MOS1232', 'MOS4561'], 6) == {
+        'MOS123': ['MOS1231', 'MOS1232'],
+        'MOS456': ['MOS4561'],
+    }
+
+
+def test_parse_last_order_row():
+    """Test that only the last row of the order details table is kept."""
+    html = make_table(('MOS1', 'IF1', 'FAIL', 'error'), ('MOS1', 'IF2', 'SUCCESS', ''))
+    assert parse_last_order_row(html) == WMOrder('MOS1', 'IF2', 'SUCCESS', '')
+    assert parse_last_order_row('<html><body></body></html>') is None
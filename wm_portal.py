@@ -2,14 +2,19 @@ from dataclasses import dataclass
 import os
 from pathlib import Path
 import re
+from collections.abc import Iterable
+from typing import Optional
 from bs4 import BeautifulSoup
 from requests import HTTPError, Session
-from requests.adapters import HTTPAdapter
 from requests.compat import urljoin
 from dotenv import load_dotenv
-from urllib3 import Retry
 
+from http_sessions import RETRY_STATUSES, BudgetRetry, TimeoutHTTPAdapter, pooled_adapter
 from loggerfactory import LoggerFactory
+from order_validation_config import POOL_BLOCK, WM_POOL_SIZE
+from parse_pool import parse_order_table, run_parser
+from profiling import profiler
+from request_log import get_request_log
 
 load_dotenv(Path().joinpath(os.path.expanduser('~'), '.env'))
 logger = LoggerFactory.get_logger(__name__)
@@ -20,8 +25,59 @@ LOGIN_ENDPOINT = '/user.current.start.page'
 INITIALIZATION_ENDPOINT = '/opf.orderdetails'
 ORDER_DETAILS_ENDPOINT = '/meta/default/maxis_opf_support___opfdetails/0000007517'
 
-
-@dataclass
+SESSION_HEADERS = {
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'Origin': BASE_URL,
+    'Pragma': 'no-cache',
+    'Upgrade-Insecure-Requests': '1',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.0.0 Safari/537.36',
+}
+
+LOGIN_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'Referer': f'{BASE_URL}/',
+}
+
+ORDER_DETAILS_HEADERS = {
+    'Accept': 'text/javascript, text/html, application/xml, text/xml, */*',
+    'Content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
+    'Referer': urljoin(BASE_URL, INITIALIZATION_ENDPOINT),
+    'X-Prototype-Version': '1.7.1',
+    'X-Requested-With': 'XMLHttpRequest',
+}
+
+ORDER_DETAILS_FORM = {
+    'jsfwmp7517:defaultForm': '',
+    'jsfwmp7517:defaultForm:htmlInputText': '',
+    'jsfwmp7517:defaultForm:asyncTable__update': '__row0,__row1,__row2,__row3,__row4,__row5',
+    'jsfwmp7517:defaultForm:asyncTable__firstByID': '',
+    'jsfwmp7517:defaultForm:asyncTable__first': '0',
+    'jsfwmp7517:defaultForm:asyncTable__rows': '10',
+    'javax.faces.ViewState': '',
+    '__forms': 'jsfwmp7517:defaultForm',
+    '__fc': 'jsfwmp7517:defaultForm:button',
+    '__vf': 'jsfwmp7517:defaultForm',
+    'wms.layout': 'tabulaRasa',
+    'wms.portlet': ORDER_DETAILS_ENDPOINT,
+    'wms.hiddenRequest': 'true',
+    'wms.shell': 'shell.blank',
+    'wms.replaceForNextUrl': 'hiddenRequest=&shell=&layout=&portlet='
+}
+
+ORDER_DETAILS_PARAMS = (
+    ('wmp_tc', '7517'),
+    ('wmp_rt', 'action'),
+    ('wmp_tv', '/OpfDetails/default.view'),
+    ('__ns', 'wmp7517'),
+)
+
+FORM_TOKEN_PATTERN = re.compile(r'var axsrft = "(.*?)";.*?')
+
+
+@dataclass(slots=True)
 class WMOrder:
     order_ID: str
     interface_ID: str
@@ -40,6 +96,7 @@ class WM(Session):
         total (int, optional): :obj:`Retry` total value. Defaults to 4.
         backoff_factor (int, optional): :obj:`Retry` backoff_factor value.
             Defaults to 30.
+        pool_size (int, optional): Connections kept to WM. Defaults to WM_POOL_SIZE.
 
     Usage::
 
@@ -47,7 +104,7 @@ class WM(Session):
 
       wm = WM()
     """
-    def __init__(self, timeout=30, total=4, backoff_factor=30):
+    def __init__(self, timeout=30, total=4, backoff_factor=30, pool_size=WM_POOL_SIZE):
         """
         WM client consutructor.
 
@@ -59,25 +116,20 @@ class WM(Session):
             total (int, optional): :obj:`Retry` total value. Defaults to 4.
             backoff_factor (int, optional): :obj:`Retry` backoff_factor value.
                 Defaults to 30.
+            pool_size (int, optional): Connections kept to WM. Defaults to WM_POOL_SIZE.
         """
         super().__init__()
-        self.headers = {
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'Origin': BASE_URL,
-            'Pragma': 'no-cache',
-            'Upgrade-Insecure-Requests': '1',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.0.0 Safari/537.36',
-        }
+        self.headers = dict(SESSION_HEADERS)
 
-        adapter = TimeoutHTTPAdapter(
-            timeout=timeout,
-            max_retries=Retry(
+        adapter = pooled_adapter(
+            pool_size,
+            BudgetRetry(
                 total=total,
                 backoff_factor=backoff_factor,
-                status_forcelist=[429, 500, 502, 503, 504],
+                status_forcelist=RETRY_STATUSES,
             ),
+            timeout=timeout,
+            block=POOL_BLOCK,
         )
         self.mount('http://', adapter)
         self.mount('https://', adapter)
@@ -88,12 +140,7 @@ class WM(Session):
 
     def login(self):
         """Perform authentication and store cookies in session."""
-        headers = {
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Referer': f'{BASE_URL}/',
-        }
-        self.headers.update(headers)
+        self.headers.update(LOGIN_HEADERS)
         data = {
             'username': os.environ['secretUser'],
             'password': os.environ['wmPassword']
@@ -109,71 +156,68 @@ class WM(Session):
 
     def initialize(self):
         """Initialize the data, headers and parms to fetch order details."""
-        self.data = {
-            'jsfwmp7517:defaultForm': '',
-            'jsfwmp7517:defaultForm:htmlInputText': '',
-            'jsfwmp7517:defaultForm:asyncTable__update': '__row0,__row1,__row2,__row3,__row4,__row5',
-            'jsfwmp7517:defaultForm:asyncTable__firstByID': '',
-            'jsfwmp7517:defaultForm:asyncTable__first': '0',
-            'jsfwmp7517:defaultForm:asyncTable__rows': '10',
-            'javax.faces.ViewState': '',
-            '__forms': 'jsfwmp7517:defaultForm',
-            '__fc': 'jsfwmp7517:defaultForm:button',
-            '__vf': 'jsfwmp7517:defaultForm',
-            'wms.layout': 'tabulaRasa',
-            'wms.portlet': ORDER_DETAILS_ENDPOINT,
-            'wms.hiddenRequest': 'true',
-            'wms.shell': 'shell.blank',
-            'wms.replaceForNextUrl': 'hiddenRequest=&shell=&layout=&portlet='
-        }
+        self.data = dict(ORDER_DETAILS_FORM)
 
         logger.info("Fetching form data jsfwmp7517:defaultForm...")
         response = self.get(INITIALIZATION_ENDPOINT)
-        pattern = re.compile(r'var axsrft = "(.*?)";.*?')
-
-        soup = BeautifulSoup(response.content, 'lxml')
-        scripts = soup.find_all('script', string=pattern)
-        default_form_data = pattern.search(scripts[0].string).group(1)
+        default_form_data = parse_form_token(response.content)
         logger.info(f"Received: {default_form_data}")
         self.data.update({'jsfwmp7517:defaultForm': default_form_data})
 
-        self.headers.update({
-            'Accept': 'text/javascript, text/html, application/xml, text/xml, */*',
-            'Content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
-            'Referer': urljoin(BASE_URL, INITIALIZATION_ENDPOINT),
-            'X-Prototype-Version': '1.7.1',
-            'X-Requested-With': 'XMLHttpRequest',
-        })
-
-        self.params = (
-            ('wmp_tc', '7517'),
-            ('wmp_rt', 'action'),
-            ('wmp_tv', '/OpfDetails/default.view'),
-            ('__ns', 'wmp7517'),
-        )
+        self.headers.update(ORDER_DETAILS_HEADERS)
+
+        self.params = ORDER_DETAILS_PARAMS
 
     def fetch(self, id: str):
         """Fetches order details for a order by its ID."""
-        self.data.update({'jsfwmp7517:defaultForm:htmlInputText': id})
+        data = {**self.data, 'jsfwmp7517:defaultForm:htmlInputText': id}
         response = self.post(
             ORDER_DETAILS_ENDPOINT,
-            data=self.data,
+            data=data,
             params=self.params,
         )
-        logger.info(f"{response.request.method} /{id} [status:{response.status_code} request:{response.elapsed.total_seconds():.3f}s]")
-        soup = BeautifulSoup(response.text, 'lxml')
-        tbody = soup.find('tbody')
-        try:
-            last_row = tbody.find_all('tr')[-1]
-            tds = last_row.find_all('td')
-            order_id = tds[2].text
-            interface_id = tds[4].text
-            order_status = tds[5].text
-            msg = tds[6].text
-        except IndexError:
-            logger.error("Something went wrong, possible table was empty")
-            return None
-        return WMOrder(order_id, interface_id, order_status, msg)
+        get_request_log().record('wm', response.request.method, f'/{id}', response.status_code,
+                                 response.elapsed.total_seconds())
+        return parse_last_order_row(response.text)
+
+    def fetch_page(self, query: str, first: int = 0, rows: int = 100) -> list[WMOrder]:
+        """
+        Fetches one page of the order details table for a search, e.g. an
+        order ID prefix or an interface ID.
+
+        Args:
+            query (str): Text searched in the order details form.
+            first (int, optional): Index of the first row of the page. Defaults to 0.
+            rows (int, optional): Number of rows per page. Defaults to 100.
+        """
+        response = self.post(
+            ORDER_DETAILS_ENDPOINT,
+            data=order_details_page_form(self.data, query, first, rows),
+            params=self.params,
+        )
+        get_request_log().record('wm', response.request.method, f'/{query}[{first}:{first + rows}]',
+                                 response.status_code, response.elapsed.total_seconds())
+        return parse_order_rows(response.text)
+
+    def fetch_bulk(self, query: str, page_size: int = 100, max_pages: int = 100) -> list[WMOrder]:
+        """
+        Fetches every row of the order details table for a search by walking
+        its pages until a page comes back short.
+        """
+        orders: list[WMOrder] = []
+        previous_page: list[WMOrder] = []
+        for page in range(max_pages):
+            rows = self.fetch_page(query, first=page * page_size, rows=page_size)
+            if rows == previous_page:
+                # The table ignored the paging fields and returned the same rows again.
+                break
+            orders.extend(rows)
+            if len(rows) < page_size:
+                break
+            previous_page = rows
+        else:
+            logger.warning(f"Stopped fetching '{query}' after {max_pages} pages of {page_size} rows.")
+        return orders
 
     def request(self, method, path, *args, **kwargs):
         """
@@ -203,23 +247,58 @@ class WM(Session):
         return response
 
 
-class TimeoutHTTPAdapter(HTTPAdapter):
-    def __init__(self, timeout, *args, **kwargs):
-        """
-        TimeoutHTTPAdapter constructor.
+def parse_form_token(content) -> str:
+    """Returns the axsrft token of the order details form from the initialization page."""
+    soup = BeautifulSoup(content, 'lxml')
+    scripts = soup.find_all('script', string=FORM_TOKEN_PATTERN)
+    return FORM_TOKEN_PATTERN.search(scripts[0].string).group(1)
 
-        Args:
-            timeout (int): How many seconds to wait for the server to send
-            data before giving up.
-        """
-        self.timeout = timeout
-        super().__init__(*args, **kwargs)
+
+@profiler.timed('wm parse')
+def parse_last_order_row(html) -> Optional[WMOrder]:
+    """Returns the order in the last row of the order details table or None if it is empty."""
+    # Parsed here, one small page costs more to send to the parse pool and back than to parse.
+    rows = parse_order_table(html, True)
+    if not rows:
+        logger.error("Something went wrong, possible table was empty")
+        return None
+    return WMOrder(*rows[-1])
+
+
+@profiler.timed('wm parse')
+def parse_order_rows(html) -> list[WMOrder]:
+    """Returns the orders in every row of the order details table."""
+    return [WMOrder(*row) for row in run_parser(parse_order_table, html)]
+
+
+def order_details_page_form(data: dict, query: str, first: int, rows: int) -> dict:
+    """Returns the order details form asking for 'rows' rows starting at 'first' for a search."""
+    return {
+        **data,
+        'jsfwmp7517:defaultForm:htmlInputText': query,
+        'jsfwmp7517:defaultForm:asyncTable__update': ','.join(f'__row{row}' for row in range(rows)),
+        'jsfwmp7517:defaultForm:asyncTable__first': str(first),
+        'jsfwmp7517:defaultForm:asyncTable__rows': str(rows),
+    }
+
+
+def match_wm_orders(order_ids: Iterable[str], rows: Iterable[WMOrder]) -> dict[str, WMOrder]:
+    """
+    Matches the rows of bulk queries to the order IDs, keeping the last row of
+    each order like :meth:`WM.fetch` does.
+    """
+    wanted = set(order_ids)
+    matched: dict[str, WMOrder] = {}
+    for order in rows:
+        if order.order_ID in wanted:
+            matched[order.order_ID] = order
+    return matched
 
 
-    def send(self, request, **kwargs):
-        """Override :obj:`HTTPAdapter` send method to add a default timeout."""
-        timeout = kwargs.get("timeout")
-        if timeout is None:
-            kwargs["timeout"] = self.timeout
+def group_by_prefix(order_ids: Iterable[str], prefix_length: int) -> dict[str, list[str]]:
+    """Groups order IDs by their first 'prefix_length' characters."""
+    groups: dict[str, list[str]] = {}
+    for order_id in order_ids:
+        groups.setdefault(order_id[:prefix_length], []).append(order_id)
+    return groups
 
-        return super().send(request, **kwargs)